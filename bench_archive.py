@@ -0,0 +1,73 @@
+"""Benchmark the run archive over simulated daily runs
+
+Writes daily run directories with bench_stats' market simulation, adds them
+to an archive one by one and reports the disk used and bytes written against
+keeping every run directory, then times rebuilding a run and looking up
+single MLS numbers' histories, checking that every rebuilt run is identical.
+
+    python bench_archive.py --runs 365 --active 2000
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from bench_stats import simulate
+from zealty_archive import Archive
+
+def du(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=365)
+    parser.add_argument("--active", type=int, default=2000, help="listings for sale on any day")
+    parser.add_argument("--lookups", type=int, default=10000)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="zealty-archive-bench-")
+    try:
+        data = os.path.join(root, "data")
+        simulate(data, args.runs, args.active)
+        run_dirs = sorted(d.path for d in os.scandir(data))
+        archive = Archive(os.path.join(root, "archive"))
+        written, seconds = [], []
+        for run_dir in run_dirs:
+            started = time.perf_counter()
+            manifest = archive.add_run(run_dir)
+            seconds.append(time.perf_counter() - started)
+            written.append(manifest["written_bytes"])
+
+        original = du(data)
+        archived = du(archive.path)
+        per_run = original / len(run_dirs)
+        steady = written[1:] or written
+        print(f"{len(run_dirs)} runs, {manifest['rows']} rows in the last, {archive.count} distinct row versions\n")
+        print(f"{'run directories':<34} {original / 1e6:>9.1f} MB")
+        print(f"{'archive':<34} {archived / 1e6:>9.1f} MB  ({original / archived:.0f}x smaller)")
+        print(f"{'written per run, directory':<34} {per_run / 1e6:>9.2f} MB")
+        print(f"{'written per run, archive':<34} {sum(steady) / len(steady) / 1e6:>9.3f} MB  "
+              f"({per_run * len(steady) / sum(steady):.0f}x less)")
+        print(f"{'add one run':<34} {sum(seconds[1:]) / max(1, len(seconds) - 1) * 1000:>9.0f} ms")
+
+        archive = Archive(archive.path)
+        started = time.perf_counter()
+        for run_dir in run_dirs[-10:]:
+            assert archive.verify(os.path.basename(run_dir), run_dir), f"{run_dir} doesn't rebuild identically"
+        print(f"{'rebuild and check one run':<34} {(time.perf_counter() - started) * 100:>9.0f} ms")
+
+        keys = list({archive.record(row_id)[5] for row_id in range(archive.count)})
+        rng = random.Random(1)
+        picks = [rng.choice(keys).rstrip(b"\0").decode() for _ in range(args.lookups)]
+        started = time.perf_counter()
+        versions = sum(len(archive.history(mls)) for mls in picks)
+        elapsed = time.perf_counter() - started
+        print(f"{'history of one MLS number':<34} {elapsed * 1e6 / len(picks):>9.1f} us  "
+              f"({versions / len(picks):.1f} versions on average)")
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    main()
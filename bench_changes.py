@@ -0,0 +1,106 @@
+"""Benchmark the change feed against diffing two runs in memory
+
+Writes two synthetic runs where a few percent of the listings for sale are
+new, repriced, sold or delisted, then diffs them with zealty_changes at a
+few chunk sizes and with two in-memory dicts. Each diff runs in a fresh
+process so its peak RSS is its own, and every one must find the same events.
+
+    python bench_changes.py --listings 100000
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import resource
+import random
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+
+from zealty_changes import changes, diff_records, records
+from zealty_listing import COLUMNS
+
+HEADER = ",".join(COLUMNS) + "\n"
+
+def csv_line(number, day, price):
+    return (f"R{number:08d},49.25,-123.1,{day.isoformat()},,{number % 9000 + 100} Bench Street,Area {number % 150},"
+            f"{price},Synthetic listing,Townhouse,2,,3,2,1200,,\n")
+
+def write_run(run_dir, active, sold):
+    os.makedirs(run_dir)
+    for name, rows in (("for_sale_today", active), ("solds_last_12_months", sold)):
+        with open(os.path.join(run_dir, name + ".csv"), "w", encoding="utf-8") as f:
+            f.write(HEADER)
+            f.writelines(csv_line(number, day, price) for number, (day, price) in rows.items())
+
+def simulate(root, listings, seed=7):
+    """Two consecutive runs; returns their directories"""
+    rng = random.Random(seed)
+    today = date.today()
+    numbers = rng.sample(range(10_000_000), listings * 2)
+    active = {n: (today - timedelta(days=rng.randrange(90)), rng.randint(400, 4000)) for n in numbers[:listings]}
+    sold = {n: (today - timedelta(days=rng.randrange(365)), rng.randint(400, 4000)) for n in numbers[listings:]}
+    write_run(os.path.join(root, "run-a"), active, sold)
+    for number in list(active):
+        pick = rng.random()
+        if pick < 0.01:
+            sold[number] = (today, active.pop(number)[1])
+        elif pick < 0.02:
+            del active[number]
+        elif pick < 0.05:
+            day, price = active[number]
+            active[number] = (day, round(price * rng.uniform(0.9, 0.99)))
+    for number in rng.sample(range(10_000_000, 20_000_000), listings // 50):
+        active[number] = (today, rng.randint(400, 4000))
+    write_run(os.path.join(root, "run-b"), active, sold)
+    return os.path.join(root, "run-a"), os.path.join(root, "run-b")
+
+def in_memory(old_run, new_run, chunk_rows=None, tmp_dir=None):
+    """The diff the feed replaces: both runs loaded into dicts"""
+    def load(run_dir):
+        latest = {}
+        for record in records(run_dir):
+            if record[0] not in latest or record[1] < latest[record[0]][1]:
+                latest[record[0]] = record
+        return latest
+    old, new = load(old_run), load(new_run)
+    return diff_records((old[k] for k in sorted(old)), (new[k] for k in sorted(new)))
+
+def measure(diff, old_run, new_run, chunk_rows, tmp_dir):
+    """Seconds, peak RSS in MB, event counts and a digest of the events, in a child process"""
+    started = time.perf_counter()
+    digest = hashlib.sha256()
+    counts = {}
+    # Consume the events one at a time, as a consumer streaming them would
+    for event in diff(old_run, new_run, chunk_rows, tmp_dir):
+        digest.update(json.dumps(event).encode())
+        counts[event["event"]] = counts.get(event["event"], 0) + 1
+    elapsed = time.perf_counter() - started
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, counts, digest.hexdigest()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listings", type=int, default=100_000, help="listings for sale, and as many solds")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="zealty-changes-bench-")
+    try:
+        old_run, new_run = simulate(root, args.listings)
+        print(f"{args.listings} for sale and {args.listings} sold per run\n")
+        context = multiprocessing.get_context("spawn")
+        results = []
+        for label, diff, chunk_rows in [("in-memory dicts", in_memory, None)] + [
+                (f"change feed, {rows} rows/chunk", changes, rows) for rows in (20_000, 100_000, 1_000_000)]:
+            with context.Pool(1) as pool:
+                elapsed, peak, counts, digest = pool.apply(measure, (diff, old_run, new_run, chunk_rows, root))
+            print(f"{label:<34} {elapsed:>7.2f} s {peak:>8.1f} MB peak RSS")
+            results.append(digest)
+        assert len(set(results)) == 1, "the diffs found different events"
+        print("\n" + ", ".join(f"{count} {kind}" for kind, count in sorted(counts.items())) + ", the same for every diff")
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Benchmark comps queries on the spatial index against a linear scan
+
+Indexes the stub's synthetic sold and for-sale listings (clustered like the
+real map), then times radius and nearest queries for random subject
+properties, one at a time and as one batch, and checks that they return the
+same listings as scanning every row.
+
+    python bench_comps.py --listings 20000 --subjects 5000
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from stub_svcfetchdb import make_listings
+from zealty_comps import CompIndex, project
+from zealty_listing import decode_rows
+
+def scan(index, x, y, meters, bedrooms):
+    """The linear scan the index replaces: measure every sold listing"""
+    distance = np.hypot(index.x - x, index.y - y)
+    rows = np.flatnonzero((distance <= meters) & (index.category == 1) & (index.bedrooms == bedrooms))
+    return rows[np.argsort(distance[rows], kind="stable")]
+
+def timed(label, count, fn):
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40} {elapsed * 1000:>9.1f} ms {elapsed * 1e6 / count:>9.1f} us/subject")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listings", type=int, default=20000, help="sold and for-sale listings each")
+    parser.add_argument("--subjects", type=int, default=5000)
+    parser.add_argument("--radius", type=float, default=500)
+    parser.add_argument("--nearest", type=int, default=10)
+    args = parser.parse_args()
+
+    dataset = make_listings(args.listings)
+    listings = {"sold": decode_rows(dataset["sold"]), "active": decode_rows(dataset["active"])}
+    index = timed("build index", 1, lambda: CompIndex.from_listings(listings))
+    workdir = tempfile.mkdtemp(prefix="zealty-comps-bench-")
+    try:
+        path = os.path.join(workdir, "comps_index.npz")
+        index.save(path, {})
+        timed("load index from disk", 1, lambda: CompIndex.load(path))
+    finally:
+        shutil.rmtree(workdir)
+
+    # Subjects sit on random listings, like pricing properties in the same market
+    rng = random.Random(1)
+    picks = [rng.randrange(len(index)) for _ in range(args.subjects)]
+    latitudes = index.latitude[picks] + np.array([rng.gauss(0, 0.001) for _ in picks])
+    longitudes = index.longitude[picks] + np.array([rng.gauss(0, 0.001) for _ in picks])
+    bedrooms = index.bedrooms[picks]
+    print(f"{len(index)} listings, {args.subjects} subjects, {args.radius:g}m radius, "
+          f"k={args.nearest}, same bedrooms, solds only\n")
+
+    one = min(args.subjects, 1000)
+    timed("linear scan, one subject at a time", one, lambda: [
+        scan(index, *project(latitudes[i], longitudes[i], index.origin), args.radius, bedrooms[i]) for i in range(one)])
+    timed("index radius, one subject at a time", one, lambda: [
+        index.within(latitudes[i], longitudes[i], args.radius, bedrooms=int(bedrooms[i])) for i in range(one)])
+    matches = timed("index radius, batch", args.subjects, lambda: index.within(
+        latitudes, longitudes, args.radius, bedrooms=bedrooms))
+    nearest = timed(f"index {args.nearest} nearest, batch", args.subjects, lambda: index.nearest(
+        latitudes, longitudes, args.nearest, bedrooms=bedrooms))
+
+    # Both query kinds must return exactly what the scan finds
+    starts = np.searchsorted(matches.subject, np.arange(args.subjects + 1))
+    near_starts = np.searchsorted(nearest.subject, np.arange(args.subjects + 1))
+    for i in range(args.subjects):
+        x, y = project(latitudes[i], longitudes[i], index.origin)
+        expected = scan(index, x, y, args.radius, bedrooms[i])
+        assert set(matches.row[starts[i]:starts[i + 1]]) == set(expected), f"radius mismatch for subject {i}"
+        distance = np.hypot(index.x - x, index.y - y)
+        rows = np.flatnonzero((index.category == 1) & (index.bedrooms == bedrooms[i]))
+        kth = np.sort(distance[rows])[:args.nearest]
+        assert np.allclose(nearest.distance[near_starts[i]:near_starts[i + 1]], kth), f"nearest mismatch for subject {i}"
+    print(f"\n{len(matches.row)} radius matches and {len(nearest.row)} nearest matches, all equal to a full scan")
+
+if __name__ == "__main__":
+    main()
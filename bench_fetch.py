@@ -0,0 +1,64 @@
+"""Benchmark serial vs concurrent fetching against the local stub
+
+Runs the adaptive planner for all three categories against stub_svcfetchdb.py
+with injected latency, once with a single worker (the old serial loop) and once
+per requested worker count, and checks every run collects the same listings.
+
+    python bench_fetch.py --latency 0.2 --workers 4 8
+"""
+import argparse
+import contextlib
+import io
+import time
+
+from stub_svcfetchdb import start_stub
+from zealty_fetch import ApiClient, fetch_rows
+from zealty_scraper_multi import METRO_BOUNDS, PROPERTY_FILTER, build_sql, collect_adaptive
+
+def run_once(url, workers):
+    client = ApiClient(url=url)
+
+    def fetch_box(sold_flag, box, window):
+        sql = build_sql(box, PROPERTY_FILTER, "entryDate DESC")
+        return fetch_rows(client, sql, sold_flag)
+
+    flags = ("active", "sold", "expired")
+    listings = {flag: set() for flag in flags}
+
+    def collect(sold_flag, box, rows):
+        listings[sold_flag].update(row.mls_number for row in rows)
+
+    jobs = [(flag, METRO_BOUNDS) for flag in flags]
+    started = time.perf_counter()
+    # fetch_rows prints a line per request; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = collect_adaptive(fetch_box, jobs, collect, workers=workers)
+    elapsed = time.perf_counter() - started
+    client.close()
+
+    requests = sum(r[0] for r in results.values())
+    return elapsed, requests, listings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds added to every response")
+    parser.add_argument("--listings", type=int, default=20000, help="listings per category")
+    parser.add_argument("--workers", type=int, nargs="+", default=[4, 8])
+    args = parser.parse_args()
+
+    server, url = start_stub(listings=args.listings, latency=args.latency)
+    print(f"Stub at {url} ({args.listings} listings per category, {args.latency}s latency)")
+
+    serial, requests, expected = run_once(url, 1)
+    print(f"{'workers':>8} {'requests':>9} {'seconds':>9} {'speedup':>8}")
+    print(f"{1:>8} {requests:>9} {serial:>9.2f} {1.0:>7.1f}x")
+    for workers in args.workers:
+        elapsed, requests, listings = run_once(url, workers)
+        if listings != expected:
+            raise SystemExit(f"{workers} workers collected different listings than the serial run")
+        print(f"{workers:>8} {requests:>9} {elapsed:>9.2f} {serial / elapsed:>7.1f}x")
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Benchmark how long each module takes to import in a fresh interpreter
+
+Every module is imported in new processes with ZEALTY_USERNAME and
+ZEALTY_PASSWORD unset, and the median import time over --repeat runs is
+reported along with which heavy dependencies the import pulled in. Planning,
+parsing and output modules should load none of them, and even the scraper
+itself should import without Playwright, .env or credentials.
+
+    python bench_import.py --repeat 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = ["zealty_grid", "zealty_jobs", "zealty_listing", "zealty_output", "zealty_incremental", "zealty_store",
+           "zealty_stats", "zealty_changes", "zealty_comps", "zealty_fetch", "zealty_session",
+           "zealty_scraper_multi", "zealty_daemon"]
+
+# Imported by the browser, network and server layers only
+HEAVY = ["playwright", "dotenv", "http.client", "http.server", "concurrent.futures", "numpy"]
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps([elapsed, [name for name in {heavy!r} if name in sys.modules]]))
+"""
+
+def measure(module, repeat):
+    env = {k: v for k, v in os.environ.items() if k not in ("ZEALTY_USERNAME", "ZEALTY_PASSWORD")}
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)],
+                                capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if result.returncode:
+            return None, result.stderr.strip().splitlines()[-1]
+        elapsed, loaded = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(elapsed)
+    return statistics.median(times), ", ".join(loaded) or "-"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=9, help="fresh interpreters per module")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    args = parser.parse_args()
+
+    print(f"{'module':<22} {'median ms':>10}  heavy imports")
+    for module in args.modules:
+        elapsed, loaded = measure(module, args.repeat)
+        if elapsed is None:
+            print(f"{module:<22} {'failed':>10}  {loaded}")
+        else:
+            print(f"{module:<22} {elapsed * 1000:>10.1f}  {loaded}")
+
+if __name__ == "__main__":
+    main()
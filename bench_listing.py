@@ -0,0 +1,84 @@
+"""Benchmark Listing decoding against plain list-of-lists rows
+
+Builds a svcFetchDB.php-shaped response body from the stub's synthetic
+listings and compares the old path (json.loads, rows kept as lists and
+converted again by every typed consumer) with the Listing path (rows typed
+once at decode time). Reports decode time, memory retained per row and the
+time to produce typed columns, as the Parquet/Arrow writers and SQLite store
+do.
+
+    python bench_listing.py --rows 50000
+    python bench_listing.py --rows 50000 --strings
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from stub_svcfetchdb import make_listings
+from zealty_listing import COLUMNS, SCHEMA, decode_rows, loads, orjson
+
+def make_body(count, strings):
+    rows = make_listings(count)["active"]
+    if strings:
+        # Some API responses carry every value as text
+        rows = [[v if isinstance(v, str) else str(v) for v in row] for row in rows]
+    return json.dumps({"rows": rows}).encode()
+
+def decode_lists(body):
+    return json.loads(body).get("rows") or []
+
+def decode_listings(body):
+    return decode_rows(loads(body).get("rows") or [])
+
+def typed_columns_lists(rows):
+    """What every typed consumer had to do with list rows: convert each value"""
+    return [[SCHEMA[col][1](row[i]) if i < len(row) else None for row in rows]
+            for i, col in enumerate(COLUMNS)]
+
+def typed_columns_listings(rows):
+    return [list(values) for values in zip(*rows)]
+
+def measure(decode, columns, body, repeat):
+    best_decode = best_columns = float("inf")
+    # Like timeit, keep the garbage collector out of the timings
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = decode(body)
+            best_decode = min(best_decode, time.perf_counter() - started)
+            started = time.perf_counter()
+            columns(rows)
+            best_columns = min(best_columns, time.perf_counter() - started)
+            del rows
+    finally:
+        gc.enable()
+
+    gc.collect()
+    tracemalloc.start()
+    rows = decode(body)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best_decode, best_columns, retained / len(rows), len(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--strings", action="store_true", help="encode every value as a JSON string")
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    body = make_body(args.rows, args.strings)
+    print(f"{len(body) / 1024 / 1024:.1f} MB response, {args.rows} rows, "
+          f"{'string' if args.strings else 'mixed'} values, orjson {'on' if orjson else 'off'}")
+    print(f"{'path':<10} {'decode ms':>10} {'columns ms':>11} {'total ms':>9} {'bytes/row':>10}")
+    for name, decode, columns in (("lists", decode_lists, typed_columns_lists),
+                                  ("Listing", decode_listings, typed_columns_listings)):
+        decode_s, columns_s, per_row, _ = measure(decode, columns, body, args.repeat)
+        print(f"{name:<10} {decode_s * 1000:>10.1f} {columns_s * 1000:>11.1f} "
+              f"{(decode_s + columns_s) * 1000:>9.1f} {per_row:>10.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark the query planner against the local stand-in
+
+Starts stub_svcfetchdb.py (synthetic listings with water areas, or recorded
+fixtures), then runs the scraper several times in a row in one working
+directory: the first run starts from whole regions and the rest are planned
+from the density stats of the runs before them. Reports planned and executed
+requests per run. Every run must write the same listings as the first.
+
+    python bench_planner.py --runs 6
+    python bench_planner.py --fixtures fixtures.jsonl.gz
+"""
+import argparse
+import glob
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_run import free_port
+from bench_shards import listings
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PLAN_RE = re.compile(r"Query plan: (\d+) boxes \((\d+) merged into (\d+), (\d+) empty skipped\), "
+                     r"(\d+) requests planned, (\d+) executed")
+
+def start_stand_in(args):
+    port = free_port()
+    cmd = [sys.executable, os.path.join(HERE, "stub_svcfetchdb.py"), "--port", str(port),
+           "--listings", str(args.listings), "--latency", str(args.latency)]
+    cmd += ["--fixtures", os.path.abspath(args.fixtures)] if args.fixtures else ["--water"]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    process.stdout.readline()
+    return process, f"http://127.0.0.1:{port}/svcFetchDB.php"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=6, help="runs in a row, the first one unplanned")
+    parser.add_argument("--fixtures", help="replay a fixture file recorded with --record")
+    parser.add_argument("--listings", type=int, default=20000, help="synthetic listings per category")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every response")
+    args = parser.parse_args()
+
+    process, url = start_stand_in(args)
+    workdir = tempfile.mkdtemp(prefix="zealty-planner-bench-")
+    env = dict(os.environ, ZEALTY_API_URL=url, ZEALTY_SESSION_FILE=os.path.join(workdir, "session.json"),
+               PYTHONPATH=os.pathsep.join(filter(None, [HERE, os.environ.get("PYTHONPATH")])))
+    try:
+        print(f"Stand-in at {url}" + (f" replaying {args.fixtures}" if args.fixtures else " with water areas"))
+        print(f"{'run':>3} {'plan':>7} {'boxes':>6} {'merged':>9} {'skipped':>7} {'planned':>7} "
+              f"{'executed':>8} {'seconds':>7}")
+        expected = baseline = None
+        for run in range(args.runs):
+            command = [sys.executable, os.path.join(HERE, "zealty_scraper_multi.py"), "--no-cache", "--rate", "0"]
+            if run == 0:
+                command.append("--no-plan")
+            started = time.perf_counter()
+            output = subprocess.run(command, cwd=workdir, env=env, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, text=True)
+            elapsed = time.perf_counter() - started
+            if output.returncode:
+                print(output.stdout[-3000:])
+                sys.exit(f"run {run + 1}: the scraper exited with {output.returncode}")
+            boxes, merged, into, skipped, planned, executed = map(int, PLAN_RE.search(output.stdout).groups())
+            baseline = baseline or executed
+            print(f"{run + 1:>3} {'regions' if run == 0 else 'stats':>7} {boxes:>6} {f'{merged}->{into}':>9} "
+                  f"{skipped:>7} {planned:>7} {executed:>8} {elapsed:>7.2f}")
+
+            run_dir = sorted(glob.glob(os.path.join(workdir, "data", "run-*")))[-1]
+            found = listings(run_dir)
+            if expected is None:
+                expected = found
+            assert found == expected, f"run {run + 1} wrote different listings"
+            # Each run needs its own timestamped directory
+            time.sleep(1)
+        print(f"\nEvery run wrote the same {sum(map(len, expected.values()))} listings; "
+              f"the last one sent {executed} requests, {1 - executed / baseline:.0%} fewer than the unplanned run")
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
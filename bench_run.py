@@ -0,0 +1,134 @@
+"""Benchmark full scraper runs against the local stand-in
+
+Starts stub_svcfetchdb.py in a separate process (synthetic listings or
+recorded fixtures, with optional latency and injected errors), then runs
+zealty_scraper_multi.run in this process and reports wall-clock time,
+requests per second, rows per second and peak RSS. Every run starts from
+whole regions (--no-plan), so repeats send the same requests instead of
+being planned from the density stats of the runs before them. Arguments
+after `--` are passed to the scraper.
+
+    python bench_run.py --latency 0.05 --repeat 3
+    python bench_run.py --fixtures fixtures.jsonl.gz -- --workers 8
+    python bench_run.py --error-rate 0.05 --max-rps 30 -- --rate 0 --workers 16
+"""
+import argparse
+import contextlib
+import csv
+import glob
+import io
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Passed to every run ahead of the arguments after `--`
+BASE_ARGS = ["--no-cache", "--no-plan"]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_stand_in(args):
+    """Start the stub in a child process so its memory isn't counted, and return (process, url)"""
+    port = free_port()
+    cmd = [sys.executable, os.path.join(HERE, "stub_svcfetchdb.py"), "--port", str(port),
+           "--listings", str(args.listings), "--latency", str(args.latency),
+           "--error-rate", str(args.error_rate), "--drop-rate", str(args.drop_rate),
+           "--max-rps", str(args.max_rps)]
+    if args.fixtures:
+        cmd += ["--fixtures", os.path.abspath(args.fixtures)]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    # The stub prints its URL once it is listening
+    process.stdout.readline()
+    return process, f"http://127.0.0.1:{port}/svcFetchDB.php"
+
+def stand_in_stats(url):
+    with urllib.request.urlopen(url.replace("/svcFetchDB.php", "/stats")) as resp:
+        return json.load(resp)
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def rows_written(run_dir):
+    total = 0
+    for path in glob.glob(os.path.join(run_dir, "*.csv")):
+        with open(path, newline='', encoding='utf-8') as f:
+            total += sum(1 for _ in csv.reader(f)) - 1
+    return total
+
+def main():
+    argv = sys.argv[1:]
+    scraper_args = []
+    if "--" in argv:
+        split = argv.index("--")
+        argv, scraper_args = argv[:split], argv[split + 1:]
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixtures", help="replay a fixture file recorded with --record")
+    parser.add_argument("--listings", type=int, default=20000, help="synthetic listings per category")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of connections dropped without a response")
+    parser.add_argument("--max-rps", type=int, default=0, help="stand-in answers 429 above this many requests per second")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    process, url = start_stand_in(args)
+    workdir = tempfile.mkdtemp(prefix="zealty-bench-")
+    # The stand-in doesn't need a session, so the scraper never opens a browser
+    os.environ["ZEALTY_API_URL"] = url
+    os.environ["ZEALTY_SESSION_FILE"] = os.path.join(workdir, "session.json")
+    os.environ.setdefault("ZEALTY_USERNAME", "bench")
+    os.environ.setdefault("ZEALTY_PASSWORD", "bench")
+    sys.path.insert(0, HERE)
+    os.chdir(workdir)
+
+    try:
+        import zealty_scraper_multi
+
+        print(f"Stand-in at {url}, scraper args: {BASE_ARGS + scraper_args}")
+        print(f"{'run':>4} {'seconds':>8} {'requests':>9} {'req/s':>7} {'rows':>7} {'rows/s':>8} {'errors':>7} {'peak RSS MB':>12}")
+        results = []
+        for i in range(1, args.repeat + 1):
+            before = stand_in_stats(url)
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                zealty_scraper_multi.run(BASE_ARGS + scraper_args)
+            elapsed = time.perf_counter() - started
+            after = stand_in_stats(url)
+
+            run_dir = sorted(glob.glob(os.path.join("data", "run-*")))[-1]
+            result = {
+                "seconds": round(elapsed, 3),
+                "requests": after["requests"] - before["requests"],
+                "errors": sum(after[k] - before[k] for k in ("errors", "throttled", "dropped")),
+                "rows": rows_written(run_dir),
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+            }
+            result["requests_per_second"] = round(result["requests"] / elapsed, 1)
+            result["rows_per_second"] = round(result["rows"] / elapsed, 1)
+            results.append(result)
+            print(f"{i:>4} {elapsed:>8.2f} {result['requests']:>9} {result['requests_per_second']:>7.1f} "
+                  f"{result['rows']:>7} {result['rows_per_second']:>8.0f} {result['errors']:>7} {result['peak_rss_mb']:>12.1f}")
+            # Each run needs its own timestamped directory
+            time.sleep(1)
+
+        best = min(results, key=lambda r: r["seconds"])
+        print(json.dumps({"best": best, "runs": results}))
+    finally:
+        process.terminate()
+        process.wait()
+
+if __name__ == "__main__":
+    main()
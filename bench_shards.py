@@ -0,0 +1,104 @@
+"""Benchmark how a run scales with --shards against the local stand-in
+
+Starts stub_svcfetchdb.py (with several server processes so it isn't the
+bottleneck), then runs the scraper once per shard count and reports requests
+per second and the speedup over a single process. Every run starts from
+whole regions (--no-plan), so each shard count sends the same requests
+rather than a plan built from the runs before it. --rate is the ceiling of
+each session, like the real site's per-session throttling, and --max-rps
+adds an upstream limit shared by every shard. Every run must write the same
+listings as the single-process one.
+
+    python bench_shards.py --shards 1 2 4 --rate 10
+    python bench_shards.py --shards 1 2 4 8 --rate 10 --max-rps 40
+"""
+import argparse
+import csv
+import glob
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_run import free_port, stand_in_stats
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def start_stand_in(args):
+    port = free_port()
+    cmd = [sys.executable, os.path.join(HERE, "stub_svcfetchdb.py"), "--port", str(port),
+           "--listings", str(args.listings), "--latency", str(args.latency), "--max-rps", str(args.max_rps),
+           "--processes", str(args.stub_processes)]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    process.stdout.readline()
+    return process, f"http://127.0.0.1:{port}/svcFetchDB.php"
+
+def listings(run_dir):
+    """{file name: set of MLS numbers} for every CSV in a run"""
+    found = {}
+    for path in glob.glob(os.path.join(run_dir, "*.csv")):
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader)
+            found[os.path.basename(path)] = {row[0] for row in reader}
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--workers", type=int, default=4, help="queries in flight per shard")
+    parser.add_argument("--rate", type=float, default=10, help="requests per second per session")
+    parser.add_argument("--listings", type=int, default=20000, help="synthetic listings per category")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds added to every response")
+    parser.add_argument("--max-rps", type=int, default=0, help="upstream limit across all sessions, 0 for none")
+    parser.add_argument("--stub-processes", type=int, default=2)
+    args = parser.parse_args()
+
+    process, url = start_stand_in(args)
+    workdir = tempfile.mkdtemp(prefix="zealty-shards-bench-")
+    env = dict(os.environ, ZEALTY_API_URL=url, ZEALTY_SESSION_FILE=os.path.join(workdir, "session.json"),
+               PYTHONPATH=os.pathsep.join(filter(None, [HERE, os.environ.get("PYTHONPATH")])))
+    try:
+        print(f"Stand-in at {url}, {args.workers} workers and {args.rate:g} requests/s per session"
+              + (f", upstream limit {args.max_rps}/s" if args.max_rps else ""))
+        print(f"{'shards':>6} {'seconds':>8} {'requests':>9} {'throttled':>9} {'req/s':>7} {'speedup':>8} {'efficiency':>10}")
+        baseline = expected = None
+        for shards in args.shards:
+            before = stand_in_stats(url)
+            started = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, os.path.join(HERE, "zealty_scraper_multi.py"), "--no-cache", "--no-plan", "--rate", str(args.rate),
+                 "--workers", str(args.workers), "--shards", str(shards)],
+                cwd=workdir, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            elapsed = time.perf_counter() - started
+            if output.returncode:
+                print(output.stdout[-3000:])
+                sys.exit(f"{shards} shards: the scraper exited with {output.returncode}")
+            output = output.stdout
+            after = stand_in_stats(url)
+
+            # Collecting is what sharding speeds up; session setup is reported separately
+            requests, collect = re.search(r"Total requests: (\d+) in ([\d.]+)s", output).groups()
+            rate = int(requests) / float(collect)
+            baseline = baseline or rate / shards
+            print(f"{shards:>6} {elapsed:>8.2f} {requests:>9} {after['throttled'] - before['throttled']:>9} "
+                  f"{rate:>7.1f} {rate / baseline:>7.2f}x {rate / baseline / shards:>9.0%}")
+
+            run_dir = sorted(glob.glob(os.path.join(workdir, "data", "run-*")))[-1]
+            found = listings(run_dir)
+            if expected is None:
+                expected = found
+            assert found == expected, f"{shards} shards wrote different listings"
+            # Each run needs its own timestamped directory
+            time.sleep(1)
+        print(f"\nEvery run wrote the same {sum(map(len, expected.values()))} listings")
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
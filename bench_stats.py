@@ -0,0 +1,101 @@
+"""Benchmark zealty_stats over a year of synthetic daily runs
+
+Simulates a market where listings come up for sale, sell or expire each day
+and writes one run directory per day, each with that day's for-sale
+snapshot, the solds of the last 12 months and the expireds of the last 30
+days. Then times building the merged tables from scratch, loading them from
+the cache, merging one new run and computing the summary and trend tables.
+
+    python bench_stats.py --runs 365 --active 2000
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+
+import zealty_stats
+from zealty_listing import COLUMNS
+from stub_svcfetchdb import TYPES
+
+HEADER = ",".join(COLUMNS) + "\n"
+
+# Roughly as many neighbourhoods as Metro Vancouver has
+NEIGHBORHOODS = [f"Area {i:03d}" for i in range(150)]
+
+def csv_line(number, day, price, listing):
+    neighborhood, property_type, sqft = listing
+    return (f"R{number},49.25,-123.1,{day.isoformat()},,{number % 9000 + 100} Bench Street,{neighborhood},"
+            f"{price},Synthetic listing,{property_type},2,,3,2,{sqft},,\n")
+
+def simulate(root, runs, inventory, seed=42):
+    """Write `runs` daily run directories under root"""
+    rng = random.Random(seed)
+    start = date.today() - timedelta(days=runs)
+    active = {}
+    sold = []
+    expired = []
+    number = 2000000
+    for i in range(runs):
+        day = start + timedelta(days=i)
+        # New listings keep the inventory near its target, and each day a
+        # few sell (around the asking price) or expire
+        while len(active) < inventory:
+            number += 1
+            listing = (rng.choice(NEIGHBORHOODS), rng.choice(TYPES), rng.randint(500, 3500))
+            active[number] = (rng.randint(400, 4000), listing, day)
+        for mls in list(active):
+            pick = rng.random()
+            if pick < 1 / 60:
+                ask, listing, _ = active.pop(mls)
+                sold.append((day, csv_line(mls, day, round(ask * rng.uniform(0.92, 1.04)), listing)))
+            elif pick < 1 / 40:
+                ask, listing, _ = active.pop(mls)
+                expired.append((day, csv_line(mls, day, ask, listing)))
+
+        run_dir = os.path.join(root, f"run-{day:%Y-%m-%d}_06-00-00")
+        os.makedirs(run_dir)
+        with open(os.path.join(run_dir, "for_sale_today.csv"), "w", encoding="utf-8") as f:
+            f.write(HEADER)
+            # A listing for sale keeps the date it was listed
+            f.writelines(csv_line(mls, listed, ask, listing) for mls, (ask, listing, listed) in active.items())
+        for name, rows, days in (("solds_last_12_months", sold, 365), ("expired_last_30_days", expired, 30)):
+            with open(os.path.join(run_dir, name + ".csv"), "w", encoding="utf-8") as f:
+                f.write(HEADER)
+                f.writelines(line for when, line in rows if (day - when).days < days)
+
+def timed(label, fn):
+    started = time.perf_counter()
+    result = fn()
+    print(f"{label:<34} {(time.perf_counter() - started) * 1000:>9.1f} ms")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=365)
+    parser.add_argument("--active", type=int, default=2000, help="listings for sale on any day")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="zealty-stats-bench-")
+    cache_dir = os.path.join(root, "cache")
+    try:
+        print(f"Writing {args.runs} runs with about {args.active} listings for sale each...")
+        simulate(os.path.join(root, "data"), args.runs + 1, args.active)
+        run_dirs = sorted(d.path for d in os.scandir(os.path.join(root, "data")))
+        rows = sum(sum(1 for _ in open(p, encoding="utf-8")) - 1
+                   for d in run_dirs for _, p in zealty_stats.run_files(d))
+        print(f"{len(run_dirs)} runs, {rows} rows in total\n")
+
+        timed(f"build from {args.runs} runs", lambda: zealty_stats.load_market(run_dirs[:-1], cache_dir))
+        timed("load from cache", lambda: zealty_stats.load_market(run_dirs[:-1], cache_dir))
+        market, _ = timed("load from cache + 1 new run", lambda: zealty_stats.load_market(run_dirs, cache_dir))
+        timed("summary by neighborhood", lambda: zealty_stats.summary_rows(market, "neighborhood", 12, 5))
+        timed("summary by neighborhood and type", lambda: zealty_stats.summary_rows(market, "both", 12, 5))
+        timed("trend, 12 months, 3-month rolling", lambda: zealty_stats.trend_rows(market, "property_type", 12, 3, 5))
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,17 @@
-import os
 import json
-import time
 from playwright.sync_api import sync_playwright
-from dotenv import load_dotenv
 
-load_dotenv()
+from zealty_session import MAP_TIMEOUT, api_responses, credentials, open_map, sign_in, wait_for_signal
 
-USERNAME = os.getenv("ZEALTY_USERNAME")
-PASSWORD = os.getenv("ZEALTY_PASSWORD")
+USERNAME, PASSWORD = credentials()
 
 def run():
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=True)
         context = browser.new_context()
         page = context.new_page()
+        responses = api_responses(page)
 
-        print("Navigating to login page...")
-        page.goto("https://www.zealty.ca/sign-in")
-
-        print("Filling credentials...")
-        page.fill("#email", USERNAME)
-        page.fill("#password", PASSWORD)
-        
         # Capture specific API requests
         def handle_response(response):
             if "svcFetchDB.php" in response.url or "svcGetInfoDB.php" in response.url:
@@ -46,30 +36,22 @@ def run():
         
         page.on("websocket", handle_ws)
 
-        print("Clicking sign in...")
-        page.click("button:has-text('Sign In')")
-        
-        print("Waiting for login to complete...")
-        time.sleep(5)
+        sign_in(page, USERNAME, PASSWORD)
 
-        print("Checking current URL...")
-        if "map.html" not in page.url:
-            print(f"Current URL is {page.url}. Forcing navigation to map...")
-            page.goto("https://www.zealty.ca/map.html")
-        
         print("Waiting for map data...")
         try:
-            page.wait_for_load_state("networkidle")
-            time.sleep(10)
-            
+            open_map(page, responses)
+
             # Interact with map to trigger loading
             print("Interacting with map...")
+            seen = len(responses)
             page.mouse.move(500, 500)
             page.mouse.down()
             page.mouse.move(600, 600)
             page.mouse.up()
-            time.sleep(5)
-            
+            signal, waited = wait_for_signal(page, {"map data reloaded": lambda: len(responses) > seen}, MAP_TIMEOUT)
+            print(f"{signal or 'No new map data'} after {waited:.2f}s")
+
             print("Taking map screenshot...")
             page.screenshot(path="map_page.png")
             
@@ -1,42 +1,29 @@
-import os
-import time
 from playwright.sync_api import sync_playwright
-from dotenv import load_dotenv
 
-load_dotenv()
+from zealty_session import MAP_TIMEOUT, api_responses, credentials, open_map, sign_in, wait_for_signal
 
-USERNAME = os.getenv("ZEALTY_USERNAME")
-PASSWORD = os.getenv("ZEALTY_PASSWORD")
+USERNAME, PASSWORD = credentials()
+
+def click_and_wait(page, responses, text):
+    """Click a category button and wait for the map data it loads"""
+    seen = len(responses)
+    page.get_by_text(text, exact=False).first.click()
+    signal, waited = wait_for_signal(page, {"map data reloaded": lambda: len(responses) > seen}, MAP_TIMEOUT)
+    print(f"{signal or 'No new map data'} after {waited:.2f}s")
 
 def run():
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=True)
         context = browser.new_context(viewport={'width': 1280, 'height': 720})
         page = context.new_page()
+        responses = api_responses(page)
 
-        print("Navigating to login page...")
-        page.goto("https://www.zealty.ca/sign-in")
-
-        print("Filling credentials...")
-        page.fill("#email", USERNAME)
-        page.fill("#password", PASSWORD)
-        page.click("button:has-text('Sign In')")
-        
-        print("Waiting for login...")
-        try:
-            page.wait_for_url("**/map.html", timeout=15000)
-        except:
-            print("Manually navigating to map.html...")
-            page.goto("https://www.zealty.ca/map.html")
-            page.wait_for_load_state("networkidle")
-        
-        time.sleep(5) # Wait for map to load
+        sign_in(page, USERNAME, PASSWORD)
+        open_map(page, responses)
         
         # Click on "For Sale" button
         print("\n=== Clicking 'For Sale' ===")
-        for_sale_btn = page.get_by_text("For Sale", exact=False).first
-        for_sale_btn.click()
-        time.sleep(2)
+        click_and_wait(page, responses, "For Sale")
         page.screenshot(path="for_sale_clicked.png")
         
         # Look for date selector - might be a dropdown or date input
@@ -53,9 +40,7 @@ def run():
         
         # Click on "Solds" button
         print("\n=== Clicking 'Solds' ===")
-        solds_btn = page.get_by_text("Solds", exact=False).first
-        solds_btn.click()
-        time.sleep(2)
+        click_and_wait(page, responses, "Solds")
         page.screenshot(path="solds_clicked.png")
         
         print("Looking for date selector after clicking Solds...")
@@ -69,9 +54,7 @@ def run():
         
         # Click on "Expired" button
         print("\n=== Clicking 'Expired' ===")
-        expired_btn = page.get_by_text("Expired", exact=False).first
-        expired_btn.click()
-        time.sleep(2)
+        click_and_wait(page, responses, "Expired")
         page.screenshot(path="expired_clicked.png")
         
         print("Looking for date selector after clicking Expired...")
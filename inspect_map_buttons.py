@@ -1,41 +1,21 @@
-import os
-import time
 from playwright.sync_api import sync_playwright
-from dotenv import load_dotenv
 
-load_dotenv()
+from zealty_session import api_responses, credentials, open_map, sign_in
 
-USERNAME = os.getenv("ZEALTY_USERNAME")
-PASSWORD = os.getenv("ZEALTY_PASSWORD")
+USERNAME, PASSWORD = credentials()
 
 def run():
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=True)
         context = browser.new_context(viewport={'width': 1280, 'height': 720})
         page = context.new_page()
+        responses = api_responses(page)
 
-        print("Navigating to login page...")
-        page.goto("https://www.zealty.ca/sign-in")
+        sign_in(page, USERNAME, PASSWORD)
+        open_map(page, responses)
 
-        print("Filling credentials...")
-        page.fill("#email", USERNAME)
-        page.fill("#password", PASSWORD)
-        page.click("button:has-text('Sign In')")
-        
-        print("Waiting for login...")
-        try:
-            # Wait for either map.html or just a successful login redirect
-            page.wait_for_url("**/map.html", timeout=15000)
-            print("Redirected to map page automatically.")
-        except:
-            print(f"Timed out waiting for redirect. Current URL: {page.url}")
-            print("Manually navigating to map.html...")
-            page.goto("https://www.zealty.ca/map.html")
-            page.wait_for_load_state("networkidle")
-        
         print(f"Current URL: {page.url}")
         print("On map page. Taking screenshot...")
-        time.sleep(5) # Wait for map to load
         page.screenshot(path="map_page_top.png")
         
         # Try to find buttons with text "For Sale", "Solds", "Expired"
@@ -0,0 +1,355 @@
+"""Local stand-in for bcrealestatemap.ca/svcFetchDB.php
+
+Serves synthetic listings, or listings replayed from fixtures recorded with
+`zealty_scraper_multi.py --record`, so the scraper can be exercised and
+benchmarked without an account or network access. Point the scraper at it with:
+
+    python stub_svcfetchdb.py --port 8765 [--fixtures fixtures.jsonl.gz]
+    ZEALTY_API_URL=http://127.0.0.1:8765/svcFetchDB.php ...
+
+GET /stats returns request, error and row counters as JSON. With
+--processes, several forked server processes share the listening socket, the
+counters and the --max-rps window, so the stand-in can keep up with a
+sharded scraper.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Dense clusters (lat, lon, spread in degrees, share of listings)
+CLUSTERS = [
+    (49.2827, -123.1207, 0.010, 0.30),  # Downtown Vancouver
+    (49.2276, -123.0076, 0.012, 0.15),  # Metrotown
+    (49.1913, -122.8490, 0.015, 0.10),  # Surrey Central
+    (49.1666, -123.1336, 0.015, 0.10),  # Richmond
+]
+
+BOUNDS = (49.0, 49.5, -123.3, -122.5)
+
+# Rough areas with no listings for --water (lat_min, lat_max, lon_min, lon_max)
+WATER = [
+    (49.0, 49.27, -123.3, -123.2),  # Strait of Georgia
+    (49.0, 49.08, -123.0, -122.85),  # Boundary Bay
+    (49.4, 49.5, -123.3, -122.5),  # North Shore mountains
+]
+
+TYPES = ["Apartment/Condo", "Townhouse", "House/Single Family", "Duplex"]
+NEIGHBORHOODS = ["Downtown VW", "Metrotown", "Whalley", "Brighouse", "Kitsilano", "Fleetwood"]
+CATEGORIES = ["active", "sold", "expired"]
+
+STATS = ("requests", "errors", "throttled", "dropped", "replayed", "rows")
+
+def in_water(lat, lon):
+    return any(lat_min <= lat <= lat_max and lon_min <= lon <= lon_max for lat_min, lat_max, lon_min, lon_max in WATER)
+
+def make_listings(count=20000, seed=42, water=False):
+    """Generate synthetic rows per category, shaped like svcFetchDB.php rows
+
+    With water, the listings spread across the region avoid WATER, so the
+    map has empty areas like the real one.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    dataset = {}
+    mls = 1000000
+    for category in CATEGORIES:
+        rows = []
+        for _ in range(count):
+            pick = rng.random()
+            lat = lon = None
+            for c_lat, c_lon, spread, share in CLUSTERS:
+                if pick < share:
+                    lat = rng.gauss(c_lat, spread)
+                    lon = rng.gauss(c_lon, spread)
+                    break
+                pick -= share
+            while lat is None or (water and in_water(lat, lon)):
+                lat = rng.uniform(BOUNDS[0], BOUNDS[1])
+                lon = rng.uniform(BOUNDS[2], BOUNDS[3])
+            mls += 1
+            entry = today - timedelta(days=rng.randint(0, 400))
+            beds = rng.randint(0, 6)
+            rows.append([
+                f"R{mls}", round(lat, 6), round(lon, 6), entry.isoformat(), "",
+                f"{rng.randint(100, 9999)} Stub Street", rng.choice(NEIGHBORHOODS),
+                rng.randint(300, 5000), "Synthetic listing", rng.choice(TYPES),
+                rng.randint(1, 3), "", beds, max(1, beds - 1),
+                rng.randint(400, 4000), rng.choice(["", "33.00", "50.00"]), "",
+            ])
+        # Newest first, like the real ORDER BY ... DESC queries
+        rows.sort(key=lambda r: r[3], reverse=True)
+        dataset[category] = rows
+    return dataset
+
+def load_fixtures(path):
+    """Load recorded request/response pairs
+
+    Returns (responses, dataset): the exact recorded response bodies keyed by
+    (sold flag, SQL), and every recorded row per category so that queries
+    which were never recorded (e.g. a different grid) can still be answered.
+    """
+    responses = {}
+    dataset = {}
+    seen = set()
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["status"] != 200:
+                continue
+            responses[(record["sold"], record["sql"])] = record["body"].encode()
+            try:
+                rows = json.loads(record["body"]).get("rows") or []
+            except ValueError:
+                continue
+            for row in rows:
+                if (record["sold"], row[0]) not in seen:
+                    seen.add((record["sold"], row[0]))
+                    dataset.setdefault(record["sold"], []).append(row)
+    for rows in dataset.values():
+        rows.sort(key=lambda r: str(r[3]), reverse=True)
+    return responses, dataset
+
+_NUM = r"(-?[\d.]+(?:e-?\d+)?)"
+LAT_RE = re.compile(rf"latitude BETWEEN {_NUM} AND {_NUM}")
+LON_RE = re.compile(rf"longitude BETWEEN {_NUM} AND {_NUM}")
+DATE_RE = re.compile(r"entryDate BETWEEN '([\d-]+)' AND '([\d-]+)'")
+SINCE_RE = re.compile(r"(?:entryDate|GREATEST\(listingDate, listingPricePrevDate\)) >= '([\d-]+)'")
+LIMIT_RE = re.compile(r"LIMIT (\d+)")
+
+def query(dataset, sql, sold, row_cap=500):
+    """Evaluate the parts of the SQL the scraper uses against the dataset"""
+    lat = LAT_RE.search(sql)
+    lon = LON_RE.search(sql)
+    if not lat or not lon:
+        return None
+    lat_min, lat_max = float(lat.group(1)), float(lat.group(2))
+    lon_min, lon_max = float(lon.group(1)), float(lon.group(2))
+    dates = DATE_RE.search(sql)
+    since = SINCE_RE.search(sql)
+    limit = LIMIT_RE.search(sql)
+    limit = min(int(limit.group(1)), row_cap) if limit else row_cap
+
+    rows = []
+    for row in dataset.get(sold, []):
+        if not (lat_min <= float(row[1]) <= lat_max and lon_min <= float(row[2]) <= lon_max):
+            continue
+        day = str(row[3])[:10]
+        if dates and not (dates.group(1) <= day <= dates.group(2)):
+            continue
+        if since and day < since.group(1):
+            continue
+        rows.append(row)
+        if len(rows) >= limit:
+            break
+    return rows
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes, which Nagle's algorithm
+    # would hold back for the client's delayed ACK
+    disable_nagle_algorithm = True
+    dataset = {}
+    responses = {}
+    row_cap = 500
+    latency = 0.0
+    error_rate = 0.0
+    drop_rate = 0.0
+    max_rps = 0
+    recent = None  # times of the last max_rps accepted requests, a ring starting at cursor[0]
+    cursor = None
+    session_cookie = None
+    stats = None  # counters in STATS order
+    lock = None
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[STATS.index(key)] += amount
+
+    def over_rate_limit(self):
+        """Sliding one-second window shared by all connections and processes"""
+        now = time.monotonic()
+        with self.lock:
+            oldest = self.cursor[0]
+            if now - self.recent[oldest] <= 1.0:
+                return True
+            self.recent[oldest] = now
+            self.cursor[0] = (oldest + 1) % self.max_rps
+            return False
+
+    def do_GET(self):
+        if self.path != "/stats":
+            self.send_error(404)
+            return
+        with self.lock:
+            stats = dict(zip(STATS, self.stats))
+        self.send_json(stats)
+
+    def do_POST(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if not self.path.endswith("svcFetchDB.php"):
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode())
+        sql = form.get("sql", [""])[0]
+        sold = form.get("sold", [""])[0]
+        token = form.get("s", [""])[0]
+        self.count("requests")
+
+        if self.max_rps and self.over_rate_limit():
+            self.count("throttled")
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.drop_rate and random.random() < self.drop_rate:
+            # Hang up without answering, like a proxy timing out
+            self.count("dropped")
+            self.close_connection = True
+            return
+        if self.error_rate and random.random() < self.error_rate:
+            self.count("errors")
+            self.send_error(503, "Injected failure")
+            return
+        if self.session_cookie and self.session_cookie not in (self.headers.get("Cookie") or ""):
+            self.count("errors")
+            self.send_error(403, "Not signed in")
+            return
+        if token != hashlib.md5(sql.encode()).hexdigest():
+            self.count("errors")
+            self.send_error(403, "Bad token")
+            return
+
+        recorded = self.responses.get((sold, sql))
+        if recorded is not None:
+            self.count("replayed")
+            self.send_payload(recorded)
+            return
+        rows = query(self.dataset, sql, sold, self.row_cap)
+        if rows is None:
+            body = {"columns": [], "rows": [], "error": {"code": 1, "message": "Bad query", "query": sql}}
+        else:
+            self.count("rows", len(rows))
+            body = {"columns": [], "rows": rows, "error": {"code": 0, "message": "", "query": ""}}
+        self.send_json(body)
+
+    def send_json(self, body):
+        self.send_payload(json.dumps(body).encode())
+
+    def send_payload(self, payload):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def make_server(port=0, listings=20000, seed=42, row_cap=500, latency=0.0, session_cookie=None,
+                fixtures=None, error_rate=0.0, drop_rate=0.0, max_rps=0, water=False):
+    """Build a stub server bound to 127.0.0.1 and return (server, url)
+
+    With fixtures, recorded responses are replayed and their rows replace the
+    synthetic listings. Counters and the rate limit window live in shared
+    memory, so processes forked from the server share them.
+    """
+    if fixtures:
+        responses, dataset = load_fixtures(fixtures)
+    else:
+        responses, dataset = {}, make_listings(listings, seed, water)
+    handler = type("Handler", (StubHandler,), {
+        "dataset": dataset,
+        "responses": responses,
+        "row_cap": row_cap,
+        "latency": latency,
+        "error_rate": error_rate,
+        "drop_rate": drop_rate,
+        "max_rps": max_rps,
+        "recent": multiprocessing.RawArray("d", [float("-inf")] * max_rps),
+        "cursor": multiprocessing.RawArray("i", 1),
+        "session_cookie": session_cookie,
+        "stats": multiprocessing.RawArray("q", len(STATS)),
+        "lock": multiprocessing.Lock(),
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    url = f"http://127.0.0.1:{server.server_address[1]}/svcFetchDB.php"
+    return server, url
+
+def start_stub(**kwargs):
+    """Start the stub in a background thread and return (server, url)"""
+    server, url = make_server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, url
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--listings", type=int, default=20000, help="listings per category")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--row-cap", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--require-cookie", metavar="NAME=VALUE",
+                        help="reject requests without this cookie, to simulate an expired session")
+    parser.add_argument("--fixtures", help="replay a fixture file recorded with --record")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests answered with 503 (default: 0)")
+    parser.add_argument("--drop-rate", type=float, default=0.0,
+                        help="fraction of requests whose connection is closed without a response")
+    parser.add_argument("--max-rps", type=int, default=0,
+                        help="answer 429 with Retry-After once this many requests arrive within a second")
+    parser.add_argument("--water", action="store_true",
+                        help="leave rough water and mountain areas without listings, like the real map")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="server processes sharing the port, for clients that outrun one process (default: 1)")
+    args = parser.parse_args()
+
+    server, url = make_server(args.port, args.listings, args.seed, args.row_cap, args.latency,
+                              args.require_cookie, args.fixtures, args.error_rate, args.drop_rate,
+                              args.max_rps, args.water)
+    children = []
+    for _ in range(args.processes - 1):
+        pid = os.fork()
+        if pid == 0:
+            # Die with the parent rather than keep the port open
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            server.serve_forever()
+            os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    if args.fixtures:
+        print(f"Replaying {args.fixtures} at {url}", flush=True)
+    else:
+        print(f"Serving {args.listings} synthetic listings per category at {url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        stop(signal.SIGINT, None)
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""Content-addressed archive of runs
+
+Consecutive runs repeat most of their rows, so the archive stores every
+distinct CSV row version once, keyed by a hash of its bytes, and each run
+becomes a manifest of references to those rows. Any run's files can be
+rebuilt byte for byte, and every version of one MLS number is found through
+a memory-mapped index without reading the runs.
+
+Layout of the archive directory:
+
+    rows.dat    every distinct row version, appended exactly as written
+    rows.idx    one ROW record per row version: its offset and length in
+                rows.dat, content hash, category, first run and MLS number
+    mls.idx     (MLS number, row id) pairs sorted by MLS number, rebuilt
+                once enough rows are newer than it
+    runs.txt    archived run names, in the order they were added
+    runs/       NAME.json lists a run's files, NAME.refs holds the row ids of
+                its CSVs (delta-encoded and zlib-compressed)
+    blobs/      a run's other files (JSON, metrics, Parquet, Arrow),
+                gzip-compressed and named by their SHA-256
+
+Only one process should add runs at a time. A crash while adding leaves at
+most unreferenced rows behind; the run is simply added again.
+
+    uv run zealty_archive.py add                       # every data/run-* not archived yet
+    uv run zealty_archive.py restore run-2026-10-17_06-00-00 --output /tmp/run
+    uv run zealty_archive.py history R2891234
+"""
+import argparse
+import csv
+import glob
+import gzip
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import time
+import zlib
+from array import array
+from datetime import datetime
+from itertools import accumulate
+
+from zealty_listing import COLUMNS
+from zealty_output import CATEGORY_FILES, RUNS_GLOB
+
+ARCHIVE_DIR = os.path.join("data", "archive")
+
+# rows.idx record: offset, length, content hash, category, first run, MLS number
+ROW = struct.Struct("<QI8sBI16s")
+
+# mls.idx is a count of the rows it covers followed by (MLS number, row id) entries
+MLS_HEADER = struct.Struct("<Q")
+MLS_ENTRY = struct.Struct("<16sI")
+
+CATEGORIES = list(CATEGORY_FILES)
+OTHER_CATEGORY = 255
+
+# Rebuild mls.idx once more rows than this (and than this share of the
+# indexed rows) are newer than it; newer rows are looked up in memory
+MIN_REINDEX_ROWS = 10_000
+REINDEX_FRACTION = 0.1
+
+def content_hash(record):
+    return hashlib.blake2b(record, digest_size=8).digest()
+
+def mls_key(record):
+    """The MLS number of a CSV record, as a fixed-width key"""
+    return record.split(b",", 1)[0].strip(b'"\r\n')[:16].ljust(16, b"\0")
+
+def csv_records(f):
+    """Split a binary CSV file into records with their line endings, keeping quoted newlines inside"""
+    pending = b""
+    for line in f:
+        pending += line
+        # A record ends at a line break outside quotes; "" escapes keep the count even
+        if pending.count(b'"') % 2 == 0:
+            yield pending
+            pending = b""
+    if pending:
+        yield pending
+
+def file_category(path):
+    name = os.path.basename(path)
+    for code, prefix in enumerate(CATEGORY_FILES.values()):
+        if name.startswith(prefix):
+            return code
+    return OTHER_CATEGORY
+
+def encode_refs(ids):
+    deltas = array("i", (b - a for a, b in zip([-1] + ids[:-1], ids)))
+    if sys.byteorder == "big":
+        deltas.byteswap()
+    return zlib.compress(deltas.tobytes(), 6)
+
+def decode_refs(data):
+    deltas = array("i")
+    deltas.frombytes(zlib.decompress(data))
+    if sys.byteorder == "big":
+        deltas.byteswap()
+    return [i - 1 for i in accumulate(deltas)]
+
+def _map(path):
+    """A read-only memory map of a file, or None if it is missing or empty"""
+    try:
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _write_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class Archive:
+    """An archive directory, for adding runs and reading them back"""
+
+    def __init__(self, path=ARCHIVE_DIR):
+        self.path = path
+        os.makedirs(os.path.join(path, "runs"), exist_ok=True)
+        os.makedirs(os.path.join(path, "blobs"), exist_ok=True)
+        self._rows = self._index = self._mls = None
+        self._open()
+
+    def _file(self, *parts):
+        return os.path.join(self.path, *parts)
+
+    def _open(self):
+        self.close()
+        idx_path = self._file("rows.idx")
+        size = os.path.getsize(idx_path) if os.path.exists(idx_path) else 0
+        if size % ROW.size:
+            # A partial record from an interrupted add
+            with open(idx_path, "r+b") as f:
+                f.truncate(size - size % ROW.size)
+        self.count = size // ROW.size
+        self._rows = _map(self._file("rows.dat"))
+        self._index = _map(idx_path)
+        self._mls = _map(self._file("mls.idx"))
+        self.indexed = MLS_HEADER.unpack_from(self._mls)[0] if self._mls else 0
+        if self.indexed > self.count:
+            self._mls, self.indexed = None, 0
+        self._mls_entries = (len(self._mls) - MLS_HEADER.size) // MLS_ENTRY.size if self._mls else 0
+        # Rows newer than mls.idx, by MLS number
+        self._tail = {}
+        for row_id in range(self.indexed, self.count):
+            self._tail.setdefault(self.record(row_id)[5], []).append(row_id)
+        try:
+            with open(self._file("runs.txt"), encoding="utf-8") as f:
+                names = [line.strip() for line in f if line.strip()]
+        except OSError:
+            names = []
+        self.order = list(dict.fromkeys(names))
+        self.runs = [name for name in self.order if os.path.exists(self._file("runs", name + ".json"))]
+
+    def close(self):
+        for name in ("_rows", "_index", "_mls"):
+            mapped = getattr(self, name, None)
+            if mapped is not None:
+                mapped.close()
+            setattr(self, name, None)
+
+    def record(self, row_id):
+        """(offset, length, hash, category, first run, MLS key) of a row version"""
+        return ROW.unpack_from(self._index, row_id * ROW.size)
+
+    def row(self, row_id):
+        """The bytes of a row version"""
+        offset, length = ROW.unpack_from(self._index, row_id * ROW.size)[:2]
+        return self._rows[offset:offset + length]
+
+    def versions(self, key):
+        """Row ids of every version of an MLS key, oldest first"""
+        lo, hi = 0, self._mls_entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if MLS_ENTRY.unpack_from(self._mls, MLS_HEADER.size + mid * MLS_ENTRY.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        ids = []
+        while lo < self._mls_entries:
+            found, row_id = MLS_ENTRY.unpack_from(self._mls, MLS_HEADER.size + lo * MLS_ENTRY.size)
+            if found != key:
+                break
+            ids.append(row_id)
+            lo += 1
+        return ids + self._tail.get(key, [])
+
+    def history(self, mls_number):
+        """(first run, category, row bytes) of every version of an MLS number, oldest first"""
+        key = mls_number.encode()[:16].ljust(16, b"\0")
+        result = []
+        for row_id in self.versions(key):
+            _, _, _, category, run, _ = self.record(row_id)
+            result.append((self.order[run], CATEGORIES[category] if category < len(CATEGORIES) else "other",
+                           self.row(row_id)))
+        return result
+
+    def manifest(self, name):
+        with open(self._file("runs", name + ".json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def refs(self, name):
+        with open(self._file("runs", name + ".refs"), "rb") as f:
+            return decode_refs(f.read())
+
+    def _previous(self):
+        """Content hash -> row ids of the last archived run, which most new rows repeat"""
+        if not self.runs:
+            return {}
+        previous = {}
+        for row_id in self.refs(self.runs[-1]):
+            previous.setdefault(self.record(row_id)[2], []).append(row_id)
+        return previous
+
+    def _find(self, digest, record, previous, added):
+        for row_id in previous.get(digest, ()):
+            if self.row(row_id) == record:
+                return row_id
+        for row_id, stored in added.get(digest, ()):
+            if stored == record:
+                return row_id
+        for row_id in self.versions(mls_key(record)):
+            if self.record(row_id)[2] == digest and self.row(row_id) == record:
+                return row_id
+        return None
+
+    def _store_blob(self, path):
+        digest = _sha256(path)
+        blob_path = self._file("blobs", digest + ".gz")
+        written = 0
+        if not os.path.exists(blob_path):
+            with open(path, "rb") as src, gzip.open(blob_path + ".tmp", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(blob_path + ".tmp", blob_path)
+            written = os.path.getsize(blob_path)
+        return digest, written
+
+    def add_run(self, run_dir):
+        """Archive a run directory; returns its manifest"""
+        name = os.path.basename(os.path.normpath(run_dir))
+        if name in self.runs:
+            raise ValueError(f"{name} is already archived")
+        if name not in self.order:
+            with open(self._file("runs.txt"), "a", encoding="utf-8") as f:
+                f.write(name + "\n")
+            self.order.append(name)
+        run = self.order.index(name)
+        previous = self._previous()
+        added = {}
+        next_id = self.count
+        ids, files, blobs = [], {}, {}
+        original = written = 0
+
+        data_path = self._file("rows.dat")
+        offset = os.path.getsize(data_path) if os.path.exists(data_path) else 0
+        with open(data_path, "ab") as data, open(self._file("rows.idx"), "ab") as index:
+            for path in sorted(glob.glob(os.path.join(run_dir, "**", "*"), recursive=True)):
+                if not os.path.isfile(path) or path.endswith(".partial"):
+                    continue
+                rel = os.path.relpath(path, run_dir).replace(os.sep, "/")
+                original += os.path.getsize(path)
+                if not path.endswith(".csv"):
+                    blobs[rel], size = self._store_blob(path)
+                    written += size
+                    continue
+                category = file_category(path)
+                start = len(ids)
+                with open(path, "rb") as f:
+                    records = csv_records(f)
+                    header = next(records, b"")
+                    for record in records:
+                        digest = content_hash(record)
+                        row_id = self._find(digest, record, previous, added)
+                        if row_id is None:
+                            row_id = next_id
+                            next_id += 1
+                            data.write(record)
+                            index.write(ROW.pack(offset, len(record), digest, category, run, mls_key(record)))
+                            offset += len(record)
+                            written += len(record) + ROW.size
+                            added.setdefault(digest, []).append((row_id, record))
+                        ids.append(row_id)
+                files[rel] = {"header": header.decode("utf-8"), "start": start, "count": len(ids) - start}
+
+        refs = encode_refs(ids)
+        manifest = {
+            "name": name,
+            "archived": datetime.now().isoformat(timespec="seconds"),
+            "files": files,
+            "blobs": blobs,
+            "rows": len(ids),
+            "new_rows": next_id - self.count,
+            "original_bytes": original,
+        }
+        manifest["written_bytes"] = written + len(refs)
+        body = json.dumps(manifest, indent=1).encode()
+        manifest["written_bytes"] += len(body)
+        # The manifest goes last: a run only counts as archived once it exists
+        _write_atomic(self._file("runs", name + ".refs"), refs)
+        _write_atomic(self._file("runs", name + ".json"), body)
+        self._open()
+        if self.count - self.indexed > max(MIN_REINDEX_ROWS, REINDEX_FRACTION * self.indexed):
+            self.reindex()
+        return manifest
+
+    def reindex(self):
+        """Merge the rows newer than mls.idx into it"""
+        newer = sorted((key, row_id) for key, ids in self._tail.items() for row_id in ids)
+        older = (MLS_ENTRY.unpack_from(self._mls, MLS_HEADER.size + i * MLS_ENTRY.size)
+                 for i in range(self._mls_entries))
+        path = self._file("mls.idx")
+        with open(path + ".tmp", "wb") as f:
+            f.write(MLS_HEADER.pack(self.count))
+            f.writelines(MLS_ENTRY.pack(*entry) for entry in heapq.merge(older, newer))
+        os.replace(path + ".tmp", path)
+        self._open()
+
+    def iter_file(self, name, rel, manifest=None, ids=None):
+        """The bytes of one archived file of a run, in chunks"""
+        manifest = manifest or self.manifest(name)
+        if rel in manifest["blobs"]:
+            with gzip.open(self._file("blobs", manifest["blobs"][rel] + ".gz"), "rb") as f:
+                yield from iter(lambda: f.read(1 << 20), b"")
+            return
+        entry = manifest["files"][rel]
+        ids = self.refs(name) if ids is None else ids
+        yield entry["header"].encode("utf-8")
+        for start in range(entry["start"], entry["start"] + entry["count"], 1000):
+            stop = min(start + 1000, entry["start"] + entry["count"])
+            yield b"".join(self.row(row_id) for row_id in ids[start:stop])
+
+    def restore(self, name, output_dir):
+        """Rebuild every file of an archived run under output_dir"""
+        manifest = self.manifest(name)
+        ids = self.refs(name)
+        for rel in list(manifest["files"]) + list(manifest["blobs"]):
+            path = os.path.join(output_dir, *rel.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.writelines(self.iter_file(name, rel, manifest, ids))
+
+    def verify(self, name, run_dir):
+        """Whether every file of run_dir is archived and rebuilds byte for byte"""
+        manifest = self.manifest(name)
+        ids = self.refs(name)
+        for rel in list(manifest["files"]) + list(manifest["blobs"]):
+            digest = hashlib.sha256()
+            for chunk in self.iter_file(name, rel, manifest, ids):
+                digest.update(chunk)
+            path = os.path.join(run_dir, *rel.split("/"))
+            if not os.path.exists(path) or _sha256(path) != digest.hexdigest():
+                return False
+        on_disk = [p for p in glob.glob(os.path.join(run_dir, "**", "*"), recursive=True)
+                   if os.path.isfile(p) and not p.endswith(".partial")]
+        return len(on_disk) == len(manifest["files"]) + len(manifest["blobs"])
+
+    def size(self):
+        """Bytes the archive takes on disk"""
+        return sum(os.path.getsize(p) for p in glob.glob(os.path.join(self.path, "**", "*"), recursive=True)
+                   if os.path.isfile(p))
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="Content-addressed archive of scraped runs")
+    parser.add_argument("--archive", default=ARCHIVE_DIR, help=f"archive directory (default: {ARCHIVE_DIR})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="archive run directories")
+    add.add_argument("runs", nargs="*", metavar="RUN_DIR", help=f"runs to add (default: every {RUNS_GLOB} not archived)")
+    add.add_argument("--remove", action="store_true",
+                     help="delete each run directory once its archived copy rebuilds byte for byte")
+    restore = commands.add_parser("restore", help="rebuild an archived run's files")
+    restore.add_argument("name", help="run name, e.g. run-2026-10-17_06-00-00")
+    restore.add_argument("--output", help="directory to write to (default: data/NAME)")
+    history = commands.add_parser("history", help="every archived version of an MLS number as CSV")
+    history.add_argument("mls_number")
+    commands.add_parser("list", help="archived runs and how much they take")
+    args = parser.parse_args(argv)
+
+    archive = Archive(args.archive)
+    if args.command == "add":
+        run_dirs = args.runs or [d for d in sorted(glob.glob(RUNS_GLOB))
+                                 if os.path.isdir(d) and os.path.basename(d) not in archive.runs]
+        for run_dir in run_dirs:
+            started = time.perf_counter()
+            try:
+                manifest = archive.add_run(run_dir)
+            except ValueError as e:
+                print(f"Skipping {run_dir}: {e}")
+                continue
+            print(f"{manifest['name']}: {manifest['rows']} rows, {manifest['new_rows']} new, "
+                  f"{manifest['original_bytes'] / 1e6:.1f} MB -> {manifest['written_bytes'] / 1e6:.2f} MB written "
+                  f"in {time.perf_counter() - started:.2f}s")
+            if args.remove:
+                if archive.verify(manifest["name"], run_dir):
+                    shutil.rmtree(run_dir)
+                    print(f"  verified and removed {run_dir}")
+                else:
+                    print(f"  WARNING: {run_dir} doesn't rebuild identically, kept it")
+        print(f"Archive {args.archive}: {len(archive.runs)} runs, {archive.count} distinct rows, "
+              f"{archive.size() / 1e6:.1f} MB")
+    elif args.command == "restore":
+        if args.name not in archive.runs:
+            print(f"ERROR: {args.name} is not in {args.archive}")
+            exit(1)
+        output = args.output or os.path.join("data", args.name)
+        archive.restore(args.name, output)
+        print(f"Restored {args.name} to {output}")
+    elif args.command == "history":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["first_seen", "category"] + COLUMNS)
+        for first_seen, category, record in archive.history(args.mls_number):
+            writer.writerow([first_seen, category] + next(csv.reader([record.decode("utf-8")])))
+    else:
+        total = 0
+        for name in archive.runs:
+            manifest = archive.manifest(name)
+            total += manifest["original_bytes"]
+            print(f"{name}  {manifest['rows']:>8} rows  {manifest['new_rows']:>7} new  "
+                  f"{manifest['original_bytes'] / 1e6:>7.1f} MB")
+        size = archive.size()
+        print(f"{len(archive.runs)} runs, {total / 1e6:.1f} MB as run directories, {size / 1e6:.1f} MB archived"
+              + (f" ({total / size:.0f}x smaller)" if size else ""))
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,137 @@
+"""On-disk cache of svcFetchDB.php responses
+
+Rows are stored gzip-compressed, one file per (sold flag, SQL) pair. Entries
+expire after a per-category TTL, and once the cache grows past its size cap
+the least recently used entries are evicted.
+
+Shard workers share one cache directory, so a scan leaves other processes'
+temporary files alone until they are TMP_GRACE seconds old, and put()
+gives up quietly if another process removes its temporary file.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+CACHE_DIR = os.getenv("ZEALTY_CACHE_DIR", ".zealty_cache")
+
+# Seconds a cached response stays fresh, per sold flag
+DEFAULT_TTLS = {
+    "active": 15 * 60,
+    "sold": 24 * 60 * 60,
+    "expired": 6 * 60 * 60,
+}
+
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+# Temporary files older than this are left over from a crashed writer
+TMP_GRACE = 60 * 60
+
+class ResponseCache:
+    """Compressed response rows keyed by a hash of (sold flag, SQL)"""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, ttls=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._sizes = {}
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """Index existing entries, dropping any older than the longest TTL"""
+        oldest = time.time() - max(self.ttls.values())
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                    if name.endswith(".tmp"):
+                        # Possibly being written by another process right now
+                        if stat.st_mtime < time.time() - TMP_GRACE:
+                            os.remove(path)
+                        continue
+                    if not name.endswith(".json.gz") or stat.st_mtime < oldest:
+                        os.remove(path)
+                        continue
+                except OSError:
+                    # Removed by another process since the walk listed it
+                    continue
+                self._sizes[path] = stat.st_size
+        self.size = sum(self._sizes.values())
+
+    def _path(self, sql, sold_flag):
+        key = hashlib.md5(f"{sold_flag}\0{sql}".encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], key + ".json.gz")
+
+    def get(self, sql, sold_flag):
+        """Return cached rows, or None on a miss or an expired entry"""
+        path = self._path(sql, sold_flag)
+        ttl = self.ttls.get(sold_flag, 0)
+        try:
+            stat = os.stat(path)
+            if time.time() - stat.st_mtime > ttl:
+                raise FileNotFoundError(path)
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                rows = json.load(f)
+            # Record the access for LRU eviction without touching the
+            # write time the TTL is measured from
+            os.utime(path, (time.time(), stat.st_mtime))
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return rows
+
+    def put(self, sql, sold_flag, rows):
+        """Store rows, evicting least recently used entries if over the size cap"""
+        path = self._path(sql, sold_flag)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump(rows, f)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            # Another process removed the temporary file or the entry, so
+            # this response just isn't cached
+            return
+        with self._lock:
+            self.size += size - self._sizes.get(path, 0)
+            self._sizes[path] = size
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries until the cache is back under 90% of its cap"""
+        def last_used(path):
+            try:
+                return os.stat(path).st_atime
+            except OSError:
+                return 0
+
+        target = self.max_bytes * 0.9
+        for path in sorted(self._sizes, key=last_used):
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.size -= self._sizes.pop(path)
+            self.evictions += 1
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = f", {self.hits / total:.0%} hit rate" if total else ""
+        return (f"Cache: {self.hits} hits, {self.misses} misses{rate}, {self.evictions} evictions, "
+                f"{self.size / 1024 / 1024:.1f} MB in {self.directory}")
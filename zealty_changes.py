@@ -0,0 +1,178 @@
+"""Change feed between two runs
+
+Compares the snapshots of two run directories and writes one JSON line per
+change: listings that are new, that were removed, whose price changed, or
+whose status changed (for sale, sold or expired).
+
+Each run is read as a stream and external-sorted by MLS number: records are
+sorted in chunks of at most `chunk_rows`, chunks that don't fit are spilled
+to temporary files, and the chunks are merged back with heapq.merge. The two
+sorted streams are then walked side by side, so memory stays bounded by the
+chunk size however big the snapshots get.
+
+    uv run zealty_changes.py                                  # the two newest runs in data/
+    uv run zealty_changes.py data/run-A data/run-B --events price_changed status_changed > changes.jsonl
+"""
+import argparse
+import glob
+import heapq
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+from itertools import groupby
+from operator import itemgetter
+
+from zealty_output import CATEGORY_FILES, RUNS_GLOB, iter_rows
+
+# Records sorted in memory before a chunk is spilled to disk
+DEFAULT_CHUNK_ROWS = 200_000
+
+# Records per pickle in a spill file, which is also what merging holds of each spill
+SPILL_BATCH_ROWS = 1_000
+
+EVENTS = ("new", "removed", "price_changed", "status_changed")
+
+# A listing found in several files of one run gets the first of these
+# statuses: the for-sale file can lag behind a sale or expiry, and the
+# active -> sold transition is what the feed is for
+STATUSES = ("sold", "expired", "active")
+
+def snapshot_files(run_dir):
+    """(status, directory, name) of every saved category in a run, including region subdirectories"""
+    found = set()
+    for path in glob.glob(os.path.join(run_dir, "*.*")) + glob.glob(os.path.join(run_dir, "*", "*.*")):
+        name, ext = os.path.splitext(os.path.basename(path))
+        if ext not in (".csv", ".parquet", ".arrow"):
+            continue
+        for status, prefix in CATEGORY_FILES.items():
+            if name.startswith(prefix):
+                found.add((status, os.path.dirname(path), name))
+    return sorted(found)
+
+def records(run_dir):
+    """[mls_number, status rank, price, date, address, neighborhood, property_type] of every listing in a run"""
+    for status, directory, name in snapshot_files(run_dir):
+        rank = STATUSES.index(status)
+        for row in iter_rows(directory, name):
+            if row.mls_number:
+                yield [row.mls_number, rank, row.price, row.date.isoformat() if row.date else None,
+                       row.address, row.neighborhood, row.property_type]
+
+def _spill(chunk, tmp_dir):
+    chunk.sort(key=itemgetter(0, 1))
+    with tempfile.NamedTemporaryFile("wb", dir=tmp_dir, suffix=".spill", prefix="zealty-changes-", delete=False) as f:
+        for start in range(0, len(chunk), SPILL_BATCH_ROWS):
+            pickle.dump(chunk[start:start + SPILL_BATCH_ROWS], f, pickle.HIGHEST_PROTOCOL)
+    return f.name
+
+def _read_spill(path):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+            yield from batch
+
+def sorted_records(run_dir, chunk_rows=DEFAULT_CHUNK_ROWS, tmp_dir=None, spills=None):
+    """A run's records sorted by MLS number and status rank, one per MLS number
+
+    Spill files are created in tmp_dir and their paths appended to `spills`
+    so the caller can remove them once the stream is consumed.
+    """
+    own = []
+    chunk = []
+    for record in records(run_dir):
+        chunk.append(record)
+        if len(chunk) >= chunk_rows:
+            own.append(_spill(chunk, tmp_dir))
+            if spills is not None:
+                spills.append(own[-1])
+            chunk = []
+    chunk.sort(key=itemgetter(0, 1))
+    if own:
+        merged = heapq.merge(*map(_read_spill, own), chunk, key=itemgetter(0, 1))
+    else:
+        merged = iter(chunk)
+    # The first record of an MLS number has its highest-priority status
+    for _, group in groupby(merged, key=itemgetter(0)):
+        yield next(group)
+
+def _event(kind, record, **extra):
+    mls_number, rank, price, listed, address, neighborhood, property_type = record
+    event = {"event": kind, "mls_number": mls_number, "status": STATUSES[rank], "price": price}
+    event.update(extra)
+    event.update(date=listed, address=address, neighborhood=neighborhood, property_type=property_type)
+    return event
+
+def diff_records(old, new):
+    """Change events between two record streams sorted by MLS number"""
+    old, new = iter(old), iter(new)
+    a, b = next(old, None), next(new, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and a[0] < b[0]):
+            yield _event("removed", a)
+            a = next(old, None)
+        elif a is None or b[0] < a[0]:
+            yield _event("new", b)
+            b = next(new, None)
+        else:
+            if a[1] != b[1]:
+                yield _event("status_changed", b, old_status=STATUSES[a[1]], old_price=a[2])
+            elif a[2] != b[2] and a[2] is not None and b[2] is not None:
+                yield _event("price_changed", b, old_price=a[2],
+                             change_pct=round((b[2] - a[2]) * 100 / a[2], 2) if a[2] else None)
+            a, b = next(old, None), next(new, None)
+
+def changes(old_run, new_run, chunk_rows=DEFAULT_CHUNK_ROWS, tmp_dir=None):
+    """Change events from old_run to new_run, in MLS number order"""
+    spills = []
+    try:
+        yield from diff_records(sorted_records(old_run, chunk_rows, tmp_dir, spills),
+                                sorted_records(new_run, chunk_rows, tmp_dir, spills))
+    finally:
+        for path in spills:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="JSON-lines change feed between two scraped runs")
+    parser.add_argument("runs", nargs="*", metavar="RUN_DIR",
+                        help=f"the older and the newer run (default: the two newest {RUNS_GLOB})")
+    parser.add_argument("--events", nargs="+", choices=EVENTS, default=list(EVENTS), help="events to write (default: all)")
+    parser.add_argument("--output", "-o", help="write the events to this file instead of stdout")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS,
+                        help=f"records sorted in memory before spilling to disk (default: {DEFAULT_CHUNK_ROWS})")
+    parser.add_argument("--tmp-dir", help="directory for spill files (default: the system temp directory)")
+    args = parser.parse_args(argv)
+
+    runs = args.runs or sorted(d for d in glob.glob(RUNS_GLOB) if snapshot_files(d))[-2:]
+    if len(runs) != 2:
+        parser.error("give two run directories, or have at least two runs in data/")
+    for run_dir in runs:
+        if not snapshot_files(run_dir):
+            print(f"ERROR: no listing files in {run_dir}")
+            exit(1)
+
+    started = time.perf_counter()
+    counts = dict.fromkeys(EVENTS, 0)
+    wanted = set(args.events)
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for event in changes(runs[0], runs[1], args.chunk_rows, args.tmp_dir):
+            counts[event["event"]] += 1
+            if event["event"] in wanted:
+                output.write(json.dumps(event) + "\n")
+    finally:
+        if args.output:
+            output.close()
+    summary = ", ".join(f"{count} {kind}" for kind, count in counts.items())
+    print(f"{runs[0]} -> {runs[1]}: {summary} in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    sys.exit(run())
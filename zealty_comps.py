@@ -0,0 +1,499 @@
+"""Comparable sales: a spatial index over a run's sold and for-sale listings
+
+Listings are projected onto a local flat grid (accurate to well under 1%
+across Metro Vancouver) and bucketed by category, bedrooms and CELL_METERS
+square cell. Sorted by bucket, the listings of any bucket are one contiguous
+slice, so a radius query for 2-bedroom solds only measures the 2-bedroom
+solds in the cells its circle overlaps, and a nearest query widens its
+radius until it holds k matches (up to DEFAULT_MAX_METERS). Within a
+partition the cells of one grid column are consecutive buckets, so the
+cells a circle overlaps in a column are one slice of rows: a query costs a
+slice per column, not per cell. Property type and date filters are applied
+to those candidates only, and subjects whose type or bedrooms match no
+listing at all are answered without searching.
+
+Every query takes a batch of subjects and does the work for all of them in a
+few array operations, which is what keeps pricing thousands of subject
+properties at a few microseconds each. Large batches are split into chunks
+so memory stays bounded.
+
+The index is built from the run's files once and cached next to them in
+comps_index.npz.
+
+    uv run --with numpy zealty_comps.py data/run-... --lat 49.2634 --lon -123.1382 --radius 500 --beds 2 --months 6
+    uv run --with numpy zealty_comps.py data/run-... --subjects subjects.csv --nearest 10 > comps.csv
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+import time
+from datetime import date
+from typing import NamedTuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from zealty_output import iter_rows
+from zealty_stats import grouped_percentiles, run_files, signature
+
+INDEX_FILE = "comps_index.npz"
+
+# Side of a grid cell; about the radius of a typical comps search
+CELL_METERS = 250
+
+# Meters per degree of latitude, and of longitude at the equator
+METERS_PER_DEGREE = 111_320
+
+# Cell coordinates are offset by this much so that cell keys are never negative
+CELL_OFFSET = 1 << 20
+CELLS = (2 * CELL_OFFSET) ** 2
+
+# Bedroom partitions: unknown, 0, 1, ... and one for BED_SLOTS - 2 or more
+BED_SLOTS = 12
+
+CATEGORY_CODES = {"active": 0, "sold": 1}
+
+# Day number of listings without a date
+UNKNOWN_DAY = -(1 << 31)
+
+# Widest nearest search by default; further away sales aren't comparable
+DEFAULT_MAX_METERS = 20_000
+
+# Row slices and candidate listings handled per chunk of subjects
+SLICES_PER_CHUNK = 1 << 20
+CANDIDATES_PER_CHUNK = 1 << 21
+
+class Matches(NamedTuple):
+    """Every match of a batch query, sorted by subject and then distance"""
+    subject: "np.ndarray"  # index of the subject in the batch
+    row: "np.ndarray"  # index of the listing in the CompIndex
+    distance: "np.ndarray"  # meters
+
+class _Subjects(NamedTuple):
+    """Per-subject query arrays, as built by CompIndex._subjects"""
+    x: "np.ndarray"
+    y: "np.ndarray"
+    partitions: "np.ndarray"  # category and bedroom partitions to search, -1 for none
+    type_codes: "np.ndarray"  # -1 for any property type
+    beds: "np.ndarray"  # -1 for any bedrooms
+
+    def take(self, index):
+        return _Subjects(*(values[index] for values in self))
+
+def _per_subject(value, count, dtype, missing):
+    """Broadcast a scalar or per-subject sequence to an array, with None as `missing`"""
+    if value is None:
+        return np.full(count, missing, dtype=dtype)
+    if np.ndim(value) == 0:
+        return np.full(count, value, dtype=dtype)
+    return np.array([missing if v is None else v for v in value], dtype=dtype)
+
+def _known(value, missing):
+    """value if it is a number, else `missing` (blank, or text such as "3+1" bedrooms)"""
+    return value if type(value) in (int, float) else missing
+
+def _number(value):
+    """A float array value for JSON: None for NaN, whole numbers as int"""
+    if np.isnan(value):
+        return None
+    return int(value) if float(value).is_integer() else float(value)
+
+def _day(value):
+    """Days since 1970-01-01 of a date or ISO date string"""
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return (value - date(1970, 1, 1)).days
+
+class CompIndex:
+    """Grid index over the sold and for-sale listings of one run"""
+
+    ARRAYS = ("x", "y", "latitude", "longitude", "price", "sqft", "bedrooms", "bathrooms", "day",
+              "category", "property_type", "mls_number", "address", "property_types", "buckets", "offsets")
+
+    def __init__(self, arrays, origin, cell=CELL_METERS):
+        self.origin = origin
+        self.cell = cell
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self._type_codes = {str(label): code for code, label in enumerate(self.property_types)}
+        # Every (partition, property type) that has listings, to answer hopeless subjects at once
+        partition = np.repeat(self.buckets // CELLS, np.diff(self.offsets))
+        self._groups = np.unique(partition * len(self.property_types) + self.property_type)
+        self._groups_partitions = np.unique(partition)
+
+    def __len__(self):
+        return len(self.x)
+
+    @classmethod
+    def from_listings(cls, listings_by_category, cell=CELL_METERS):
+        """Build an index from {"sold": Listings, "active": Listings}"""
+        rows, categories = [], []
+        for category, listings in listings_by_category.items():
+            located = [row for row in listings if row.latitude is not None and row.longitude is not None]
+            rows += located
+            categories += [CATEGORY_CODES[category]] * len(located)
+        if rows:
+            columns = dict(zip(rows[0]._fields, map(list, zip(*rows))))
+        else:
+            columns = {name: [] for name in ("latitude", "longitude", "price", "sqft", "bedrooms", "bathrooms",
+                                             "date", "property_type", "mls_number", "address")}
+        latitude = np.array(columns["latitude"], dtype=np.float64)
+        longitude = np.array(columns["longitude"], dtype=np.float64)
+        origin = (float(latitude.mean()) if len(latitude) else 49.25, float(longitude.mean()) if len(longitude) else -123.1)
+        x, y = project(latitude, longitude, origin)
+        property_types, type_codes = np.unique(np.array([t or "" for t in columns["property_type"]], dtype=str),
+                                               return_inverse=True)
+        epoch = date(1970, 1, 1)
+        arrays = {
+            "x": x,
+            "y": y,
+            "latitude": latitude,
+            "longitude": longitude,
+            "price": np.array(columns["price"], dtype=np.float64),
+            "sqft": np.array([_known(s, 0) or np.nan for s in columns["sqft"]], dtype=np.float64),
+            "bedrooms": np.array([_known(b, -1) for b in columns["bedrooms"]], dtype=np.int16),
+            "bathrooms": np.array([_known(b, np.nan) for b in columns["bathrooms"]], dtype=np.float64),
+            "day": np.array([(d - epoch).days if d else UNKNOWN_DAY for d in columns["date"]], dtype=np.int32),
+            "category": np.array(categories, dtype=np.int8),
+            "property_type": type_codes.astype(np.int16).ravel(),
+            "mls_number": np.array([m or "" for m in columns["mls_number"]], dtype=str),
+            "address": np.array([a or "" for a in columns["address"]], dtype=str),
+            "property_types": property_types,
+        }
+
+        # Sort every listing by its bucket so each bucket is one slice, with
+        # offsets[i]:offsets[i + 1] the rows of buckets[i]
+        keys = bucket_keys(arrays["category"], arrays["bedrooms"], cell_keys(x, y, cell))
+        order = np.argsort(keys, kind="stable")
+        for name, values in list(arrays.items()):
+            if name != "property_types":
+                arrays[name] = values[order]
+        arrays["buckets"], starts = np.unique(keys[order], return_index=True)
+        arrays["offsets"] = np.append(starts, len(order)).astype(np.int64)
+        return cls(arrays, origin, cell)
+
+    def save(self, path, sources):
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        meta = {"origin": self.origin, "cell": self.cell, "sources": sources}
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, sources=None):
+        """The saved index, or None if it is missing or was built from other files"""
+        try:
+            with np.load(path) as saved:
+                meta = json.loads(str(saved["meta"]))
+                if sources is not None and meta["sources"] != sources:
+                    return None
+                arrays = {name: saved[name] for name in cls.ARRAYS}
+        except (OSError, KeyError, ValueError):
+            return None
+        return cls(arrays, tuple(meta["origin"]), meta["cell"])
+
+    def _partitions(self, count, category, beds, bedroom_tolerance):
+        """Category and bedroom partitions each subject needs, padded with -1"""
+        width = 2 * bedroom_tolerance + 1
+        unfiltered = beds < 0
+        slots = np.full((count, max(width, BED_SLOTS) if unfiltered.any() else width), -1, dtype=np.int64)
+        wanted = beds[:, None].astype(np.int64) + np.arange(-bedroom_tolerance, bedroom_tolerance + 1)
+        wanted = np.sort(np.where(wanted >= 0, bed_slots(wanted), -1), axis=1)
+        # Counts at or above the top slot all share it, so keep it once
+        wanted[:, 1:][wanted[:, 1:] == wanted[:, :-1]] = -1
+        slots[:, :width] = wanted
+        if unfiltered.any():
+            slots[unfiltered] = -1
+            slots[unfiltered, :BED_SLOTS] = np.arange(BED_SLOTS)
+        categories = CATEGORY_CODES.values() if category is None else [category]
+        return np.concatenate([np.where(slots >= 0, code * BED_SLOTS + slots, -1) for code in categories], axis=1)
+
+    def _slices(self, x, y, meters, partitions):
+        """Start and end rows of each partition's cells that come within `meters` of each subject
+
+        One slice per partition and grid column: the cells of a column that
+        the circle overlaps are consecutive buckets, so their rows are too.
+        """
+        reach = int(math.ceil(meters / self.cell))
+        steps = np.arange(-reach, reach + 1)
+        radius = meters / self.cell
+        fx, fy = x / self.cell, y / self.cell
+        cx, cy = np.floor(fx), np.floor(fy)
+        # Leave out the cells of each column that the circle doesn't reach
+        gap_x = np.maximum(np.maximum(steps[None, :] - (fx - cx)[:, None], 0), (fx - cx)[:, None] - steps[None, :] - 1)
+        near = gap_x <= radius
+        rise = np.sqrt(np.maximum(radius ** 2 - gap_x ** 2, 0))
+        column = cx.astype(np.int64)[:, None] + steps[None, :]
+        low = cell_keys_of(column, (cy[:, None] + np.ceil((fy - cy)[:, None] - 1 - rise)).astype(np.int64))
+        high = cell_keys_of(column, (cy[:, None] + np.floor((fy - cy)[:, None] + rise)).astype(np.int64))
+        searched = (partitions[:, :, None] >= 0) & near[:, None, :]
+        base = partitions[:, :, None] * CELLS
+        first = np.searchsorted(self.buckets, base + low[:, None, :])
+        last = np.searchsorted(self.buckets, base + high[:, None, :], side="right")
+        starts = np.where(searched, self.offsets[first], 0).reshape(len(x), -1)
+        ends = np.where(searched, self.offsets[last], 0).reshape(len(x), -1)
+        return starts, ends
+
+    def _subjects(self, latitudes, longitudes, category="sold", property_type=None, bedrooms=None,
+                  bedroom_tolerance=0, since=None, until=None):
+        """(_Subjects, options for _within) for a batch of subjects and the filters of within()"""
+        latitudes = np.atleast_1d(np.asarray(latitudes, dtype=np.float64))
+        longitudes = np.atleast_1d(np.asarray(longitudes, dtype=np.float64))
+        count = len(latitudes)
+        types = _per_subject(property_type, count, object, None)
+        type_codes = np.array([-1 if t is None else self._type_codes.get(t, -2) for t in types], dtype=np.int32)
+        beds = _per_subject(bedrooms, count, np.int32, -1)
+        x, y = project(latitudes, longitudes, self.origin)
+        partitions = self._partitions(count, CATEGORY_CODES.get(category), beds, bedroom_tolerance)
+        # Subjects with an unknown property type, or a type and bedrooms no
+        # listing has, would search ever wider circles for nothing
+        typed = np.isin(partitions * len(self.property_types) + type_codes[:, None], self._groups)
+        present = np.where(type_codes[:, None] >= 0, typed, np.isin(partitions, self._groups_partitions))
+        hopeless = (type_codes == -2) | ~(present & (partitions >= 0)).any(axis=1)
+        partitions[hopeless] = -1
+        options = {"bedroom_tolerance": bedroom_tolerance,
+                   "since": _day(since) if since else None, "until": _day(until) if until else None}
+        return _Subjects(x, y, partitions, type_codes, beds), options
+
+    def within(self, latitudes, longitudes, meters, category="sold", property_type=None, bedrooms=None,
+               bedroom_tolerance=0, since=None, until=None):
+        """Listings within `meters` of each subject that pass the filters
+
+        property_type and bedrooms can be one value for every subject or one
+        per subject (None for no filter); bedrooms matches within
+        bedroom_tolerance. since and until bound the listing date (ISO or
+        date). category is "sold", "active" or None for both.
+        """
+        subjects, options = self._subjects(latitudes, longitudes, category, property_type, bedrooms,
+                                           bedroom_tolerance, since, until)
+        return self._within(subjects, meters, **options)
+
+    def _within(self, subjects, meters, bedroom_tolerance, since, until):
+        """within() for _Subjects, a chunk of subjects at a time"""
+        count = len(subjects.x)
+        columns = 2 * int(math.ceil(meters / self.cell)) + 1
+        size = max(1, SLICES_PER_CHUNK // max(1, columns * subjects.partitions.shape[1]))
+        found = []
+        for chunk_start in range(0, count, size):
+            chunk = np.arange(chunk_start, min(count, chunk_start + size))
+            starts, ends = self._slices(subjects.x[chunk], subjects.y[chunk], meters, subjects.partitions[chunk])
+            candidates = np.cumsum((ends - starts).sum(axis=1))
+            # Split further wherever the subjects' candidates add up to too many
+            bounds = np.searchsorted(candidates, np.arange(CANDIDATES_PER_CHUNK, candidates[-1], CANDIDATES_PER_CHUNK))
+            for part in np.split(np.arange(len(chunk)), np.unique(np.maximum(bounds, 1))):
+                if len(part):
+                    found.append(self._candidates(subjects, chunk[part], starts[part], ends[part], meters,
+                                                  bedroom_tolerance, since, until))
+        if not found:
+            empty = np.array([], dtype=np.int64)
+            return Matches(empty, empty, np.array([], dtype=np.float64))
+        return Matches(*(np.concatenate(values) for values in zip(*found)))
+
+    def _candidates(self, subjects, chunk, starts, ends, meters, bedroom_tolerance, since, until):
+        """Matches of the subjects at `chunk` among the rows of their slices"""
+        lengths = (ends - starts).ravel()
+        total = int(lengths.sum())
+        # Expand each subject's slices into (subject, row) candidate pairs
+        subject = np.repeat(np.repeat(chunk, starts.shape[1]), lengths)
+        first = np.repeat(starts.ravel() - (np.cumsum(lengths) - lengths), lengths)
+        row = first + np.arange(total)
+
+        distance = np.hypot(self.x[row] - subjects.x[subject], self.y[row] - subjects.y[subject])
+        keep = distance <= meters
+        if since is not None:
+            keep &= self.day[row] >= since
+        if until is not None:
+            keep &= self.day[row] <= until
+        wanted_type = subjects.type_codes[subject]
+        keep &= (wanted_type == -1) | (self.property_type[row] == wanted_type)
+        wanted_beds = subjects.beds[subject]
+        keep &= (wanted_beds < 0) | (np.abs(self.bedrooms[row] - wanted_beds) <= bedroom_tolerance)
+
+        subject, row, distance = subject[keep], row[keep], distance[keep]
+        order = np.lexsort((distance, subject))
+        return Matches(subject[order], row[order], distance[order])
+
+    def nearest(self, latitudes, longitudes, k, max_meters=DEFAULT_MAX_METERS, **filters):
+        """The k nearest listings to each subject that pass the filters (see within)
+
+        The search radius starts where k listings would be expected on average
+        and doubles for the subjects that still have fewer than k matches, so
+        the result is exact. Subjects with fewer than k matches within
+        max_meters (None for the whole index) get what there is.
+        """
+        subjects, options = self._subjects(latitudes, longitudes, **filters)
+        count = len(subjects.x)
+        if not len(self) or not count:
+            empty = np.array([], dtype=np.int64)
+            return Matches(empty, empty, np.array([], dtype=np.float64))
+        span = max(np.ptp(self.x), np.ptp(self.y), self.cell)
+        limit = min(max_meters or 2 * span, 2 * span)
+        meters = min(limit, max(self.cell / 2, span * math.sqrt(k / len(self)) / 2))
+        # Subjects no listing can match are done before the first search
+        pending = np.flatnonzero((subjects.partitions >= 0).any(axis=1))
+        found = []
+        while len(pending):
+            matches = self._within(subjects.take(pending), meters, **options)
+            counts = np.bincount(matches.subject, minlength=len(pending))
+            done = (counts >= k) | (meters >= limit)
+            # Matches are sorted by distance within each subject, so keep each subject's first k
+            rank = np.arange(len(matches.subject)) - np.repeat(np.cumsum(counts) - counts, counts)
+            keep = done[matches.subject] & (rank < k)
+            found.append(Matches(pending[matches.subject[keep]], matches.row[keep], matches.distance[keep]))
+            pending = pending[~done]
+            meters = min(limit, meters * 2)
+        if not found:
+            empty = np.array([], dtype=np.int64)
+            return Matches(empty, empty, np.array([], dtype=np.float64))
+        subject = np.concatenate([m.subject for m in found])
+        order = np.argsort(subject, kind="stable")
+        return Matches(subject[order], np.concatenate([m.row for m in found])[order],
+                       np.concatenate([m.distance for m in found])[order])
+
+    def records(self, rows, distances=None):
+        """Listings at the given rows as dicts, for printing or CSV output"""
+        records = []
+        for i, row in enumerate(rows):
+            record = {
+                "mls_number": str(self.mls_number[row]),
+                "category": "sold" if self.category[row] else "active",
+                "date": str(np.datetime64(int(self.day[row]), "D")) if self.day[row] != UNKNOWN_DAY else None,
+                "address": str(self.address[row]),
+                "property_type": str(self.property_types[self.property_type[row]]),
+                "bedrooms": int(self.bedrooms[row]) if self.bedrooms[row] >= 0 else None,
+                "bathrooms": _number(self.bathrooms[row]),
+                "sqft": _number(self.sqft[row]),
+                "price": float(self.price[row]),
+            }
+            if distances is not None:
+                record["distance_m"] = round(float(distances[i]), 1)
+            records.append(record)
+        return records
+
+def project(latitude, longitude, origin):
+    """Meters east and north of origin on a flat local projection"""
+    lat0, lon0 = origin
+    x = (longitude - lon0) * METERS_PER_DEGREE * math.cos(math.radians(lat0))
+    y = (latitude - lat0) * METERS_PER_DEGREE
+    return x, y
+
+def cell_keys_of(cx, cy):
+    return (cx + CELL_OFFSET) * (2 * CELL_OFFSET) + (cy + CELL_OFFSET)
+
+def cell_keys(x, y, cell):
+    return cell_keys_of(np.floor(x / cell).astype(np.int64), np.floor(y / cell).astype(np.int64))
+
+def bed_slots(bedrooms):
+    """Bedroom partition of each bedroom count: 0 for unknown, then one per count up to the last"""
+    return np.clip(bedrooms, -1, BED_SLOTS - 2) + 1
+
+def bucket_keys(category, bedrooms, cells):
+    return (category.astype(np.int64) * BED_SLOTS + bed_slots(bedrooms.astype(np.int64))) * CELLS + cells
+
+def load_index(run_dir, cell=CELL_METERS):
+    """The run's index, from comps_index.npz if it is up to date, else built and saved"""
+    files = [(category, path) for category, path in run_files(run_dir) if category in CATEGORY_CODES]
+    sources = {os.path.relpath(path, run_dir): signature(path) for _, path in files}
+    path = os.path.join(run_dir, INDEX_FILE)
+    index = CompIndex.load(path, sources)
+    if index is not None and index.cell == cell:
+        return index, False
+    listings = {category: [] for category in CATEGORY_CODES}
+    for category, csv_path in files:
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        listings[category].extend(iter_rows(os.path.dirname(csv_path), name))
+    index = CompIndex.from_listings(listings, cell)
+    index.save(path, sources)
+    return index, True
+
+def read_subjects(path):
+    """Subjects from a CSV with id, latitude and longitude columns and optional bedrooms and property_type"""
+    with open(path, newline='', encoding='utf-8') as f:
+        subjects = list(csv.DictReader(f))
+    ids = [s.get("id") or str(i + 1) for i, s in enumerate(subjects)]
+    latitudes = [float(s["latitude"]) for s in subjects]
+    longitudes = [float(s["longitude"]) for s in subjects]
+    bedrooms = [int(s["bedrooms"]) if s.get("bedrooms") else None for s in subjects]
+    types = [s.get("property_type") or None for s in subjects]
+    return ids, latitudes, longitudes, bedrooms, types
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="Find comparable sales near a property or a batch of properties")
+    parser.add_argument("run_dir", help="run directory whose listings to search")
+    parser.add_argument("--lat", type=float, help="latitude of the subject property")
+    parser.add_argument("--lon", type=float, help="longitude of the subject property")
+    parser.add_argument("--subjects", metavar="CSV",
+                        help="price every subject in a CSV with id, latitude, longitude and optional "
+                             "bedrooms and property_type columns")
+    parser.add_argument("--radius", type=float, default=500, help="search radius in meters (default: 500)")
+    parser.add_argument("--nearest", type=int, metavar="K", help="the K nearest matches instead of a radius")
+    parser.add_argument("--category", choices=["sold", "active", "both"], default="sold")
+    parser.add_argument("--type", help="property type, e.g. Townhouse (per subject with --subjects)")
+    parser.add_argument("--beds", type=int, help="bedrooms (per subject with --subjects)")
+    parser.add_argument("--beds-within", type=int, default=0, help="allowed difference in bedrooms (default: 0)")
+    parser.add_argument("--months", type=int, help="only listings dated within the last N months")
+    args = parser.parse_args(argv)
+
+    if np is None:
+        print("ERROR: comps need numpy: pip install 'vancouver-real-estate-scraper[stats]'")
+        exit(1)
+    if args.subjects:
+        ids, latitudes, longitudes, bedrooms, types = read_subjects(args.subjects)
+    elif args.lat is not None and args.lon is not None:
+        ids, latitudes, longitudes, bedrooms, types = ["subject"], [args.lat], [args.lon], [args.beds], [args.type]
+    else:
+        parser.error("give --lat and --lon, or --subjects")
+    if args.subjects:
+        # Command-line filters apply to subjects that don't set their own
+        bedrooms = [args.beds if b is None else b for b in bedrooms]
+        types = [args.type if t is None else t for t in types]
+
+    started = time.perf_counter()
+    index, built = load_index(args.run_dir)
+    loaded = time.perf_counter() - started
+    filters = {
+        "category": None if args.category == "both" else args.category,
+        "property_type": types,
+        "bedrooms": bedrooms,
+        "bedroom_tolerance": args.beds_within,
+    }
+    if args.months:
+        newest = int(index.day[index.category == CATEGORY_CODES["sold"]].max(initial=_day(date.today())))
+        filters["since"] = str(np.datetime64(newest, "D") - np.timedelta64(round(args.months * 30.44), "D"))
+
+    started = time.perf_counter()
+    if args.nearest:
+        matches = index.nearest(latitudes, longitudes, args.nearest, **filters)
+    else:
+        matches = index.within(latitudes, longitudes, args.radius, **filters)
+    elapsed = time.perf_counter() - started
+
+    if args.subjects:
+        # One line per subject: how many comps and what they sold for
+        stats, counts = grouped_percentiles(matches.subject, index.price[matches.row], len(ids), (25, 50, 75))
+        per_sqft, _ = grouped_percentiles(matches.subject, index.price[matches.row] * 1000 / index.sqft[matches.row],
+                                          len(ids), (50,))
+        nearest = np.full(len(ids), np.nan)
+        first = np.unique(matches.subject, return_index=True)[1]
+        nearest[matches.subject[first]] = matches.distance[first]
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["id", "comps", "price_p25_k", "price_p50_k", "price_p75_k", "per_sqft_p50", "nearest_m"])
+        for i, subject in enumerate(ids):
+            values = [stats[i, 0], stats[i, 1], stats[i, 2], per_sqft[i, 0], nearest[i]]
+            writer.writerow([subject, int(counts[i])] + ["" if v != v else round(float(v), 1) for v in values])
+    else:
+        writer = csv.DictWriter(sys.stdout, ["distance_m", "mls_number", "category", "date", "price", "property_type",
+                                             "bedrooms", "bathrooms", "sqft", "address"])
+        writer.writeheader()
+        writer.writerows(index.records(matches.row, matches.distance))
+    print(f"{len(index)} listings indexed ({'built' if built else 'loaded from ' + INDEX_FILE} in {loaded:.2f}s), "
+          f"{len(matches.row)} matches for {len(ids)} subjects in {elapsed * 1e6 / len(ids):.0f}us per subject",
+          file=sys.stderr)
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,361 @@
+"""Long-running scraper that keeps its session warm
+
+Instead of starting Python, Chromium and a login for every cron run, the
+daemon logs in once and refreshes each category on its own schedule (active
+listings every 15 minutes, expireds every 6 hours and solds nightly by
+default) through one shared client, scheduler and worker pool. The browser
+only starts again when a refresh fails and a probe shows the session has
+expired.
+
+Every refresh is written to a staging directory and its files are moved over
+the previous ones with os.replace, so readers of `data/live/` always see a
+complete snapshot. A refresh with failed boxes keeps the previous files.
+status.json records the last success of each category, so a restarted daemon
+picks up its schedule where it left off, and GET /health and /status serve
+the same on the local status port alongside /metrics. Each refresh is
+planned from the box densities of the previous ones (see zealty_planner),
+kept in density.json next to status.json. Each refresh also starts a new
+metrics.jsonl (see Metrics.rotate), so the daemon's files stay bounded.
+
+    uv run zealty_daemon.py --every active=15m sold=24h --status-port 8787
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import signal
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from zealty_jobs import DEFAULT_SPEC, load_spec, plan_jobs
+from zealty_listing import unparsed_summary
+from zealty_metrics import Metrics, serve_metrics
+from zealty_output import FORMATS, check_formats
+from zealty_planner import QueryPlanner
+from zealty_scheduler import DEFAULT_RATE, DEFAULT_RETRIES, RequestScheduler
+from zealty_scraper_multi import DEFAULT_WORKERS, ROW_LIMIT, collect_jobs
+from zealty_session import MissingCredentials, ProbeFailed, login, open_client, probe
+from zealty_store import ListingStore
+
+OUTPUT_DIR = os.path.join("data", "live")
+STATUS_FILE = "status.json"
+DENSITY_FILE = "density.json"
+DEFAULT_STATUS_PORT = 8787
+
+# Seconds between refreshes of each category
+DEFAULT_INTERVALS = {"active": 15 * 60, "expired": 6 * 3600, "sold": 24 * 3600}
+
+# A failed refresh is tried again after this many seconds, or its interval if shorter
+RETRY_DELAY = 5 * 60
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_interval(text):
+    """Seconds in an interval such as 90s, 15m, 6h or 1d (plain numbers are seconds)"""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhd]?)", text.strip())
+    if not match or float(match.group(1)) <= 0:
+        raise ValueError(f"bad interval '{text}' (expected e.g. 90s, 15m, 6h or 1d)")
+    return float(match.group(1)) * UNITS[match.group(2) or "s"]
+
+def format_interval(seconds):
+    for unit in ("d", "h", "m"):
+        if seconds >= UNITS[unit] and seconds % UNITS[unit] == 0:
+            return f"{seconds / UNITS[unit]:g}{unit}"
+    return f"{seconds:g}s"
+
+def iso(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="seconds")
+
+def from_iso(text):
+    if not text:
+        return None
+    return datetime.fromisoformat(text).timestamp()
+
+class Daemon:
+    """Refreshes each category on its own schedule through one warm session"""
+
+    def __init__(self, spec, intervals, output_dir=OUTPUT_DIR, formats=("csv",), workers=DEFAULT_WORKERS,
+                 rate=DEFAULT_RATE, retries=DEFAULT_RETRIES, sqlite=None, plan=True):
+        self.spec = spec
+        self.intervals = intervals
+        self.output_dir = output_dir
+        self.formats = formats
+        self.workers = workers
+        self.rate = rate
+        self.retries = retries
+        self.sqlite = sqlite
+        self.started = time.time()
+        self.relogins = 0
+        self.stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.status = {flag: {"last_success": None, "last_attempt": None, "last_error": None,
+                              "listings": None, "requests": None, "seconds": None, "running": False}
+                       for flag in intervals}
+        self._load_status()
+        os.makedirs(output_dir, exist_ok=True)
+        self.metrics = Metrics(output_dir, ROW_LIMIT)
+        self.planner = QueryPlanner(os.path.join(output_dir, DENSITY_FILE), enabled=plan)
+        self.api = None
+        self.client = None
+
+    def _load_status(self):
+        """Carry the last success of each category over from a previous daemon"""
+        try:
+            with open(os.path.join(self.output_dir, STATUS_FILE), encoding="utf-8") as f:
+                saved = json.load(f).get("categories", {})
+        except (OSError, ValueError):
+            return
+        for flag, entry in saved.items():
+            if flag in self.status:
+                self.status[flag].update({key: entry.get(key) for key in ("listings", "requests", "seconds")})
+                self.status[flag]["last_success"] = from_iso(entry.get("last_success"))
+
+    def _save_status(self):
+        path = os.path.join(self.output_dir, STATUS_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=1)
+        os.replace(tmp_path, path)
+
+    def next_run(self, flag):
+        """When a category is next due, as a time.time() timestamp"""
+        entry = self.status[flag]
+        interval = self.intervals[flag]
+        if entry["last_error"] and entry["last_attempt"]:
+            return entry["last_attempt"] + min(RETRY_DELAY, interval)
+        if entry["last_success"]:
+            return entry["last_success"] + interval
+        return self.started
+
+    def snapshot(self):
+        """Schedule and last results of every category"""
+        with self._lock:
+            categories = {}
+            for flag, entry in self.status.items():
+                categories[flag] = {
+                    "interval": format_interval(self.intervals[flag]),
+                    "last_success": iso(entry["last_success"]),
+                    "last_attempt": iso(entry["last_attempt"]),
+                    "last_error": entry["last_error"],
+                    "next_run": iso(self.next_run(flag)),
+                    "running": entry["running"],
+                    "listings": entry["listings"],
+                    "requests": entry["requests"],
+                    "seconds": entry["seconds"],
+                }
+            return {"started": iso(self.started), "relogins": self.relogins, "categories": categories}
+
+    def problems(self):
+        """Categories whose last refresh failed, or whose last success is over two intervals old"""
+        now = time.time()
+        found = []
+        with self._lock:
+            for flag, entry in self.status.items():
+                if entry["last_error"]:
+                    found.append(f"{flag}: {entry['last_error']}")
+                elif entry["last_success"] and now - entry["last_success"] > 2 * self.intervals[flag]:
+                    found.append(f"{flag}: last success {iso(entry['last_success'])}")
+        return found
+
+    def health_response(self):
+        problems = self.problems()
+        body = json.dumps({"ok": not problems, "problems": problems}) + "\n"
+        return (503 if problems else 200), "application/json", body
+
+    def status_response(self):
+        return 200, "application/json", json.dumps(self.snapshot(), indent=1) + "\n"
+
+    def start(self, fresh=False):
+        """Open the session the daemon keeps for its lifetime"""
+        with self.metrics.phase("session"):
+            self.api = open_client(fresh=fresh, metrics=self.metrics, retries=self.retries)
+        self.client = RequestScheduler(self.api, self.workers, self.rate, self.retries)
+
+    def _session_expired(self):
+        """Whether the API refuses the session, as opposed to failing for some other reason"""
+        try:
+            return not probe(self.client)
+        except ProbeFailed as e:
+            print(f"Not logging in again, {e}")
+            return False
+
+    def _collect(self, jobs, staging):
+        """Collect jobs into staging, returning the per-job summary and the request count"""
+        shutil.rmtree(staging, ignore_errors=True)
+        store = ListingStore(self.sqlite, datetime.now().isoformat(timespec="seconds")) if self.sqlite else None
+        try:
+            results, summary, _, _ = collect_jobs(self.client, jobs, staging, self.formats, self.workers,
+                                                  metrics=self.metrics, store=store, planner=self.planner)
+        finally:
+            if store:
+                store.close()
+        self.planner.save()
+        print(self.planner.summary(results))
+        if unparsed_summary():
+            print(unparsed_summary() + " (since the daemon started)")
+        requests = sum(requests for requests, _, _, _ in results.values())
+        return summary, requests
+
+    def _publish(self, jobs, staging):
+        """Move a finished refresh's files over the live ones"""
+        for job in jobs:
+            live_dir = os.path.join(self.output_dir, job.subdir)
+            os.makedirs(live_dir, exist_ok=True)
+            for fmt in self.formats:
+                filename = job.name + FORMATS[fmt].extension
+                source = os.path.join(staging, job.subdir, filename)
+                target = os.path.join(live_dir, filename)
+                if os.path.exists(source):
+                    os.replace(source, target)
+                elif os.path.exists(target):
+                    # Nothing to save this time, so the old file is stale
+                    os.remove(target)
+
+    def refresh(self, flag):
+        """Scrape every job of one category and publish it if no box failed"""
+        jobs = [job for job in plan_jobs(self.spec, datetime.utcnow().date()) if job.sold_flag == flag]
+        staging = os.path.join(self.output_dir, f".refresh-{flag}")
+        started = time.time()
+        with self._lock:
+            self.status[flag].update(running=True, last_attempt=started)
+        print(f"\n[{iso(started)}] Refreshing {flag} ({len(jobs)} jobs)")
+        self.metrics.rotate()
+
+        error = None
+        try:
+            summary, requests = self._collect(jobs, staging)
+            failed = sum(line[4] for line in summary)
+            if failed and self._session_expired():
+                print("Session has expired, logging in again")
+                with self.metrics.phase("session"):
+                    self.api.set_cookies(login(metrics=self.metrics))
+                self.relogins += 1
+                summary, more = self._collect(jobs, staging)
+                requests += more
+                failed = sum(line[4] for line in summary)
+            if failed:
+                error = f"{failed} boxes failed, kept the previous files"
+            else:
+                self._publish(jobs, staging)
+        except Exception as e:
+            summary, requests = [], None
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        finished = time.time()
+        with self._lock:
+            entry = self.status[flag]
+            entry.update(running=False, last_error=error, seconds=round(finished - started, 1))
+            if not error:
+                entry.update(last_success=finished, requests=requests,
+                             listings=sum(line[1] for line in summary))
+        self._save_status()
+        if error:
+            print(f"[{iso(finished)}] {flag} refresh FAILED: {error}")
+        else:
+            print(f"[{iso(finished)}] {flag} refreshed: {self.status[flag]['listings']} listings, "
+                  f"{requests} requests in {finished - started:.1f}s")
+
+    def run_forever(self):
+        """Refresh whichever category is due next until stop() is called"""
+        while not self.stopping.is_set():
+            flag = min(self.intervals, key=self.next_run)
+            delay = self.next_run(flag) - time.time()
+            if delay > 0:
+                print(f"Next refresh: {flag} at {iso(self.next_run(flag))}")
+                if self.stopping.wait(delay):
+                    break
+            self.refresh(flag)
+
+    def stop(self):
+        self.stopping.set()
+
+    def close(self):
+        if self.client:
+            self.client.close()
+        self.metrics.close()
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="Keep Zealty.ca listings fresh from one long-running process")
+    parser.add_argument("--jobs", metavar="SPEC",
+                        help="TOML job spec listing regions, categories, date windows and property classes "
+                             "(default: all of Metro Vancouver)")
+    parser.add_argument("--every", nargs="+", default=[], metavar="CATEGORY=INTERVAL",
+                        help="refresh interval per category, e.g. active=15m sold=24h "
+                             f"(default: {' '.join(f'{k}={format_interval(v)}' for k, v in DEFAULT_INTERVALS.items())})")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR,
+                        help=f"directory the latest files are kept in (default: {OUTPUT_DIR})")
+    parser.add_argument("--status-port", type=int, default=DEFAULT_STATUS_PORT,
+                        help=f"serve /health, /status and /metrics on http://127.0.0.1:PORT (default: {DEFAULT_STATUS_PORT})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"queries in flight at once (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--fresh-login", action="store_true",
+                        help="ignore the saved session and log in with the browser")
+    parser.add_argument("--format", nargs="+", default=["csv"], choices=sorted(FORMATS),
+                        help="output formats to write (default: csv)")
+    parser.add_argument("--sqlite", metavar="PATH",
+                        help="also upsert every fetched row into this SQLite database")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help=f"maximum requests per second, 0 for no limit (default: {DEFAULT_RATE:g})")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help=f"retries per query on 429/5xx/timeouts (default: {DEFAULT_RETRIES})")
+    parser.add_argument("--no-plan", action="store_true",
+                        help="start every refresh from the whole region instead of the boxes planned from "
+                             "previous refreshes")
+    args = parser.parse_args(argv)
+
+    error = check_formats(args.format)
+    if error:
+        print(f"ERROR: {error}")
+        exit(1)
+    try:
+        spec = load_spec(args.jobs) if args.jobs else DEFAULT_SPEC
+        flags = {job.sold_flag for job in plan_jobs(spec, datetime.utcnow().date())}
+    except (OSError, ValueError, ImportError) as e:
+        print(f"ERROR: can't use job spec {args.jobs}: {e}")
+        exit(1)
+    intervals = {flag: seconds for flag, seconds in DEFAULT_INTERVALS.items() if flag in flags}
+    try:
+        for item in args.every:
+            flag, _, text = item.partition("=")
+            if flag not in intervals:
+                raise ValueError(f"'{item}' doesn't name a category the job spec scrapes ({', '.join(intervals)})")
+            intervals[flag] = parse_interval(text)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        exit(1)
+
+    daemon = Daemon(spec, intervals, args.output_dir, args.format, args.workers, args.rate, args.retries,
+                    args.sqlite, not args.no_plan)
+    server = serve_metrics(daemon.metrics, args.status_port, routes={
+        "/health": daemon.health_response,
+        "/status": daemon.status_response,
+    })
+    print(f"Health and status on http://127.0.0.1:{server.server_address[1]}/health and /status")
+
+    def on_term(signum, frame):
+        print("Stopping after the current refresh")
+        daemon.stop()
+
+    signal.signal(signal.SIGTERM, on_term)
+    print("Schedule: " + ", ".join(f"{flag} every {format_interval(s)}" for flag, s in intervals.items()))
+    try:
+        daemon.start(fresh=args.fresh_login)
+        daemon.run_forever()
+    except KeyboardInterrupt:
+        print("Interrupted")
+    except (MissingCredentials, ProbeFailed) as e:
+        print(f"ERROR: {e}")
+        return 1
+    finally:
+        server.shutdown()
+        daemon.close()
+
+if __name__ == "__main__":
+    sys.exit(run())
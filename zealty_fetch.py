@@ -0,0 +1,257 @@
+"""Direct HTTP access to svcFetchDB.php
+
+Playwright is only needed to log in. Once the session cookies exist, every
+query is a plain form POST, so they go through a small keep-alive client that
+can be shared across worker threads. http.client is imported on the first
+request, so code that only plans or replays queries doesn't load it.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+from zealty_listing import decode_rows, loads
+from zealty_profile import phase
+
+API_URL = os.getenv("ZEALTY_API_URL", "https://bcrealestatemap.ca/svcFetchDB.php")
+
+# Common headers for direct POSTs
+HEADERS = {
+    "accept": "*/*",
+    "accept-language": "en-CA,en-GB;q=0.9,en-US;q=0.8,en;q=0.7",
+    "content-type": "application/x-www-form-urlencoded",
+    "dnt": "1",
+    "origin": "https://www.zealty.ca",
+    "referer": "https://www.zealty.ca/",
+    "sec-fetch-dest": "empty",
+    "sec-fetch-mode": "cors",
+    "sec-fetch-site": "cross-site",
+    "sec-ch-ua": '"Chromium";v="142", "Google Chrome";v="142", "Not_A Brand";v="99"',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '"Linux"',
+    "user-agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/142.0.0.0 Safari/537.36",
+}
+
+def compute_token(sql_text):
+    """The API token `s` is the MD5 of the SQL text"""
+    return hashlib.md5(sql_text.encode()).hexdigest()
+
+def cookie_header(cookies, url):
+    """Build a Cookie header from Playwright-style cookie dicts that apply to url"""
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    pairs = []
+    for cookie in cookies:
+        domain = cookie.get("domain", "").lstrip(".")
+        if domain and host != domain and not host.endswith("." + domain):
+            continue
+        if not parts.path.startswith(cookie.get("path") or "/"):
+            continue
+        pairs.append(f"{cookie['name']}={cookie['value']}")
+    return "; ".join(pairs)
+
+class FetchError(Exception):
+    """A query failed and its box has no reliable rows"""
+
+class ApiResponse:
+    """Minimal response object with the parts of Playwright's APIResponse we use"""
+
+    def __init__(self, status, reason, body, headers=None):
+        self.status = status
+        self.reason = reason
+        self.body = body
+        self.headers = headers or {}
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 300
+
+    def status_text(self):
+        return self.reason
+
+    def json(self):
+        return loads(self.body)
+
+class ApiClient:
+    """Keep-alive HTTP client for svcFetchDB.php, one connection per thread"""
+
+    def __init__(self, cookies=None, url=API_URL, timeout=60):
+        self.url = url
+        self.timeout = timeout
+        self.headers = dict(HEADERS)
+        if cookies:
+            self.set_cookies(cookies)
+        self._local = threading.local()
+
+    def set_cookies(self, cookies):
+        header = cookie_header(cookies, self.url)
+        if header:
+            self.headers["cookie"] = header
+        else:
+            self.headers.pop("cookie", None)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            import http.client
+
+            parts = urlsplit(self.url)
+            if parts.scheme == "https":
+                conn = http.client.HTTPSConnection(parts.hostname, parts.port, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _reset(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+
+    def post(self, form):
+        """POST a form to the API and return an ApiResponse"""
+        import http.client
+
+        body = urlencode(form)
+        path = urlsplit(self.url).path or "/"
+        # A pooled connection may have been closed by the server while idle,
+        # so retry once on a fresh connection
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request("POST", path, body=body, headers=self.headers)
+                resp = conn.getresponse()
+                headers = {k.lower(): v for k, v in resp.getheaders()}
+                return ApiResponse(resp.status, resp.reason, resp.read(), headers)
+            except (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                    ConnectionResetError, BrokenPipeError):
+                self._reset()
+                if attempt:
+                    raise
+            except Exception:
+                self._reset()
+                raise
+
+    def close(self):
+        self._reset()
+
+def fetch_rows(client, sql_query, sold_flag, label="", cache=None, metrics=None, box=None):
+    """POST one query to svcFetchDB.php and return its rows as Listings
+
+    Raises FetchError if the request fails or the response isn't usable
+    (not a JSON object, an API error, rows that don't decode), so a failed
+    box is never mistaken for an empty one. With a ResponseCache, a
+    fresh cached response is returned without a request and successful
+    responses are stored in it. With a Metrics object, the request's latency,
+    size, parse time and row count are recorded against `box`.
+    """
+    if cache is not None:
+        started = time.perf_counter()
+        with phase("fetch"):
+            raw = cache.get(sql_query, sold_flag)
+        if raw is not None:
+            with phase("decode"):
+                rows = decode_rows(raw)
+            print(f"  [{sold_flag}] {label} cached {len(rows)} rows")
+            if metrics is not None:
+                metrics.record_request(sold_flag, box, time.perf_counter() - started,
+                                       rows=len(rows), cached=True)
+            return rows
+    token_s = compute_token(sql_query)
+    started = time.perf_counter()
+    resp = None
+    parse_seconds = 0.0
+    try:
+        try:
+            with phase("fetch"):
+                resp = client.post({
+                    "sql": sql_query,
+                    "sold": sold_flag,
+                    "from": "dmap",
+                    "s": token_s,
+                })
+        except Exception as e:
+            raise FetchError(f"request error: {e}") from e
+        latency = time.perf_counter() - started
+        if not resp.ok:
+            raise FetchError(f"request failed: {resp.status} {resp.status_text()}")
+        parse_started = time.perf_counter()
+        with phase("decode"):
+            try:
+                data = resp.json()
+            except Exception as e:
+                raise FetchError(f"non-JSON response: {e}") from e
+            if not isinstance(data, dict):
+                raise FetchError(f"unexpected response: a JSON {type(data).__name__} instead of an object")
+            error = data.get("error") or {}
+            if not isinstance(error, dict):
+                raise FetchError(f"API error: {error}")
+            if error.get("code"):
+                raise FetchError(f"API error {error.get('code')}: {error.get('message')}")
+            raw = data.get("rows") or []
+            if not isinstance(raw, list) or not all(isinstance(row, list) for row in raw):
+                raise FetchError("unexpected response: rows aren't a list of lists")
+            try:
+                rows = decode_rows(raw)
+            except Exception as e:
+                raise FetchError(f"malformed rows: {e}") from e
+        parse_seconds = time.perf_counter() - parse_started
+    except FetchError as e:
+        if metrics is not None:
+            metrics.record_request(sold_flag, box, time.perf_counter() - started,
+                                   len(resp.body) if resp else 0, parse_seconds,
+                                   status=resp.status if resp else None, error=str(e))
+        raise
+    print(f"  [{sold_flag}] {label} received {len(rows)} rows")
+    if metrics is not None:
+        metrics.record_request(sold_flag, box, latency, len(resp.body), parse_seconds,
+                               len(rows), resp.status)
+    if cache is not None:
+        # The rows are good either way, so a full disk only costs the cache entry
+        try:
+            cache.put(sql_query, sold_flag, raw)
+        except OSError as e:
+            print(f"  WARNING: couldn't cache the response: {e}")
+    return rows
+
+def open_fixture(path, mode):
+    """Open a JSON lines fixture file, gzip-compressed if it ends in .gz"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+class FixtureRecorder:
+    """Wraps a client and appends every request/response pair to a fixture file
+
+    The fixtures can be replayed offline with `stub_svcfetchdb.py --fixtures`.
+    """
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self.recorded = 0
+        self._file = open_fixture(path, "a")
+        self._lock = threading.Lock()
+
+    def post(self, form):
+        resp = self.client.post(form)
+        record = {
+            "sold": form.get("sold"),
+            "sql": form.get("sql"),
+            "status": resp.status,
+            "body": resp.body.decode("utf-8", "replace"),
+        }
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self.recorded += 1
+        return resp
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        self.client.close()
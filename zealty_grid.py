@@ -0,0 +1,64 @@
+"""Query boxes and date windows
+
+Pure helpers for planning svcFetchDB.php queries: the SQL for one box, grid
+and quadrant splits, and the date arithmetic of walking a date range in
+windows. Nothing here touches the network, so planners and analysis tools
+can import it without the browser or HTTP layers.
+"""
+from datetime import date, timedelta
+
+# svcFetchDB.php never returns more than this many rows per query
+ROW_LIMIT = 500
+
+# Stop splitting once a box is narrower than this many degrees (roughly 50m)
+MIN_BOX_SPAN = 0.0005
+
+def build_sql(box, where, order_by, limit=ROW_LIMIT):
+    """Build the svcFetchDB.php SQL for one box"""
+    lat_min, lat_max, lon_min, lon_max = box
+    return f"SELECT * FROM *** WHERE (latitude BETWEEN {lat_min} AND {lat_max}) AND (longitude BETWEEN {lon_min} AND {lon_max}) AND {where} ORDER BY {order_by} LIMIT {limit}"
+
+def generate_grid_boxes(lat_min, lat_max, lon_min, lon_max, divisions=3):
+    """Split area into smaller boxes to bypass 500 row limit"""
+    lat_step = (lat_max - lat_min) / divisions
+    lon_step = (lon_max - lon_min) / divisions
+    boxes = []
+    for i in range(divisions):
+        for j in range(divisions):
+            box_lat_min = lat_min + (i * lat_step)
+            box_lat_max = lat_min + ((i + 1) * lat_step)
+            box_lon_min = lon_min + (j * lon_step)
+            box_lon_max = lon_min + ((j + 1) * lon_step)
+            boxes.append((box_lat_min, box_lat_max, box_lon_min, box_lon_max))
+    return boxes
+
+def split_box(box):
+    """Split a box into its four quadrants"""
+    lat_min, lat_max, lon_min, lon_max = box
+    lat_mid = (lat_min + lat_max) / 2
+    lon_mid = (lon_min + lon_max) / 2
+    return [
+        (lat_min, lat_mid, lon_min, lon_mid),
+        (lat_min, lat_mid, lon_mid, lon_max),
+        (lat_mid, lat_max, lon_min, lon_mid),
+        (lat_mid, lat_max, lon_mid, lon_max),
+    ]
+
+def box_contains(outer, inner):
+    """Whether inner lies entirely within outer"""
+    return (outer[0] <= inner[0] and outer[1] >= inner[1]
+            and outer[2] <= inner[2] and outer[3] >= inner[3])
+
+def day_offset(day, days):
+    """The ISO date `days` after (or before, if negative) an ISO date"""
+    return (date.fromisoformat(day) + timedelta(days=days)).isoformat()
+
+def window_days(window):
+    """Number of days in an inclusive (start, end) window of ISO dates"""
+    start, end = window
+    return (date.fromisoformat(end) - date.fromisoformat(start)).days + 1
+
+def newest_window(remaining, days):
+    """The newest `days` days of an inclusive (start, end) range"""
+    start, end = remaining
+    return (max(start, day_offset(end, 1 - days)), end)
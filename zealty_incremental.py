@@ -0,0 +1,93 @@
+"""High-water marks for incremental scrapes
+
+After every run the newest listing date seen in each final (leaf) box is
+saved per category. An incremental run then only asks each box for rows at or
+after its mark and streams the previous run's snapshot in behind them.
+"""
+import json
+import os
+from datetime import date, timedelta
+
+from zealty_output import iter_rows
+
+STATE_FILE = os.path.join("data", "incremental_state.json")
+
+# Re-fetch this many days before each mark to catch listings entered late
+DEFAULT_LOOKBACK_DAYS = 2
+
+def load_state(path=STATE_FILE):
+    """Return the saved state, or None if there is no usable previous run"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not os.path.isdir(state.get("run_dir", "")):
+        return None
+    return state
+
+def save_state(run_dir, leaves, dirs=None, path=STATE_FILE):
+    """Save {job key: [(box, mark), ...]} as the marks for the next run
+
+    dirs maps each job key to the subdirectory of run_dir its files are in.
+    """
+    state = {
+        "run_dir": run_dir,
+        "marks": {key: [list(box) + [mark] for box, mark in boxes] for key, boxes in leaves.items()},
+        "dirs": dirs or {},
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+class Marks:
+    """Per-box high-water marks for one category"""
+
+    def __init__(self, entries, lookback_days=DEFAULT_LOOKBACK_DAYS):
+        self.boxes = [(tuple(entry[:4]), entry[4]) for entry in entries]
+        self.lookback = timedelta(days=lookback_days)
+
+    def mark_for(self, box):
+        """Earliest mark among the stored boxes overlapping box, or None if any is unknown
+
+        Quadtree leaves differ between runs, so a box is only as fresh as the
+        stalest stored box it touches.
+        """
+        lat_min, lat_max, lon_min, lon_max = box
+        marks = []
+        for (b_lat_min, b_lat_max, b_lon_min, b_lon_max), mark in self.boxes:
+            if b_lat_max < lat_min or b_lat_min > lat_max or b_lon_max < lon_min or b_lon_min > lon_max:
+                continue
+            if mark is None:
+                return None
+            marks.append(mark)
+        return min(marks) if marks else None
+
+    def query_since(self, box):
+        """Date to fetch box from (its mark minus the lookback), or None to fetch everything"""
+        mark = self.mark_for(box)
+        if mark is None:
+            return None
+        return (date.fromisoformat(mark) - self.lookback).isoformat()
+
+def newest_date(rows):
+    """Newest date (YYYY-MM-DD) among Listings, or None"""
+    dates = [row.date for row in rows if row.date]
+    return max(dates).isoformat() if dates else None
+
+def prior_rows(run_dir, name, since=None, drop=()):
+    """Stream a previous run's rows that still belong in the snapshot
+
+    Rows dated before `since` have aged out of the category's window, and MLS
+    numbers in `drop` (e.g. active listings that have since sold) are skipped.
+    Fresh rows are written first, so the writer's dedup lets them replace
+    prior rows with the same MLS number.
+    """
+    since = date.fromisoformat(since) if since else None
+    for row in iter_rows(run_dir, name):
+        if row.mls_number in drop:
+            continue
+        if since and (row.date is None or row.date < since):
+            continue
+        yield row
@@ -0,0 +1,156 @@
+"""Job specs: which regions, categories and property classes to scrape
+
+A job spec is a TOML file. Every region is scraped for every category it
+lists (all three by default), and all of them share one session, one
+scheduler and one worker pool:
+
+    # Optional, defaults to every property class
+    property_classes = [0, 1, 2, 3, 4]
+
+    # Optional, overrides the sold/expired date windows
+    [categories.sold]
+    days = 180
+
+    [[regions]]
+    name = "metro_vancouver"
+    bounds = [49.0, 49.5, -123.3, -122.5]
+
+    [[regions]]
+    name = "fraser_valley"
+    bounds = [49.0, 49.4, -122.5, -121.3]
+    categories = ["active", "sold"]
+    property_classes = [0]
+
+Without a spec the scraper covers Metro Vancouver only, as it always has.
+"""
+import re
+from datetime import timedelta
+from typing import NamedTuple, Optional, Tuple
+
+# Metro Vancouver bounds: lat 49.0 to 49.5, lon -123.3 to -122.5
+METRO_BOUNDS = (49.0, 49.5, -123.3, -122.5)
+
+# Property type filter SQL fragment
+PROPERTY_FILTER = "((propertyClassCode = 0) OR (propertyClassCode = 1 AND type IN('Apartment/Condo','Apartment','Condo Apartment')) OR (propertyClassCode = 1 AND type NOT IN('Apartment/Condo','Apartment','Condo Apartment')) OR (propertyClassCode = 3) OR (propertyClassCode = 4) OR (propertyClassCode = 2))"
+
+# sold flag -> (title, date column, default window in days, output name)
+CATEGORIES = {
+    "active": ("FOR SALE LISTINGS (TODAY)", "GREATEST(listingDate, listingPricePrevDate)",
+               None, "for_sale_today"),
+    "sold": ("SOLD LISTINGS (LAST 12 MONTHS)", "entryDate", 365, "solds_last_12_months"),
+    "expired": ("EXPIRED LISTINGS (LAST 30 DAYS)", "entryDate", 30, "expired_last_30_days"),
+}
+
+DEFAULT_SPEC = {"regions": [{"name": "metro_vancouver", "bounds": list(METRO_BOUNDS)}]}
+
+class Job(NamedTuple):
+    """One region x category to scrape and write out"""
+    key: str  # "<region>/<sold flag>"
+    region: str
+    sold_flag: str
+    title: str
+    name: str  # output file name without extension
+    subdir: str  # output directory inside the run directory ("" for a single region)
+    date_column: str
+    since: Optional[str]  # start of the date window (YYYY-MM-DD), None for active
+    bounds: Tuple[float, float, float, float]
+    where: str  # property class filter
+
+    @property
+    def query(self):
+        """Everything that determines the queries a job sends"""
+        return (self.sold_flag, self.bounds, self.where, self.date_column, self.since)
+
+def load_spec(path):
+    """Read a TOML job spec"""
+    try:
+        import tomllib
+    except ImportError:
+        # Python < 3.11
+        import tomli as tomllib
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+def property_filter(classes):
+    """SQL fragment matching any of the given propertyClassCode values"""
+    if classes is None:
+        return PROPERTY_FILTER
+    return "(" + " OR ".join(f"(propertyClassCode = {int(c)})" for c in classes) + ")"
+
+def _window(flag, days):
+    title, _, default_days, name = CATEGORIES[flag]
+    if days == default_days:
+        return title, name
+    label = {"sold": "SOLD", "expired": "EXPIRED"}[flag]
+    return f"{label} LISTINGS (LAST {days} DAYS)", f"{name.split('_last_')[0]}_last_{days}_days"
+
+def _property_classes(classes, where):
+    """classes if it is None or a non-empty list of property class codes, else ValueError"""
+    if classes is None:
+        return None
+    if (not isinstance(classes, list) or not classes
+            or not all(type(c) is int and 0 <= c <= 4 for c in classes)):
+        raise ValueError(f"{where}property_classes must be a non-empty list of class codes 0-4")
+    return classes
+
+def plan_jobs(spec, today):
+    """Expand a spec into Jobs, raising ValueError if it is malformed"""
+    regions = spec.get("regions")
+    if not regions:
+        raise ValueError("job spec has no [[regions]]")
+    if not isinstance(regions, list) or not all(isinstance(region, dict) for region in regions):
+        raise ValueError("regions must be [[regions]] tables")
+    categories = spec.get("categories", {})
+    if not isinstance(categories, dict):
+        raise ValueError("categories must be tables such as [categories.sold]")
+    default_classes = _property_classes(spec.get("property_classes"), "")
+    windows = {}
+    for flag, options in categories.items():
+        if flag not in CATEGORIES:
+            raise ValueError(f"unknown category '{flag}' (expected one of {', '.join(CATEGORIES)})")
+        if not isinstance(options, dict):
+            raise ValueError(f"categories.{flag} must be a table such as [categories.{flag}]")
+        days = options.get("days")
+        if days is not None:
+            if flag == "active":
+                raise ValueError("active listings have no date window")
+            if not isinstance(days, int) or days < 1:
+                raise ValueError(f"categories.{flag}.days must be a positive whole number of days")
+            windows[flag] = days
+
+    jobs = []
+    names = set()
+    for region in regions:
+        name = region.get("name", "")
+        if not isinstance(name, str) or not re.fullmatch(r"[A-Za-z0-9_-]+", name):
+            raise ValueError(f"region name '{name}' must be letters, digits, '_' or '-'")
+        if name in names:
+            raise ValueError(f"region '{name}' is listed twice")
+        names.add(name)
+        bounds = region.get("bounds")
+        if (not isinstance(bounds, list) or len(bounds) != 4
+                or not all(isinstance(v, (int, float)) for v in bounds)
+                or bounds[0] >= bounds[1] or bounds[2] >= bounds[3]):
+            raise ValueError(f"region '{name}' needs bounds = [lat_min, lat_max, lon_min, lon_max]")
+        flags = region.get("categories", list(CATEGORIES))
+        if not isinstance(flags, list) or not flags or not all(isinstance(flag, str) for flag in flags):
+            raise ValueError(f"region '{name}' needs categories = a non-empty list such as [\"active\", \"sold\"]")
+        unknown = [flag for flag in flags if flag not in CATEGORIES]
+        if unknown:
+            raise ValueError(f"region '{name}' has unknown categories: {', '.join(unknown)}")
+        repeated = sorted({flag for flag in flags if flags.count(flag) > 1})
+        if repeated:
+            raise ValueError(f"region '{name}' lists {', '.join(repeated)} more than once")
+        classes = _property_classes(region.get("property_classes"), f"region '{name}': ")
+        where = property_filter(classes if classes is not None else default_classes)
+
+        for flag in flags:
+            _, date_column, default_days, _ = CATEGORIES[flag]
+            days = windows.get(flag, default_days)
+            title, output = _window(flag, days)
+            since = (today - timedelta(days=days)).isoformat() if days else None
+            if len(regions) > 1:
+                title = f"{name.upper()}: {title}"
+            jobs.append(Job(f"{name}/{flag}", name, flag, title, output, name if len(regions) > 1 else "",
+                            date_column, since, tuple(float(v) for v in bounds), where))
+    return jobs
@@ -0,0 +1,254 @@
+"""Typed listing records
+
+svcFetchDB.php returns each listing as a JSON array of mixed strings and
+numbers. Rows are converted to Listing named tuples once, as they are
+decoded, so every later stage (dedup, CSV, Parquet/Arrow, SQLite, the
+planner) works with typed values instead of re-parsing strings.
+
+Listing details the API doesn't guarantee to be numbers (bedrooms such as
+"3+1", for three and a den) keep their text when it doesn't parse, which
+CSV writes as is and Parquet/Arrow keep in a separate text column. Any
+other value that doesn't parse is left blank and counted in UNPARSED.
+
+orjson is used to decode responses when it is installed.
+"""
+import json
+import threading
+from collections import Counter
+from datetime import date
+from functools import partial
+from typing import NamedTuple, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The columns from the API response
+COLUMNS = ['MLS_Number', 'Latitude', 'Longitude', 'Date', 'Unknown1', 'Address',
+           'Neighborhood', 'Price', 'Description', 'Property_Type', 'Stories',
+           'Unknown2', 'Bedrooms', 'Bathrooms', 'Unknown3', 'Unknown4', 'Unknown5']
+
+def _text(value):
+    if value is None:
+        return None
+    return value if type(value) is str else str(value)
+
+def _float(value):
+    if type(value) is float:
+        return value
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _int(value):
+    if type(value) is int:
+        return value
+    number = _float(value)
+    if number is None or not number.is_integer():
+        return None
+    return int(number)
+
+def _date(value):
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+# Column -> (pyarrow type name, converter). Price is in thousands of CAD,
+# Unknown3 is square footage and Unknown4 is lot frontage. Bathrooms and
+# square footage can be fractional (2.5 baths, 850.5 sqft), so they are floats.
+SCHEMA = {
+    'MLS_Number': ("string", _text),
+    'Latitude': ("float64", _float),
+    'Longitude': ("float64", _float),
+    'Date': ("date32", _date),
+    'Unknown1': ("string", _text),
+    'Address': ("string", _text),
+    'Neighborhood': ("string", _text),
+    'Price': ("float64", _float),
+    'Description': ("string", _text),
+    'Property_Type': ("string", _text),
+    'Stories': ("float64", _float),
+    'Unknown2': ("string", _text),
+    'Bedrooms': ("int16", _int),
+    'Bathrooms': ("float64", _float),
+    'Unknown3': ("float64", _float),
+    'Unknown4': ("float64", _float),
+    'Unknown5': ("string", _text),
+}
+
+# Columns whose values are kept as text when they don't parse
+TEXT_FALLBACK_COLUMNS = {'Stories', 'Bedrooms', 'Bathrooms', 'Unknown3', 'Unknown4'}
+
+# Values of the other typed columns that didn't parse and were left blank,
+# per column; decoded from several fetch threads, so updated under a lock
+UNPARSED = Counter()
+_unparsed_lock = threading.Lock()
+
+def _blank(value):
+    return value is None or value == ""
+
+def _unparsed(col, values, converted):
+    """converted with the text of values that didn't parse kept, or counted in UNPARSED"""
+    if None not in converted:
+        return converted
+    missing = [i for i, value in enumerate(converted) if value is None and not _blank(values[i])]
+    if not missing:
+        return converted
+    if col not in TEXT_FALLBACK_COLUMNS:
+        with _unparsed_lock:
+            UNPARSED[col] += len(missing)
+        return converted
+    converted = list(converted)
+    for i in missing:
+        converted[i] = _text(values[i])
+    return converted
+
+def _converter(col):
+    kind, convert = SCHEMA[col]
+    if kind == "string":
+        return convert
+
+    def convert_or_keep(value):
+        converted = convert(value)
+        if converted is None and not _blank(value):
+            if col in TEXT_FALLBACK_COLUMNS:
+                return _text(value)
+            with _unparsed_lock:
+                UNPARSED[col] += 1
+        return converted
+    return convert_or_keep
+
+def unparsed_summary():
+    """A warning line for values that were left blank, or None"""
+    with _unparsed_lock:
+        if not UNPARSED:
+            return None
+        counts = ", ".join(f"{count} {col}" for col, count in sorted(UNPARSED.items()))
+    return f"WARNING: values that didn't parse were left blank: {counts}"
+
+class Listing(NamedTuple):
+    """One listing, field for field with COLUMNS
+
+    The str of the numeric fields is text kept from a value that isn't a
+    number (see TEXT_FALLBACK_COLUMNS).
+    """
+    mls_number: Optional[str]
+    latitude: Optional[float]
+    longitude: Optional[float]
+    date: Optional[date]
+    unknown1: Optional[str]
+    address: Optional[str]
+    neighborhood: Optional[str]
+    price: Optional[float]  # thousands of CAD
+    description: Optional[str]
+    property_type: Optional[str]
+    stories: Union[float, str, None]
+    unknown2: Optional[str]
+    bedrooms: Union[int, str, None]
+    bathrooms: Union[float, str, None]
+    sqft: Union[float, str, None]  # Unknown3
+    lot_frontage: Union[float, str, None]  # Unknown4
+    unknown5: Optional[str]  # lot dimensions
+
+    @classmethod
+    def from_row(cls, row):
+        """Convert one API or CSV row, padding short rows with None"""
+        if len(row) < WIDTH:
+            row = list(row) + [None] * (WIDTH - len(row))
+        return cls._make([convert(value) for convert, value in zip(CONVERTERS, row)])
+
+FIELDS = list(Listing._fields)
+WIDTH = len(COLUMNS)
+CONVERTERS = tuple(_converter(col) for col in COLUMNS)
+
+# Text columns with few distinct values, whose strings are shared across rows
+SHARED_COLUMNS = {'Unknown1', 'Neighborhood', 'Property_Type', 'Unknown2', 'Unknown5'}
+
+# Whole-column converters used by decode_rows. A column whose values all
+# have the right type already is kept as is, and otherwise each distinct
+# value is converted once, so repeated values share one object across rows.
+
+def _convert_each(convert, values):
+    converted = {v: convert(v) for v in set(values)}
+    return list(map(converted.__getitem__, values))
+
+def _text_column(values):
+    if set(map(type, values)) == {str}:
+        return values
+    return _convert_each(_text, values)
+
+def _shared_text_column(values):
+    return _convert_each(_text, values)
+
+def _float_column(values):
+    types = set(map(type, values))
+    if types == {float}:
+        return values
+    try:
+        return list(map(float, values))
+    except (TypeError, ValueError):
+        # Blanks or other text mixed in
+        return _convert_each(_float, values)
+
+def _int_column(values):
+    types = set(map(type, values))
+    if types == {int}:
+        return values
+    if types <= {int, str}:
+        try:
+            return list(map(int, values))
+        except ValueError:
+            pass
+    return _convert_each(_int, values)
+
+def _date_column(values):
+    return _convert_each(_date, values)
+
+_COLUMN_CONVERTERS = {
+    "string": _text_column,
+    "float64": _float_column,
+    "int16": _int_column,
+    "int32": _int_column,
+    "date32": _date_column,
+}
+COLUMN_CONVERTERS = tuple(_shared_text_column if col in SHARED_COLUMNS else _COLUMN_CONVERTERS[SCHEMA[col][0]]
+                          for col in COLUMNS)
+
+_new_listing = partial(tuple.__new__, Listing)
+
+def loads(body):
+    """Parse a JSON response body (bytes or str)"""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+def decode_rows(rows):
+    """Convert raw API (or CSV) rows to Listings a column at a time, skipping empty rows"""
+    if set(map(len, rows)) != {WIDTH}:
+        rows = [(list(row) + [None] * WIDTH)[:WIDTH] for row in rows if row]
+    if not rows:
+        return []
+    columns = [_unparsed(col, values, convert(values))
+               for col, convert, values in zip(COLUMNS, COLUMN_CONVERTERS, zip(*rows))]
+    return list(map(_new_listing, zip(*columns)))
+
+def _whole(value):
+    return int(value) if type(value) is float and value.is_integer() else value
+
+def csv_rows(rows):
+    """Listings as CSV rows: ISO dates, whole numbers without a trailing .0 and kept text as is"""
+    columns = list(zip(*rows))
+    for i, col in enumerate(COLUMNS):
+        kind = SCHEMA[col][0]
+        if kind == "date32":
+            columns[i] = _convert_each(lambda d: d.isoformat() if d else None, columns[i])
+        elif kind == "float64":
+            columns[i] = list(map(_whole, columns[i]))
+    return zip(*columns)
@@ -0,0 +1,241 @@
+"""Per-request and per-phase run metrics
+
+Every API request is appended to metrics.jsonl in the run directory with its
+category, box, latency, response size, JSON parse time and row count, along
+with the time spent in each phase of the run (session setup, login, loading
+map.html, collecting, writing). The same numbers are summarised at the end of
+the run and can be exposed in Prometheus text format over HTTP.
+
+Latency percentiles come from a fixed-size random sample of each category's
+requests, so a long-running daemon's memory doesn't grow with every request;
+request counts, latency sums and the slowest request stay exact. The daemon
+calls rotate() before each refresh, so metrics.jsonl holds the latest refresh
+and the ones before it are kept as metrics.1.jsonl, metrics.2.jsonl, ...
+"""
+import contextlib
+import json
+import os
+import random
+import threading
+import time
+
+from zealty_profile import phase as profile_phase
+
+METRICS_FILE = "metrics.jsonl"
+
+# Upper bounds of the request latency histogram, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Latencies kept per category for the percentiles
+LATENCY_SAMPLES = 4096
+
+# Previous metrics files kept by rotate()
+ROTATED_FILES = 5
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers, or None if it is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+class CategoryStats:
+    """Running totals for one category"""
+
+    def __init__(self):
+        self.requests = 0
+        self.cached = 0
+        self.errors = 0
+        self.capped = 0
+        self.rows = 0
+        self.bytes = 0
+        self.latencies = []  # a uniform sample of at most LATENCY_SAMPLES
+        self.timed = 0
+        self.total_latency = 0.0
+        self.slowest = None
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, latency):
+        """Count one uncached request's latency, sampling it for the percentiles"""
+        self.timed += 1
+        self.total_latency += latency
+        self.slowest = latency if self.slowest is None else max(self.slowest, latency)
+        if len(self.latencies) < LATENCY_SAMPLES:
+            self.latencies.append(latency)
+        else:
+            # Reservoir sampling: every latency so far is kept with the same chance
+            index = random.randrange(self.timed)
+            if index < LATENCY_SAMPLES:
+                self.latencies[index] = latency
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.buckets[i] += 1
+
+class Metrics:
+    """Thread-safe recorder for request and phase timings"""
+
+    def __init__(self, run_dir, row_limit):
+        self.path = os.path.join(run_dir, METRICS_FILE)
+        self.row_limit = row_limit
+        self.categories = {}
+        self.phases = {}
+        self._lock = threading.Lock()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+
+    def record_request(self, category, box, latency, response_bytes=0, parse_seconds=0.0,
+                       rows=0, status=None, error=None, cached=False):
+        """Record one query; cache hits are counted but left out of the latency figures"""
+        capped = rows >= self.row_limit
+        record = {
+            "type": "request",
+            "time": round(time.time(), 3),
+            "category": category,
+            "box": list(box) if box else None,
+            "latency": round(latency, 6),
+            "bytes": response_bytes,
+            "parse": round(parse_seconds, 6),
+            "rows": rows,
+            "capped": capped,
+            "status": status,
+            "cached": cached,
+        }
+        if error:
+            record["error"] = error
+        with self._lock:
+            stats = self.categories.setdefault(category, CategoryStats())
+            stats.requests += 1
+            stats.rows += rows
+            stats.bytes += response_bytes
+            stats.capped += capped
+            if error:
+                stats.errors += 1
+            if cached:
+                stats.cached += 1
+            else:
+                stats.observe(latency)
+            self._write(record)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a block of the run and record it as a phase (and a profiler phase with --profile)"""
+        started = time.perf_counter()
+        try:
+            with profile_phase(name):
+                yield
+        finally:
+            self.record_phase(name, time.perf_counter() - started)
+
+    def record_phase(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+            self._write({"type": "phase", "time": round(time.time(), 3),
+                         "phase": name, "seconds": round(seconds, 6)})
+
+    def rotate(self):
+        """Start a new metrics.jsonl, keeping the previous ROTATED_FILES as metrics.1.jsonl and so on
+
+        The totals behind summary() and prometheus() carry on across files.
+        """
+        root, ext = os.path.splitext(self.path)
+        with self._lock:
+            if not self._file.tell():
+                return
+            self._file.close()
+            for n in range(ROTATED_FILES - 1, 0, -1):
+                if os.path.exists(f"{root}.{n}{ext}"):
+                    os.replace(f"{root}.{n}{ext}", f"{root}.{n + 1}{ext}")
+            os.replace(self.path, f"{root}.1{ext}")
+            self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def summary(self):
+        """Per-category table with p50/p95 latency, followed by phase timings"""
+        lines = [f"{'category':<10} {'requests':>8} {'cached':>6} {'errors':>6} {'capped':>6} "
+                 f"{'p50 ms':>7} {'p95 ms':>7} {'max ms':>7} {'rows':>7} {'MB':>6}"]
+        with self._lock:
+            for category, stats in self.categories.items():
+                p50, p95 = percentile(stats.latencies, 50), percentile(stats.latencies, 95)
+                ms = [f"{v * 1000:>7.0f}" if v is not None else f"{'-':>7}" for v in (p50, p95, stats.slowest)]
+                lines.append(f"{category:<10} {stats.requests:>8} {stats.cached:>6} {stats.errors:>6} "
+                             f"{stats.capped:>6} {' '.join(ms)} {stats.rows:>7} {stats.bytes / 1024 / 1024:>6.1f}")
+            if self.phases:
+                lines.append("Phases: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items()))
+        lines.append(f"Per-request metrics: {self.path}")
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """Render the current totals in the Prometheus text exposition format"""
+        counters = [
+            ("zealty_requests_total", "API queries, including cache hits", "requests"),
+            ("zealty_cached_requests_total", "Queries answered from the response cache", "cached"),
+            ("zealty_request_errors_total", "Queries that failed after all retries", "errors"),
+            ("zealty_capped_responses_total", "Responses at the row cap", "capped"),
+            ("zealty_rows_total", "Rows returned", "rows"),
+            ("zealty_response_bytes_total", "Response body bytes", "bytes"),
+        ]
+        lines = []
+        with self._lock:
+            for name, help_text, attr in counters:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for category, stats in self.categories.items():
+                    lines.append(f'{name}{{category="{category}"}} {getattr(stats, attr)}')
+
+            name = "zealty_request_duration_seconds"
+            lines += [f"# HELP {name} API request latency", f"# TYPE {name} histogram"]
+            for category, stats in self.categories.items():
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    lines.append(f'{name}_bucket{{category="{category}",le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{category="{category}",le="+Inf"}} {stats.timed}')
+                lines.append(f'{name}_sum{{category="{category}"}} {stats.total_latency:.6f}')
+                lines.append(f'{name}_count{{category="{category}"}} {stats.timed}')
+
+            name = "zealty_phase_seconds"
+            lines += [f"# HELP {name} Time spent in each phase of the run", f"# TYPE {name} gauge"]
+            for phase, seconds in self.phases.items():
+                lines.append(f'{name}{{phase="{phase}"}} {seconds:.6f}')
+        return "\n".join(lines) + "\n"
+
+def timed(metrics, name):
+    """metrics.phase(name), or a no-op when there is no Metrics object"""
+    return metrics.phase(name) if metrics is not None else contextlib.nullcontext()
+
+def serve_metrics(metrics, port, host="127.0.0.1", routes=None):
+    """Serve GET /metrics in Prometheus text format from a background thread
+
+    routes maps further paths to functions returning (status code, content
+    type, body text). Returns the server; call shutdown() on it to stop serving.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    handlers = {"/metrics": lambda: (200, "text/plain; version=0.0.4", metrics.prometheus())}
+    handlers.update(routes or {})
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            handler = handlers.get(self.path.split("?")[0])
+            if handler is None:
+                self.send_error(404)
+                return
+            status, content_type, text = handler()
+            body = text.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving Prometheus metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,281 @@
+"""Writing listings to disk
+
+Rows are written as they arrive: each batch is deduplicated by MLS number and
+appended to a `.partial` file per output format, which is renamed into place
+once the category is complete. A crash leaves the rows collected so far in
+the `.partial` CSV.
+
+Rows are Listing tuples whose values were typed when they were decoded. CSV
+writes them as text, Parquet and Arrow IPC store each column with its type
+(see SCHEMA) and need the optional pyarrow dependency. Text kept in a
+numeric column (see TEXT_FALLBACK_COLUMNS) is null there and stored in a
+string column of the same name ending in _Text, so all three formats hold
+the same values.
+"""
+import csv
+import os
+from itertools import islice
+
+from zealty_listing import COLUMNS, SCHEMA, TEXT_FALLBACK_COLUMNS, Listing, csv_rows, decode_rows
+from zealty_profile import phase
+
+RUNS_GLOB = os.path.join("data", "run-*")
+
+# File name prefixes of each category; the sold and expired names end in their window
+CATEGORY_FILES = {"active": "for_sale_today", "sold": "solds_last_", "expired": "expired_last_"}
+
+# Rows buffered per Parquet row group / Arrow record batch
+COLUMNAR_BATCH_SIZE = 10_000
+
+# Rows deduplicated per chunk when streaming an iterable through a writer
+WRITE_CHUNK_SIZE = 5_000
+
+def _pyarrow():
+    """Import pyarrow, which is only needed for the columnar formats"""
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+    return pyarrow
+
+# Numeric column -> string column for its values that aren't numbers
+TEXT_COLUMNS = {col: col + "_Text" for col in COLUMNS if col in TEXT_FALLBACK_COLUMNS}
+
+def arrow_schema():
+    pa = _pyarrow()
+    return pa.schema([pa.field(col, getattr(pa, SCHEMA[col][0])()) for col in COLUMNS]
+                     + [pa.field(text_col, pa.string()) for text_col in TEXT_COLUMNS.values()])
+
+def to_record_batch(rows, schema):
+    """Convert Listings to a typed Arrow record batch, with kept text in the _Text columns"""
+    pa = _pyarrow()
+    arrays = []
+    texts = {}
+    for col, values in zip(COLUMNS, zip(*rows)):
+        if col in TEXT_COLUMNS:
+            if str in set(map(type, values)):
+                texts[col] = [value if type(value) is str else None for value in values]
+                values = [None if type(value) is str else value for value in values]
+            else:
+                texts[col] = [None] * len(values)
+        arrays.append(pa.array(values, type=schema.field(col).type))
+    arrays += [pa.array(texts[col], type=pa.string()) for col in TEXT_COLUMNS]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+class CsvFormat:
+    """Plain CSV, flushed after every batch"""
+    extension = ".csv"
+
+    def __init__(self, partial_path):
+        self._file = open(partial_path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+
+    def write(self, rows):
+        self._writer.writerows(csv_rows(rows))
+        self._file.flush()
+
+    def close(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+
+class _ColumnarFormat:
+    """Buffers rows and writes them as typed record batches"""
+
+    def __init__(self, partial_path):
+        self.schema = arrow_schema()
+        self.partial_path = partial_path
+        self._buffer = []
+        self._writer = self._open(partial_path)
+
+    def write(self, rows):
+        self._buffer.extend(rows)
+        if len(self._buffer) >= COLUMNAR_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._write_batch(to_record_batch(self._buffer, self.schema))
+            self._buffer = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+    def abort(self):
+        self._buffer = []
+        try:
+            self._writer.close()
+        except Exception:
+            pass
+
+class ParquetFormat(_ColumnarFormat):
+    """Parquet with zstd compression, one row group per buffered batch"""
+    extension = ".parquet"
+
+    def _open(self, partial_path):
+        pq = _pyarrow().parquet
+        return pq.ParquetWriter(partial_path, self.schema, compression="zstd")
+
+    def _write_batch(self, batch):
+        self._writer.write_table(_pyarrow().Table.from_batches([batch]))
+
+class ArrowFormat(_ColumnarFormat):
+    """Arrow IPC file format with zstd compressed buffers"""
+    extension = ".arrow"
+
+    def _open(self, partial_path):
+        pa = _pyarrow()
+        options = pa.ipc.IpcWriteOptions(compression="zstd")
+        return pa.ipc.new_file(partial_path, self.schema, options=options)
+
+    def _write_batch(self, batch):
+        self._writer.write_batch(batch)
+
+FORMATS = {
+    "csv": CsvFormat,
+    "parquet": ParquetFormat,
+    "arrow": ArrowFormat,
+}
+
+def check_formats(formats):
+    """Return an error message if a requested format can't be written here, else None"""
+    unknown = [f for f in formats if f not in FORMATS]
+    if unknown:
+        return f"Unknown output format(s): {', '.join(unknown)}"
+    if any(f != "csv" for f in formats):
+        try:
+            _pyarrow()
+        except ImportError:
+            return "Parquet/Arrow output needs pyarrow: pip install 'vancouver-real-estate-scraper[parquet]'"
+    return None
+
+class ListingWriter:
+    """Streams deduplicated rows to one file per output format
+
+    Each file is written as `<name><ext>.partial` and renamed into place on
+    finish.
+    """
+
+    def __init__(self, name, run_dir, formats=("csv",), dedupe=True):
+        self.name = name
+        self.dedupe = dedupe
+        self.seen = set()
+        self.count = 0
+        self.received = 0
+        self.sample = None
+        self.paths = []
+        self.outputs = []
+        for fmt in formats:
+            path = os.path.join(run_dir, name + FORMATS[fmt].extension)
+            self.paths.append(path)
+            self.outputs.append(FORMATS[fmt](path + ".partial"))
+
+    def write_batch(self, rows):
+        """Append Listings, skipping any whose MLS number was already written
+
+        rows may be any iterable, so a large snapshot can be streamed through
+        in chunks without loading it all. Returns the number of rows written.
+        """
+        written = 0
+        chunk = []
+        with phase("dedup"):
+            for row in rows:
+                self.received += 1
+                if self.dedupe:
+                    mls = row.mls_number
+                    if not mls or mls in self.seen:
+                        continue
+                    self.seen.add(mls)
+                chunk.append(row)
+                if len(chunk) >= WRITE_CHUNK_SIZE:
+                    written += self._write(chunk)
+                    chunk = []
+            if chunk:
+                written += self._write(chunk)
+        return written
+
+    def _write(self, rows):
+        if self.sample is None:
+            self.sample = rows[0]
+        with phase("write"):
+            for output in self.outputs:
+                output.write(rows)
+        self.count += len(rows)
+        return len(rows)
+
+    def finish(self):
+        """Close every output and move it into place, printing a sample row"""
+        for output in self.outputs:
+            output.close()
+        if not self.count:
+            for path in self.paths:
+                os.remove(path + ".partial")
+            print(f"No listings to save for {self.name}")
+            return
+        for path in self.paths:
+            os.replace(path + ".partial", path)
+            print(f"Saved {self.count} listings to {path}")
+        print_sample(self.sample, self.name)
+
+    def abort(self):
+        """Close every output, leaving the rows written so far in the .partial files"""
+        for output in self.outputs:
+            output.abort()
+
+def iter_rows(run_dir, name, batch_size=WRITE_CHUNK_SIZE):
+    """Stream a saved category back as Listings, from whichever format exists"""
+    csv_path = os.path.join(run_dir, name + ".csv")
+    if os.path.exists(csv_path):
+        with open(csv_path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            while True:
+                chunk = list(islice(reader, batch_size))
+                if not chunk:
+                    break
+                yield from decode_rows(chunk)
+        return
+
+    parquet_path = os.path.join(run_dir, name + ".parquet")
+    arrow_path = os.path.join(run_dir, name + ".arrow")
+    if os.path.exists(parquet_path):
+        batches = _pyarrow().parquet.ParquetFile(parquet_path).iter_batches(batch_size=batch_size)
+    elif os.path.exists(arrow_path):
+        reader = _pyarrow().ipc.open_file(arrow_path)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    else:
+        return
+    for batch in batches:
+        columns = batch.to_pydict()
+        for col, text_col in TEXT_COLUMNS.items():
+            # Files written before the _Text columns existed don't have them
+            if text_col in columns:
+                columns[col] = [value if text is None else text for value, text in zip(columns[col], columns[text_col])]
+        yield from (Listing._make(row) for row in zip(*(columns[col] for col in COLUMNS)))
+
+def print_sample(sample, filename):
+    """Print one listing column by column"""
+    print(f"\nSample listing from {filename}:")
+    for i, col in enumerate(COLUMNS):
+        if i < len(sample):
+            value = str(sample[i])[:100]
+            print(f"  {col}: {value}")
+
+def save_to_csv(listings, filename, run_dir):
+    """Save listings to a CSV file in the run directory"""
+    if not listings:
+        print(f"No listings to save for {filename}")
+        return
+
+    filepath = os.path.join(run_dir, filename)
+    output = CsvFormat(filepath + ".partial")
+    output.write([row if isinstance(row, Listing) else Listing.from_row(row) for row in listings])
+    output.close()
+    os.replace(filepath + ".partial", filepath)
+    print(f"Saved {len(listings)} listings to {filepath}")
+    print_sample(listings[0], filename)
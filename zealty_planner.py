@@ -0,0 +1,309 @@
+"""Query planning from per-box density statistics
+
+Without a plan every job starts from its whole region, and each query that
+hits the row cap costs a request before its quadrants (or date windows) are
+fetched. Most of those splits are the same from one run to the next, so after
+every run the planner saves the final boxes of each job with how many rows
+they held: rows for active listings, rows per day for sold and expired,
+whose date windows change every day.
+
+The next run starts from those boxes instead:
+- sibling quadrants whose rows add up to well under the cap are merged back
+  into their parent, so sparse areas take one request instead of four
+- a box that has come back empty in PRUNE_AFTER full runs in a row (water,
+  US territory, parkland) is skipped, except that every RECHECK_EVERY-th
+  run queries it again in case listings have appeared
+- sold and expired boxes start with a date window sized from their density,
+  so a dense box doesn't spend its first request on a capped window
+
+Every box is still walked and split by collect_adaptive, so a box that has
+become denser than its statistics say is split as usual. Stats are kept per
+job and dropped when its bounds, category or property filter change. A job
+with failed boxes keeps its previous stats, and so does an incremental run,
+whose rows newer than each mark say little about how dense a box is; its
+active jobs start from the region, since those rows are far fewer than the
+stats' boxes held.
+
+    uv run zealty_scraper_multi.py              # plans from data/density.json when it exists
+    uv run zealty_scraper_multi.py --no-plan    # start from whole regions, still updating the stats
+"""
+import json
+import math
+import os
+
+from zealty_grid import ROW_LIMIT, box_contains, split_box, window_days
+
+DENSITY_FILE = os.path.join("data", "density.json")
+
+# Merge sibling boxes only while they are expected to stay this far under the cap
+MERGE_FILL = 0.6
+
+# Skip a box once it has been empty in this many full runs in a row...
+PRUNE_AFTER = 3
+
+# ...but query it again every this many runs
+RECHECK_EVERY = 7
+
+def _area(box):
+    lat_min, lat_max, lon_min, lon_max = box
+    return (lat_max - lat_min) * (lon_max - lon_min)
+
+def _fingerprint(job):
+    """What a job's statistics depend on (its date window only scales them)"""
+    return [job.sold_flag, list(job.bounds), job.where, job.date_column]
+
+def _finest(leaves):
+    """{box: rows} over the smallest boxes of a run's leaves
+
+    A date-bounded box walks its newest windows before it splits, so a box
+    and its quadrants can both be leaves. The rows of such a box are shared
+    between the smallest boxes inside it in proportion to their own rows.
+    """
+    rows = {}
+    for box, _, count, _ in leaves:
+        rows[box] = rows.get(box, 0) + count
+    nested = {box: [b for b in rows if b != box and box_contains(box, b)] for box in rows}
+    finest = {box: float(count) for box, count in rows.items() if not nested[box]}
+    for box, inside in nested.items():
+        inside = [b for b in inside if b in finest]
+        if not inside:
+            continue
+        weight = sum(rows[b] for b in inside)
+        for b in inside:
+            finest[b] += rows[box] * (rows[b] / weight if weight else 1 / len(inside))
+    return finest
+
+class BoxStats:
+    """Density, empty streak and skip count of one box"""
+
+    __slots__ = ("box", "density", "empty_runs", "skipped_runs")
+
+    def __init__(self, box, density, empty_runs=0, skipped_runs=0):
+        self.box = box
+        self.density = density  # rows, or rows per day for date-bounded jobs
+        self.empty_runs = empty_runs
+        self.skipped_runs = skipped_runs
+
+    @property
+    def prunable(self):
+        return self.empty_runs >= PRUNE_AFTER and self.skipped_runs + 1 < RECHECK_EVERY
+
+    def expected(self, box):
+        """Density expected in box, which lies inside this box or contains it"""
+        if box_contains(box, self.box):
+            return self.density
+        return self.density * _area(box) / _area(self.box)
+
+class QueryPlanner:
+    """Per-box density statistics from previous runs, and the query plans built from them"""
+
+    def __init__(self, path=DENSITY_FILE, limit=ROW_LIMIT, enabled=True):
+        self.path = path
+        self.limit = limit
+        self.enabled = enabled
+        self.stats = {}
+        self.requests = {}
+        self.fingerprints = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+        for key, entry in saved.get("jobs", {}).items():
+            self.fingerprints[key] = entry["query"]
+            self.requests[key] = entry["requests"]
+            self.stats[key] = [BoxStats(tuple(box[:4]), *box[4:]) for box in entry["boxes"]]
+        self._reset()
+
+    def _reset(self):
+        # What the latest plan() did, for update() and summary()
+        self.planned = {}
+        self.skipped = {}
+        self.merges = {}
+        self.estimated = 0
+        self.previous = {}
+
+    def _usable(self, key, job):
+        return self.enabled and key in self.stats and self.fingerprints[key] == _fingerprint(job)
+
+    def plan(self, leads, date_range, window_rows, marks=None):
+        """collect_adaptive tasks for the lead jobs: (key, box) or (key, box, dates, days) with a sized first window
+
+        marks are the incremental marks per key, if any.
+        """
+        self._reset()
+        marks = marks or {}
+        tasks = []
+        fill = self.limit * MERGE_FILL
+        for key, job in leads.items():
+            self.previous[key] = self.requests.get(key) if self.fingerprints.get(key) == _fingerprint(job) else None
+            # An incremental run asks for active listings newer than each box's
+            # mark, far fewer than the stats' boxes held, so it starts from the
+            # region like an unplanned run. Sold and expired densities are per
+            # day, so their plan already shrinks with the dates left to fetch.
+            since = job.since is None and key in marks and marks[key].query_since(job.bounds)
+            if since or not self._usable(key, job):
+                tasks.append((key, job.bounds))
+                self.planned[key] = 1
+                self.estimated += 1
+                continue
+            entries = self.stats[key]
+            skipped = self.skipped[key] = []
+            merges = self.merges[key] = {}
+            boxes = []
+
+            def days(box):
+                dates = date_range(key, box)
+                return max(window_days(dates), 0) if dates else 1
+
+            def emit(box, inside, known=True):
+                boxes.append((box, sum(e.density for e in inside) if known else None))
+                if len(inside) > 1:
+                    merges[box] = [e.box for e in inside]
+
+            def mergeable(box):
+                """The stats inside box if it can be fetched in one request, else None"""
+                inside = [e for e in entries if box_contains(box, e.box)]
+                if (not inside or all(e.prunable for e in inside)
+                        or sum(_area(e.box) for e in inside) < _area(box) * 0.999
+                        or sum(e.density for e in inside) * days(box) > fill):
+                    return None
+                return inside
+
+            def visit(node):
+                inside = [e for e in entries if box_contains(node, e.box)]
+                if not inside:
+                    # Not covered by the stats (e.g. a box that failed), so start from it
+                    emit(node, [], known=False)
+                    return
+                if all(e.prunable for e in inside):
+                    skipped.append(node)
+                    return
+                if len(inside) == 1 and inside[0].box == node or mergeable(node):
+                    emit(node, inside)
+                    return
+                # A box that was split hit the cap, but two of its quadrants may
+                # still fit in one request between them
+                quadrants = split_box(node)
+                parts = [mergeable(quadrant) for quadrant in quadrants]
+                paired = set()
+                for a, b in ((0, 1), (2, 3), (0, 2), (1, 3)):
+                    if a in paired or b in paired or parts[a] is None or parts[b] is None:
+                        continue
+                    union = (quadrants[a][0], quadrants[b][1], quadrants[a][2], quadrants[b][3])
+                    if sum(e.density for e in parts[a] + parts[b]) * days(union) <= fill:
+                        emit(union, parts[a] + parts[b])
+                        paired.update((a, b))
+                for index, quadrant in enumerate(quadrants):
+                    if index not in paired:
+                        visit(quadrant)
+
+            visit(job.bounds)
+            self.planned[key] = len(boxes)
+            for box, density in boxes:
+                if job.since is None:
+                    tasks.append((key, box))
+                    self.estimated += 1
+                    continue
+                rows = density * days(box) if density is not None else 0
+                # Aim the first window at window_rows; unknown or sparse boxes ask for everything
+                first = max(1, int(window_rows * days(box) / rows)) if rows > window_rows else None
+                tasks.append((key, box, date_range(key, box), first))
+                self.estimated += max(1, math.ceil(rows / window_rows))
+        return tasks
+
+    def _unmerge(self, key, leaves, previous):
+        """leaves with the rows of each merged request shared back out to the boxes it covered
+
+        Also returns the boxes whose share is only an estimate: those of
+        merged requests that found any rows.
+        """
+        merges = self.merges.get(key)
+        if not merges:
+            return leaves, set()
+        kept = []
+        totals = dict.fromkeys(merges, 0)
+        for leaf in leaves:
+            union = next((box for box in merges if box_contains(box, leaf[0])), None)
+            if union is None:
+                kept.append(leaf)
+            else:
+                totals[union] += leaf[2]
+        densities = {e.box: e.density for e in previous}
+        shared = set()
+        for union, boxes in merges.items():
+            weight = sum(densities.get(box, 0) for box in boxes)
+            for box in boxes:
+                share = densities.get(box, 0) / weight if weight else 1 / len(boxes)
+                kept.append((box, None, totals[union] * share, None))
+                if totals[union]:
+                    shared.add(box)
+        return kept, shared
+
+    def update(self, leads, results, date_range, marks):
+        """Replace each job's stats with what this run found
+
+        An incremental run only fetched rows newer than each box's mark, which
+        says little about density or emptiness, so a job with marks keeps the
+        boxes of its last full run and only counts the ones it skipped.
+        """
+        for key, job in leads.items():
+            requests, _, leaves, failed = results[key]
+            if failed:
+                continue
+            previous = self.stats.get(key, []) if self.fingerprints.get(key) == _fingerprint(job) else []
+            if key in marks:
+                skipped = self.skipped.get(key, [])
+                if previous:
+                    self.stats[key] = [BoxStats(e.box, e.density, e.empty_runs, e.skipped_runs + 1)
+                                       if any(box_contains(node, e.box) for node in skipped) else e
+                                       for e in previous]
+                    self.requests[key] = requests
+                continue
+            leaves, shared = self._unmerge(key, leaves, previous)
+            entries = []
+            for box, rows in _finest(leaves).items():
+                density = rows
+                if job.since is not None:
+                    dates = date_range(key, box)
+                    density = rows / window_days(dates) if dates and window_days(dates) > 0 else 0.0
+                empty_runs = 0
+                if not rows:
+                    # A box fetched together with others was only assumed empty
+                    around = [e for e in previous if box_contains(box, e.box) or box_contains(e.box, box)]
+                    empty_runs = min((e.empty_runs for e in around), default=0) + (0 if box in shared else 1)
+                entries.append(BoxStats(box, round(density, 6), empty_runs))
+            for node in self.skipped.get(key, []):
+                for e in previous:
+                    if box_contains(node, e.box):
+                        entries.append(BoxStats(e.box, e.density, e.empty_runs, e.skipped_runs + 1))
+            self.stats[key] = entries
+            self.fingerprints[key] = _fingerprint(job)
+            self.requests[key] = requests
+
+    def save(self):
+        saved = {"jobs": {key: {
+            "query": self.fingerprints[key],
+            "requests": self.requests[key],
+            "boxes": [list(e.box) + [e.density, e.empty_runs, e.skipped_runs] for e in entries],
+        } for key, entries in self.stats.items()}}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(saved, f)
+        os.replace(tmp_path, self.path)
+
+    def summary(self, results):
+        """Planned vs executed requests for the run"""
+        executed = sum(results[key][0] for key in self.planned)
+        skipped = sum(map(len, self.skipped.values()))
+        merged = [boxes for merges in self.merges.values() for boxes in merges.values()]
+        line = (f"Query plan: {sum(self.planned.values())} boxes ({sum(map(len, merged))} merged into {len(merged)}, "
+                f"{skipped} empty skipped), {self.estimated} requests planned, {executed} executed")
+        previous = [self.previous[key] for key in self.planned if self.previous.get(key) is not None]
+        if len(previous) == len(self.planned):
+            line += f" (previous run: {sum(previous)})"
+        unplanned = [key for key in self.planned if self.previous.get(key) is None]
+        if unplanned and self.enabled:
+            line += f"; no stats yet for {', '.join(unplanned)}"
+        return line
@@ -0,0 +1,261 @@
+"""Built-in profiler for --profile
+
+The pipeline marks its phases with phase(name): the run's own phases
+(session, collect, finish, save and their steps) through Metrics.phase, and per
+request fetch (waiting on the API or the cache), decode (JSON and Listing
+decoding), dedup (ListingWriter's MLS check) and write (the format writers).
+phase() is a shared no-op unless a Profiler is running.
+
+While one runs:
+- every phase records its calls, wall and CPU seconds (time.thread_time of
+  its thread), in total and excluding the phases nested inside it
+- a sampling thread records the Python stack of every thread inside a phase
+  every `interval` seconds, keyed by the thread's phase path, so blocked
+  threads show up as well as busy ones
+- tracemalloc takes a snapshot whenever a top-level phase of the main thread
+  ends, recording current and peak traced memory and the lines that
+  allocated the most since the previous snapshot, unless memory=False;
+  tracing every allocation makes decoding several times slower, so phase
+  times are only faithful without it
+
+save() writes profile.json and profile.stacks, the samples in the collapsed
+stack format read by flamegraph.pl, speedscope and inferno.
+"""
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_FILE = "profile.json"
+STACKS_FILE = "profile.stacks"
+
+# Seconds between stack samples
+DEFAULT_INTERVAL = 0.005
+
+# Allocation sites kept per memory snapshot, and hot functions in the report
+TOP_LINES = 15
+TOP_FUNCTIONS = 25
+
+_NULL = contextlib.nullcontext()
+_active = None
+
+def phase(name):
+    """Mark a phase of the pipeline on this thread, if a Profiler is running"""
+    if _active is None:
+        return _NULL
+    return _active.phase(name)
+
+
+class PhaseStats:
+    """Totals for one phase, inclusive and excluding nested phases"""
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.self_wall = 0.0
+        self.self_cpu = 0.0
+
+class _Phase:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        stack = self.profiler._stack()
+        self.path = f"{stack[-1].path};{self.name}" if stack else self.name
+        self.top_level = not stack and threading.current_thread() is threading.main_thread()
+        self.child_wall = self.child_cpu = 0.0
+        stack.append(self)
+        if self.top_level:
+            self.profiler._reset_peak()
+        self.cpu_started = time.thread_time()
+        self.wall_started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall_started
+        cpu = time.thread_time() - self.cpu_started
+        stack = self.profiler._stack()
+        stack.pop()
+        if stack:
+            stack[-1].child_wall += wall
+            stack[-1].child_cpu += cpu
+        self.profiler._record(self, wall, cpu)
+        return False
+
+class Profiler:
+    """Per-phase timings, sampled stacks and tracemalloc snapshots for one process"""
+
+    def __init__(self, interval=DEFAULT_INTERVAL, memory=True):
+        self.interval = interval
+        self.memory = memory
+        self.phases = {}
+        self.samples = Counter()
+        self.snapshots = []
+        self.started = None
+        self.elapsed = 0.0
+        self._stacks = {}
+        self._names = {}
+        self._previous = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        """Start sampling and tracing, and make phase() record into this profiler"""
+        global _active
+        if self.memory:
+            import tracemalloc
+
+            tracemalloc.start()
+            self._previous = tracemalloc.take_snapshot()
+        self.started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, name="zealty-profiler", daemon=True)
+        self._sampler.start()
+        _active = self
+        return self
+
+    def stop(self):
+        """Stop sampling and tracing; safe to call more than once"""
+        global _active
+        if self._sampler is None:
+            return
+        if _active is self:
+            _active = None
+        self._stopped.set()
+        self._sampler.join()
+        self._sampler = None
+        self.elapsed = time.perf_counter() - self.started
+        if self.memory:
+            import tracemalloc
+
+            tracemalloc.stop()
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def _stack(self):
+        ident = threading.get_ident()
+        stack = self._stacks.get(ident)
+        if stack is None:
+            stack = self._stacks[ident] = []
+        return stack
+
+    def _record(self, entry, wall, cpu):
+        with self._lock:
+            stats = self.phases.get(entry.path)
+            if stats is None:
+                stats = self.phases[entry.path] = PhaseStats()
+            stats.calls += 1
+            stats.wall += wall
+            stats.cpu += cpu
+            stats.self_wall += wall - entry.child_wall
+            stats.self_cpu += cpu - entry.child_cpu
+        if entry.top_level and self.memory:
+            self._snapshot(entry.path)
+
+    def _reset_peak(self):
+        if self.memory:
+            import tracemalloc
+
+            # reset_peak() is new in Python 3.9; before that peaks cover the whole run
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+
+    def _snapshot(self, name):
+        import tracemalloc
+
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+        top = []
+        for diff in snapshot.compare_to(self._previous, "lineno")[:TOP_LINES]:
+            frame = diff.traceback[0]
+            top.append({"line": f"{frame.filename}:{frame.lineno}", "size": diff.size,
+                        "size_diff": diff.size_diff, "count_diff": diff.count_diff})
+        self._previous = snapshot
+        self.snapshots.append({"phase": name, "current": current, "peak": peak, "top": top})
+
+    def _sample(self):
+        me = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, stack in list(self._stacks.items()):
+                frame = frames.get(ident)
+                if ident == me or frame is None:
+                    continue
+                try:
+                    path = stack[-1].path
+                except IndexError:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    name = self._names.get(code)
+                    if name is None:
+                        name = self._names[code] = (f"{code.co_name} "
+                                                    f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    names.append(name)
+                    frame = frame.f_back
+                names.reverse()
+                self.samples[path, tuple(names)] += 1
+
+    def report(self):
+        """Everything the profiler recorded, as a JSON-serialisable dict"""
+        by_phase = Counter()
+        hot = Counter()
+        for (path, names), count in self.samples.items():
+            by_phase[path] += count
+            hot[path.rsplit(";", 1)[-1], names[-1]] += count
+        return {
+            "seconds": round(self.elapsed, 3),
+            "interval": self.interval,
+            "samples": sum(by_phase.values()),
+            "phases": {path: {
+                "calls": stats.calls,
+                "wall": round(stats.wall, 6),
+                "cpu": round(stats.cpu, 6),
+                "self_wall": round(stats.self_wall, 6),
+                "self_cpu": round(stats.self_cpu, 6),
+                "samples": by_phase[path],
+            } for path, stats in self.phases.items()},
+            "hot_functions": [{"phase": name, "function": function, "samples": count}
+                              for (name, function), count in hot.most_common(TOP_FUNCTIONS)],
+            "memory": self.snapshots,
+        }
+
+    def save(self, run_dir, suffix=""):
+        """Write profile<suffix>.json and the collapsed stacks to run_dir and return both paths"""
+        root, ext = os.path.splitext(PROFILE_FILE)
+        report_path = os.path.join(run_dir, root + suffix + ext)
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=1)
+        root, ext = os.path.splitext(STACKS_FILE)
+        stacks_path = os.path.join(run_dir, root + suffix + ext)
+        with open(stacks_path, "w", encoding="utf-8") as f:
+            for (path, names), count in sorted(self.samples.items()):
+                f.write(f"{path};{';'.join(names)} {count}\n")
+        return report_path, stacks_path
+
+    def summary(self):
+        """Per-phase table sorted by time spent in the phase itself, then memory per snapshot"""
+        report = self.report()
+        total = report["samples"] or 1
+        lines = [f"{'phase':<32} {'calls':>7} {'wall s':>8} {'cpu s':>8} {'self wall':>9} {'self cpu':>8} {'samples':>7}"]
+        for path, stats in sorted(report["phases"].items(), key=lambda item: -item[1]["self_wall"]):
+            lines.append(f"{path:<32} {stats['calls']:>7} {stats['wall']:>8.2f} {stats['cpu']:>8.2f} "
+                         f"{stats['self_wall']:>9.2f} {stats['self_cpu']:>8.2f} {stats['samples'] * 100 / total:>6.1f}%")
+        for snapshot in report["memory"]:
+            line = (f"Memory after {snapshot['phase']}: {snapshot['current'] / 1024 / 1024:.1f} MB traced, "
+                    f"peak {snapshot['peak'] / 1024 / 1024:.1f} MB")
+            if snapshot["top"]:
+                biggest = snapshot["top"][0]
+                line += f", most allocated at {biggest['line']} ({biggest['size_diff'] / 1024 / 1024:+.1f} MB)"
+            lines.append(line)
+        return "\n".join(lines)
@@ -0,0 +1,168 @@
+"""Rate limiting, retries and adaptive concurrency for API requests
+
+RequestScheduler wraps an ApiClient (or anything with post/close). Every
+request waits for a token-bucket slot and a concurrency slot. Throttling
+(429), server errors (5xx), timeouts and dropped connections are retried with
+jittered exponential backoff. The concurrency limit follows AIMD: it grows by
+one slot per window of successes and halves when the upstream pushes back.
+The request rate does the same on 429s, so several sessions sharing one
+upstream limit (see zealty_shard) settle under it instead of failing boxes.
+"""
+import random
+import threading
+import time
+
+# Statuses worth retrying; anything else is returned to the caller as is
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+DEFAULT_RATE = 20.0
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts up to `burst`
+
+    throttled() halves the rate, at most once per cooldown, and every
+    success() adds 1/rate back, so the rate recovers by about one request
+    per second each second until it is back at `rate`.
+    """
+
+    def __init__(self, rate, burst=None, cooldown=1.0):
+        self.rate = rate
+        self.maximum = rate
+        self.minimum = min(rate, 0.5)
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.cooldown = cooldown
+        self.decreased = 0.0
+        self._lock = threading.Lock()
+
+    def throttled(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self.decreased >= self.cooldown:
+                self.rate = max(self.minimum, self.rate / 2)
+                self.decreased = now
+
+    def success(self):
+        with self._lock:
+            self.rate = min(self.maximum, self.rate + 1 / self.rate)
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class AimdLimiter:
+    """Concurrency limit with additive increase and multiplicative decrease"""
+
+    def __init__(self, maximum, minimum=1, cooldown=1.0):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.cooldown = cooldown
+        self.decreased = 0.0
+        self.decreases = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                # Requests already in flight when the upstream pushed back
+                # will often fail too; only halve once per cooldown
+                if now - self.decreased >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.decreased = now
+                    self.decreases += 1
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+class RequestScheduler:
+    """Drop-in wrapper for a client that rate limits, retries and adapts concurrency"""
+
+    def __init__(self, client, max_concurrency, rate=DEFAULT_RATE, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF):
+        self.client = client
+        self.bucket = TokenBucket(rate) if rate else None
+        self.limiter = AimdLimiter(max_concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.requests = 0
+        self.retried = 0
+        self._lock = threading.Lock()
+
+    def _delay(self, attempt, resp=None):
+        """Full-jitter exponential backoff, or the server's Retry-After if it sent one"""
+        if resp is not None:
+            retry_after = resp.headers.get("retry-after", "")
+            if retry_after.isdigit():
+                return min(MAX_BACKOFF, float(retry_after))
+        return random.uniform(0, min(MAX_BACKOFF, self.backoff * 2 ** attempt))
+
+    def post(self, form):
+        """POST with retries; returns the final response or raises the final error"""
+        import http.client
+
+        for attempt in range(self.retries + 1):
+            if self.bucket:
+                self.bucket.acquire()
+            self.limiter.acquire()
+            with self._lock:
+                self.requests += 1
+            resp = error = None
+            throttled = False
+            try:
+                resp = self.client.post(form)
+                throttled = resp.status in RETRY_STATUSES
+            except (OSError, http.client.HTTPException) as e:
+                # Timeouts, refused and dropped connections
+                error = e
+                throttled = True
+            finally:
+                self.limiter.release(throttled)
+
+            if self.bucket:
+                if resp is not None and resp.status == 429:
+                    self.bucket.throttled()
+                elif not throttled:
+                    self.bucket.success()
+            if not throttled or attempt == self.retries:
+                if error is not None:
+                    raise error
+                return resp
+            with self._lock:
+                self.retried += 1
+            reason = error if error is not None else f"HTTP {resp.status}"
+            delay = self._delay(attempt, resp)
+            print(f"  {reason}, retrying in {delay:.1f}s (attempt {attempt + 2}/{self.retries + 1})")
+            time.sleep(delay)
+
+    def close(self):
+        self.client.close()
+
+    def summary(self):
+        line = (f"Scheduler: {self.requests} requests, {self.retried} retried, "
+                f"concurrency limit {self.limiter.limit:.1f}/{self.limiter.maximum} "
+                f"after {self.limiter.decreases} backoffs")
+        if self.bucket:
+            line += f", rate {self.bucket.rate:.1f}/{self.bucket.maximum:g} per second"
+        return line
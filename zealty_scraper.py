@@ -1,15 +1,11 @@
-import os
 import json
-import time
 import csv
 from playwright.sync_api import sync_playwright
-from dotenv import load_dotenv
 from urllib.parse import parse_qs, urlparse
 
-load_dotenv()
+from zealty_session import MAP_TIMEOUT, api_responses, credentials, open_map, sign_in, wait_for_signal
 
-USERNAME = os.getenv("ZEALTY_USERNAME")
-PASSWORD = os.getenv("ZEALTY_PASSWORD")
+USERNAME, PASSWORD = credentials()
 
 def run():
     captured_token = None
@@ -20,14 +16,8 @@ def run():
         browser = p.chromium.launch(headless=True)
         context = browser.new_context()
         page = context.new_page()
+        responses = api_responses(page)
 
-        print("Navigating to login page...")
-        page.goto("https://www.zealty.ca/sign-in")
-
-        print("Filling credentials...")
-        page.fill("#email", USERNAME)
-        page.fill("#password", PASSWORD)
-        
         # Capture the API request to get the session token
         def handle_response(response):
             nonlocal captured_token, captured_sql, all_listings
@@ -61,26 +51,20 @@ def run():
 
         page.on("response", handle_response)
 
-        print("Clicking sign in...")
-        page.click("button:has-text('Sign In')")
-        
-        print("Waiting for login to complete...")
-        time.sleep(5)
+        sign_in(page, USERNAME, PASSWORD)
 
-        print("Navigating to map...")
-        page.goto("https://www.zealty.ca/map.html")
-        
         print("Waiting for map data to load...")
-        page.wait_for_load_state("networkidle")
-        time.sleep(10)
-        
+        open_map(page, responses)
+
         # Interact with map to trigger more API calls
         print("Interacting with map to load more listings...")
+        seen = len(responses)
         page.mouse.move(500, 500)
         page.mouse.down()
         page.mouse.move(600, 600)
         page.mouse.up()
-        time.sleep(5)
+        signal, waited = wait_for_signal(page, {"map data reloaded": lambda: len(responses) > seen}, MAP_TIMEOUT)
+        print(f"{signal or 'No new map data'} after {waited:.2f}s")
 
         browser.close()
 
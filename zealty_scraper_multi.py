@@ -1,246 +1,537 @@
 import os
+import sys
 import json
 import time
-import csv
 import re
-from datetime import datetime, timedelta
-from playwright.sync_api import sync_playwright
-from dotenv import load_dotenv
+import shutil
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
 from urllib.parse import parse_qs
 
-load_dotenv()
-
-USERNAME = os.getenv("ZEALTY_USERNAME")
-PASSWORD = os.getenv("ZEALTY_PASSWORD")
-
-# Validate credentials at startup
-if not USERNAME or not PASSWORD:
-    print("ERROR: Missing credentials!")
-    print("Please create a .env file with:")
-    print("  ZEALTY_USERNAME=your.email@example.com")
-    print("  ZEALTY_PASSWORD=your_password_here")
-    print("\nYou can copy .env.example to .env and fill in your credentials.")
-    exit(1)
-
-def save_to_csv(listings, filename, run_dir):
-    """Save listings to a CSV file in the run directory"""
-    if not listings:
-        print(f"No listings to save for {filename}")
-        return
-    
-    # The columns from the API response
-    columns = ['MLS_Number', 'Latitude', 'Longitude', 'Date', 'Unknown1', 'Address', 
-               'Neighborhood', 'Price', 'Description', 'Property_Type', 'Stories', 
-               'Unknown2', 'Bedrooms', 'Bathrooms', 'Unknown3', 'Unknown4', 'Unknown5']
-    
-    filepath = os.path.join(run_dir, filename)
-    with open(filepath, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(columns)
-        writer.writerows(listings)
-    
-    print(f"Saved {len(listings)} listings to {filepath}")
-    
-    # Print a sample
-    if len(listings) > 0:
-        print(f"\nSample listing from {filename}:")
-        sample = listings[0]
-        for i, col in enumerate(columns):
-            if i < len(sample):
-                value = str(sample[i])[:100]
-                print(f"  {col}: {value}")
-
-def run():
-    import hashlib
-    
+from zealty_cache import CACHE_DIR, ResponseCache
+from zealty_fetch import FetchError, FixtureRecorder, fetch_rows
+from zealty_grid import (MIN_BOX_SPAN, ROW_LIMIT, box_contains, build_sql, day_offset, generate_grid_boxes,
+                         newest_window, split_box, window_days)
+from zealty_jobs import DEFAULT_SPEC, METRO_BOUNDS, PROPERTY_FILTER, load_spec, plan_jobs
+from zealty_incremental import DEFAULT_LOOKBACK_DAYS, Marks, load_state, newest_date, prior_rows, save_state
+from zealty_metrics import Metrics, serve_metrics, timed
+from zealty_listing import unparsed_summary
+from zealty_output import COLUMNS, FORMATS, ListingWriter, check_formats, save_to_csv
+from zealty_planner import QueryPlanner
+from zealty_profile import Profiler
+from zealty_scheduler import DEFAULT_RATE, DEFAULT_RETRIES, RequestScheduler
+from zealty_session import MissingCredentials, ProbeFailed, open_client
+from zealty_store import ListingStore
+
+# Queries in flight at once, across all boxes and categories
+DEFAULT_WORKERS = 4
+
+# Date-bounded boxes whose remaining rows would take more than this many
+# windows to walk through are split into quadrants instead
+MAX_WALK_WINDOWS = 4
+
+# Size date windows to come back this full, and grow a sparse window by at
+# most this factor for the next query
+WINDOW_FILL = 0.8
+MAX_WINDOW_GROWTH = 4
+
+def collect_adaptive(fetch, jobs, sink, limit=ROW_LIMIT, min_span=MIN_BOX_SPAN, workers=DEFAULT_WORKERS,
+                     date_range=None, offload=None, refill=None):
+    """Collect every row for each job, narrowing queries whenever one hits the row cap
+
+    jobs is a list of (key, box) pairs and fetch(key, box, window) returns the
+    rows for a single box, where window is an inclusive (start, end) pair of
+    ISO dates or None. Final rows are passed to sink(key, box, rows) as soon
+    as they arrive. Up to `workers` queries run at once across all keys.
+
+    Without a date range, a box that comes back with exactly `limit` rows may
+    be missing listings, so its rows are discarded and its quadrants are
+    queried instead.
+
+    date_range(key, box) returns the (start, end) dates a box needs, or None
+    for keys that aren't date-bounded. Those boxes are walked through time
+    instead. Rows come back newest first, so when a window hits the cap
+    everything newer than its oldest row is complete and kept, and the rest
+    of the range is queried in a window sized from the density seen so far.
+    Windows that come back sparse grow for the next query. A box whose
+    remaining rows would need more than MAX_WALK_WINDOWS windows is split into
+    quadrants instead, so dense areas are still fetched in parallel.
+
+    A fetch that raises FetchError (after the scheduler's retries) marks its
+    box as failed rather than empty.
+
+    jobs may also hold (key, box, remaining, days) tasks: a box part way
+    through its date range, as handed over by offload(), or a planned box
+    with its first window sized (see zealty_planner). Queries beyond the
+    `workers` that can run wait in a backlog. Whenever the backlog has more
+    than the free workers can start, its newest queries are offered to
+    offload(key, box, remaining, days), which returns True if another
+    process took one, and refill(slots) is asked for up to `slots` more
+    tasks whenever this process has fewer queries than workers. Together
+    they let worker processes share one query plan (see zealty_shard).
+
+    Returns {key: (requests, truncated, leaves, failed)} where truncated
+    lists the (box, window) pairs that still hit the cap but could be neither
+    narrowed nor split, leaves lists (box, window, row count, newest date)
+    for every final query and failed lists (box, window, error) for queries
+    with no usable response, with window covering every date left unfetched.
+    """
+    requests = {}
+    truncated = {}
+    leaves = {}
+    failed = {}
+
+    # Aim windows at this many rows, leaving headroom under the cap
+    target = limit * WINDOW_FILL
+
+    def splittable(box):
+        lat_min, lat_max, lon_min, lon_max = box
+        return lat_max - lat_min >= min_span and lon_max - lon_min >= min_span
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        # Queries waiting for a worker, oldest first
+        backlog = deque()
+
+        def submit(key, box, remaining=None, days=None):
+            """Queue a query for box, covering the newest `days` of the remaining date range"""
+            window = None
+            if remaining:
+                # A quadrant may need less history than the box it came from
+                bound = date_range(key, box)
+                remaining = (max(remaining[0], bound[0]), remaining[1])
+                if remaining[0] > remaining[1]:
+                    return
+                window = newest_window(remaining, days or window_days(remaining))
+            backlog.append((key, box, remaining, days, window))
+
+        def add_tasks(tasks):
+            for key, box, *task in tasks:
+                requests.setdefault(key, 0)
+                for lists in (truncated, leaves, failed):
+                    lists.setdefault(key, [])
+                submit(key, box, *(task or [date_range(key, box) if date_range else None]))
+
+        add_tasks(jobs)
+        while True:
+            # Hand queries this process can't start yet to whoever wants
+            # them, newest first, and take more when there's room
+            if offload is not None:
+                while len(backlog) > workers - len(running) and offload(*backlog[-1][:4]):
+                    backlog.pop()
+            if refill is not None and len(running) + len(backlog) < workers:
+                add_tasks(refill(workers - len(running) - len(backlog)))
+            while backlog and len(running) < workers:
+                key, box, remaining, _, window = backlog.popleft()
+                running[pool.submit(fetch, key, box, window)] = (key, box, window, remaining)
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, box, window, remaining = running.pop(future)
+                requests[key] += 1
+                try:
+                    batch = future.result()
+                except FetchError as e:
+                    print(f"  ERROR: [{key}] box {box} failed: {e}")
+                    failed[key].append((box, remaining, str(e)))
+                    continue
+
+                if window is None:
+                    if len(batch) >= limit:
+                        if splittable(box):
+                            for quadrant in split_box(box):
+                                submit(key, quadrant)
+                            continue
+                        print(f"  WARNING: box {box} still returns {limit} rows and is too small to split")
+                        truncated[key].append((box, None))
+                    sink(key, box, batch)
+                    leaves[key].append((box, None, len(batch), newest_date(batch)))
+                    continue
+
+                start, end = window
+                if len(batch) < limit:
+                    sink(key, box, batch)
+                    leaves[key].append((box, window, len(batch), newest_date(batch)))
+                    if start > remaining[0]:
+                        growth = min(MAX_WINDOW_GROWTH, target / max(len(batch), 1))
+                        days = max(1, int(window_days(window) * growth))
+                        submit(key, box, (remaining[0], day_offset(start, -1)), days)
+                    continue
+
+                # Rows newer than the oldest one in a capped response are complete
+                dates = [row.date.isoformat() for row in batch if row.date]
+                oldest = min(dates + [end])
+                complete = [row for row in batch if row.date and row.date.isoformat() > oldest]
+                if complete:
+                    sink(key, box, complete)
+                    leaves[key].append((box, (day_offset(oldest, 1), end), len(complete), newest_date(complete)))
+                rest = (remaining[0], oldest)
+                per_day = len(batch) / window_days((oldest, end))
+
+                if splittable(box) and (oldest == end or per_day * window_days(rest) > limit * MAX_WALK_WINDOWS):
+                    for quadrant in split_box(box):
+                        submit(key, quadrant, rest, max(1, int(target * 4 / per_day)))
+                    continue
+                if oldest == end:
+                    print(f"  WARNING: box {box} still returns {limit} rows for {end} and is too small to split")
+                    truncated[key].append((box, (end, end)))
+                    sink(key, box, batch)
+                    leaves[key].append((box, (end, end), len(batch), end))
+                    if end == remaining[0]:
+                        continue
+                    rest = (remaining[0], day_offset(end, -1))
+                submit(key, box, rest, max(1, int(target / per_day)))
+
+    return {key: (requests[key], truncated[key], leaves[key], failed[key]) for key in requests}
+
+def write_completeness(results, run_dir, skipped=None):
+    """Write a per-box report of which boxes are complete, truncated, failed or skipped as empty"""
+    report = {}
+    skipped = skipped or {}
+    for key, (requests, truncated, leaves, failed) in results.items():
+        capped = set(truncated)
+        boxes = []
+        for box, window, count, _ in leaves:
+            entry = {"box": list(box), "status": "truncated" if (box, window) in capped else "complete", "rows": count}
+            if window:
+                entry["window"] = list(window)
+            boxes.append(entry)
+        for box, window, error in failed:
+            entry = {"box": list(box), "status": "failed", "error": error}
+            if window:
+                entry["window"] = list(window)
+            boxes.append(entry)
+        boxes.extend({"box": list(box), "status": "skipped"} for box in skipped.get(key, []))
+        report[key] = {
+            "requests": requests,
+            "complete": len(leaves) - len(capped),
+            "truncated": len(capped),
+            "failed": len(failed),
+            "skipped": len(skipped.get(key, [])),
+            "boxes": boxes,
+        }
+    filepath = os.path.join(run_dir, "completeness.json")
+    with open(filepath, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    return filepath
+
+def date_ranges(leads, marks, today_str):
+    """collect_adaptive's date_range for the lead jobs, starting at each box's mark on incremental runs"""
+    def date_range(key, box):
+        """Dates a box needs for sold and expired"""
+        since = leads[key].since
+        if not since:
+            return None
+        newer_than = marks[key].query_since(box) if key in marks else None
+        return (max(since, newer_than or since), today_str)
+    return date_range
+
+def box_fetcher(client, leads, marks, cache=None, metrics=None):
+    """collect_adaptive's fetch for the lead jobs, sending each box's query through client"""
+    def fetch_box(key, box, window):
+        job = leads[key]
+        where = job.where
+        label = f"box {box}"
+        if window:
+            where += f" AND ({job.date_column} BETWEEN '{window[0]}' AND '{window[1]}')"
+            label += f" {window[0]}..{window[1]}"
+        else:
+            newer_than = marks[key].query_since(box) if key in marks else None
+            if newer_than:
+                where += f" AND ({job.date_column} >= '{newer_than}')"
+        sql = build_sql(box, where, f"{job.date_column} DESC")
+        return fetch_rows(client, sql, job.sold_flag, label=label, cache=cache, metrics=metrics, box=box)
+    return fetch_box
+
+def collect_jobs(client, jobs, run_dir, formats=("csv",), workers=DEFAULT_WORKERS, cache=None, metrics=None,
+                 store=None, state=None, lookback_days=DEFAULT_LOOKBACK_DAYS, today=None, shards=None,
+                 planner=None):
+    """Collect every job through one client and write its files under run_dir
+
+    With a ShardPool (zealty_shard), the queries run in its worker processes
+    instead, each with its own session, and client and cache are unused; the
+    rows still come back here to be deduplicated and written once.
+
+    With a QueryPlanner (zealty_planner), jobs start from the boxes it plans
+    from previous runs instead of their whole regions, and its statistics
+    are updated with what this run found.
+
+    With a previous incremental state, only rows newer than its marks are
+    fetched and its snapshot is merged in. Returns (results, summary,
+    new_marks, elapsed): collect_adaptive's results per distinct query set,
+    a (title, listings, requests, truncated, failed) line per job, the marks
+    for the next incremental run and the seconds spent collecting.
+    """
+    today_str = (today or datetime.utcnow().date()).strftime("%Y-%m-%d")
+
+    # Jobs that send exactly the same queries (the same bounds, category,
+    # window and property classes) share them. The first job of each group
+    # names the queries and the rows are handed to every job in the group.
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job.query, []).append(job)
+    shared = {group[0].key: group for group in groups.values()}
+    leads = {key: group[0] for key, group in shared.items()}
+
+    marks = {}
+    if state is not None:
+        marks = {key: Marks(entries, lookback_days) for key, entries in state["marks"].items()}
+
+    # Each job streams into its own file(s) as boxes complete
+    writers = {}
+    for job in jobs:
+        job_dir = os.path.join(run_dir, job.subdir)
+        os.makedirs(job_dir, exist_ok=True)
+        writers[job.key] = ListingWriter(job.name, job_dir, formats)
+
+    def write_rows(key, box, rows):
+        for job in shared[key]:
+            writers[job.key].write_batch(rows)
+        if store:
+            store.upsert(leads[key].sold_flag, rows)
+
+    # Every job starts from its whole region, or the planner's boxes. Boxes
+    # are split into quadrants, and sold/expired date ranges into windows,
+    # only where the 500 row limit is hit. All regions share the session,
+    # scheduler and worker pool.
+    print("\n" + "="*60)
+    regions = len({job.region for job in jobs})
+    parallel = f"{shards.processes} processes x {workers} workers" if shards else f"{workers} workers"
+    print(f"COLLECTING LISTINGS [direct API, {parallel}, "
+          f"{len(jobs)} jobs in {regions} region(s), {len(shared)} distinct]")
+    print("="*60)
+    started = time.time()
+    date_range = date_ranges(leads, marks, today_str)
+    if planner:
+        plan = planner.plan(leads, date_range, ROW_LIMIT * WINDOW_FILL, marks)
+    else:
+        plan = [(key, job.bounds) for key, job in leads.items()]
+    try:
+        with timed(metrics, "collect"):
+            if shards:
+                results = shards.collect(leads, marks, today_str, plan, write_rows)
+            else:
+                results = collect_adaptive(box_fetcher(client, leads, marks, cache, metrics), plan, write_rows,
+                                           workers=workers, date_range=date_range)
+    except BaseException:
+        for writer in writers.values():
+            writer.abort()
+        print(f"Run interrupted, rows collected so far are in the .partial files under {run_dir}")
+        raise
+    elapsed = time.time() - started
+    # A job whose every box was skipped as empty sent no queries
+    for key in leads:
+        results.setdefault(key, (0, [], [], []))
+    if planner:
+        planner.update(leads, results, date_range, marks)
+
+    # Active listings that now show up as sold or expired in the same region
+    # are no longer for sale
+    closed = {}
+    for job in jobs:
+        if job.sold_flag != "active":
+            closed.setdefault(job.region, set()).update(writers[job.key].seen)
+
+    new_marks = {}
+    for key, (_, _, leaves, failed) in results.items():
+        # A box with no rows at all has still been seen up to today
+        newest_by_box = {}
+        for box, _, count, newest in leaves:
+            previous = marks[key].mark_for(box) if key in marks else None
+            if not count and previous is None:
+                newest = today_str
+            newest_by_box[box] = max(filter(None, [newest, previous, newest_by_box.get(box)]), default=None)
+        # Date windows of a box, and the box a quadrant was split from, cover
+        # the same area, so a box is as fresh as the newest of them
+        box_marks = [
+            (box, max((n for b, n in newest_by_box.items() if n and box_contains(b, box)), default=None))
+            for box in newest_by_box
+        ]
+        # Failed boxes have no mark, so the next incremental run refetches them in full
+        box_marks.extend((box, None) for box, _, _ in failed)
+        for job in shared[key]:
+            new_marks[job.key] = box_marks
+
+    summary = []
+    with timed(metrics, "finish"):
+        for job in jobs:
+            requests, truncated, _, failed = results[groups[job.query][0].key]
+            writer = writers[job.key]
+            # Only merge a snapshot of this same job from the previous run
+            if state is not None and job.key in state["marks"]:
+                fetched = writer.count
+                prior_dir = os.path.join(state["run_dir"], state.get("dirs", {}).get(job.key, ""))
+                drop = closed.get(job.region, ()) if job.sold_flag == "active" else ()
+                kept = writer.write_batch(prior_rows(prior_dir, job.name, job.since, drop))
+                print(f"\n{job.title}: {writer.count} listings ({fetched} new or updated, {kept} kept from the previous run, {requests} requests)")
+            else:
+                print(f"\n{job.title}: {writer.count} listings (deduped from {writer.received}, {requests} requests)")
+            summary.append((job.title, writer.count, requests, len(truncated), len(failed)))
+            writer.finish()
+
+    return results, summary, new_marks, elapsed
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape Metro Vancouver listings from Zealty.ca")
+    parser.add_argument("--jobs", metavar="SPEC",
+                        help="TOML job spec listing regions, categories, date windows and property classes "
+                             "(default: all of Metro Vancouver)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"queries in flight at once (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--no-plan", action="store_true",
+                        help="start every job from its whole region instead of the boxes planned from previous "
+                             "runs (the density stats are still updated)")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="worker processes, each with its own session, --workers and --rate (default: 1)")
+    parser.add_argument("--fresh-login", action="store_true",
+                        help="ignore the saved session and log in with the browser")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only fetch rows newer than the previous run and merge them into its snapshot")
+    parser.add_argument("--lookback-days", type=int, default=DEFAULT_LOOKBACK_DAYS,
+                        help=f"with --incremental, re-fetch this many days before each mark (default: {DEFAULT_LOOKBACK_DAYS})")
+    parser.add_argument("--format", nargs="+", default=["csv"], choices=sorted(FORMATS),
+                        help="output formats to write (default: csv)")
+    parser.add_argument("--sqlite", metavar="PATH",
+                        help="also upsert every fetched row into this SQLite database")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always query the API instead of reusing recent responses")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help=f"response cache directory (default: {CACHE_DIR})")
+    parser.add_argument("--record", metavar="PATH",
+                        help="append every API request/response to a JSON lines fixture file (.gz to compress)")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help=f"maximum requests per second, 0 for no limit (default: {DEFAULT_RATE:g})")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help=f"retries per query on 429/5xx/timeouts (default: {DEFAULT_RETRIES})")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics during the run")
+    parser.add_argument("--profile", nargs="?", const="all", choices=["all", "cpu"],
+                        help="time each phase, sample stacks and take tracemalloc snapshots, written to "
+                             "profile.json and profile.stacks (flame graph input) in the run directory; "
+                             "`--profile cpu` skips tracemalloc, which slows decoding several times")
+    args = parser.parse_args(argv)
+
+    error = check_formats(args.format)
+    if error:
+        print(f"ERROR: {error}")
+        exit(1)
+
+    today = datetime.utcnow().date()
+    try:
+        jobs = plan_jobs(load_spec(args.jobs) if args.jobs else DEFAULT_SPEC, today)
+    except (OSError, ValueError, ImportError) as e:
+        print(f"ERROR: can't use job spec {args.jobs}: {e}")
+        exit(1)
+
+    state = None
+    if args.incremental:
+        state = load_state()
+        if state is None:
+            print("No previous run to build on, doing a full scrape")
+        else:
+            print(f"Incremental scrape on top of {state['run_dir']}")
+
     # Create run directory with timestamp
     run_timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     run_dir = os.path.join("data", f"run-{run_timestamp}")
     os.makedirs(run_dir, exist_ok=True)
     print(f"Created run directory: {run_dir}")
-    
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        context = browser.new_context(viewport={'width': 1280, 'height': 720})
-        page = context.new_page()
-
-        print("Navigating to login page...")
-        page.goto("https://www.zealty.ca/sign-in")
-
-        print("Filling credentials...")
-        page.fill("#email", USERNAME)
-        page.fill("#password", PASSWORD)
-        
-        print("Clicking sign in...")
-        page.click("button:has-text('Sign In')")
-        
-        print("Waiting for login to complete...")
-        time.sleep(5)
-
-        print("Extracting session data...")
-        # Just load the map page to establish session
-        page.goto("https://www.zealty.ca/map.html")
-        
-        page.wait_for_load_state("networkidle")
-        time.sleep(2)
-        
-        # Try to compute token by inspecting page JavaScript or just use MD5 of SQL
-        def compute_token(sql_text):
-            # The token might be MD5 hash of SQL + some salt
-            # Let's try MD5 of the SQL itself
-            return hashlib.md5(sql_text.encode()).hexdigest()
-
-        # Common headers for direct POSTs
-        headers = {
-            "accept": "*/*",
-            "accept-language": "en-CA,en-GB;q=0.9,en-US;q=0.8,en;q=0.7",
-            "content-type": "application/x-www-form-urlencoded",
-            "dnt": "1",
-            "origin": "https://www.zealty.ca",
-            "referer": "https://www.zealty.ca/",
-            "sec-fetch-dest": "empty",
-            "sec-fetch-mode": "cors",
-            "sec-fetch-site": "cross-site",
-            "sec-ch-ua": '"Chromium";v="142", "Google Chrome";v="142", "Not_A Brand";v="99"',
-            "sec-ch-ua-mobile": "?0",
-            "sec-ch-ua-platform": '"Linux"',
-            "user-agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/142.0.0.0 Safari/537.36",
-        }
 
-        # Helper to perform the POST
-        def fetch_rows(sql_query, sold_flag):
-            print(f"  Posting query for '{sold_flag}'...")
-            token_s = compute_token(sql_query)
-            resp = context.request.post(
-                "https://bcrealestatemap.ca/svcFetchDB.php",
-                headers=headers,
-                form={
-                    "sql": sql_query,
-                    "sold": sold_flag,
-                    "from": "dmap",
-                    "s": token_s,
-                },
-                timeout=60_000,
-            )
-            print(f"  Response status: {resp.status}")
-            if not resp.ok:
-                print(f"  Request failed: {resp.status} {resp.status_text()}")
-                return []
-            try:
-                data = resp.json()
-            except Exception as e:
-                print(f"  Non-JSON response: {e}")
-                return []
-            rows = data.get("rows") or []
-            print(f"  Received {len(rows)} rows")
-            return rows
-
-        # Compute date ranges
-        today = datetime.utcnow().date()
-        last_12m_start = (today - timedelta(days=365)).strftime("%Y-%m-%d")
-        today_str = today.strftime("%Y-%m-%d")
-        last_30d_start = (today - timedelta(days=30)).strftime("%Y-%m-%d")
-
-        # Metro Vancouver bounds - break into grid to get more than 500 results
-        # Overall bounds: lat 49.0 to 49.5, lon -123.3 to -122.5
-        def generate_grid_boxes(lat_min, lat_max, lon_min, lon_max, divisions=3):
-            """Split area into smaller boxes to bypass 500 row limit"""
-            lat_step = (lat_max - lat_min) / divisions
-            lon_step = (lon_max - lon_min) / divisions
-            boxes = []
-            for i in range(divisions):
-                for j in range(divisions):
-                    box_lat_min = lat_min + (i * lat_step)
-                    box_lat_max = lat_min + ((i + 1) * lat_step)
-                    box_lon_min = lon_min + (j * lon_step)
-                    box_lon_max = lon_min + ((j + 1) * lon_step)
-                    boxes.append((box_lat_min, box_lat_max, box_lon_min, box_lon_max))
-            return boxes
-
-        # Metro Vancouver area grid
-        metro_boxes = generate_grid_boxes(49.0, 49.5, -123.3, -122.5, divisions=3)
-        
-        # Property type filter SQL fragment
-        property_filter = "((propertyClassCode = 0) OR (propertyClassCode = 1 AND type IN('Apartment/Condo','Apartment','Condo Apartment')) OR (propertyClassCode = 1 AND type NOT IN('Apartment/Condo','Apartment','Condo Apartment')) OR (propertyClassCode = 3) OR (propertyClassCode = 4) OR (propertyClassCode = 2))"
-
-        # ===== FOR SALE - TODAY =====
-        print("\n" + "="*60)
-        print("COLLECTING FOR SALE LISTINGS (TODAY) [direct API]")
-        print("="*60)
-        
-        for_sale_listings = []
-        for idx, (lat_min, lat_max, lon_min, lon_max) in enumerate(metro_boxes, 1):
-            print(f"  Fetching grid box {idx}/{len(metro_boxes)}...")
-            sql = f"SELECT * FROM *** WHERE (latitude BETWEEN {lat_min} AND {lat_max}) AND (longitude BETWEEN {lon_min} AND {lon_max}) AND {property_filter} ORDER BY GREATEST(listingDate, listingPricePrevDate) DESC LIMIT 500"
-            rows = fetch_rows(sql, "active")
-            for_sale_listings.extend(rows)
-        
-        # Deduplicate by MLS_Number (first column)
-        seen = set()
-        unique_for_sale = []
-        for row in for_sale_listings:
-            mls = row[0] if row else None
-            if mls and mls not in seen:
-                seen.add(mls)
-                unique_for_sale.append(row)
-        
-        print(f"Total For Sale listings captured: {len(unique_for_sale)} (deduped from {len(for_sale_listings)})")
-        save_to_csv(unique_for_sale, "for_sale_today.csv", run_dir)
-
-        # ===== SOLDS - LAST 12 MONTHS =====
-        print("\n" + "="*60)
-        print("COLLECTING SOLD LISTINGS (LAST 12 MONTHS) [direct API]")
-        print("="*60)
-        
-        solds_listings = []
-        for idx, (lat_min, lat_max, lon_min, lon_max) in enumerate(metro_boxes, 1):
-            print(f"  Fetching grid box {idx}/{len(metro_boxes)}...")
-            sql = f"SELECT * FROM *** WHERE (latitude BETWEEN {lat_min} AND {lat_max}) AND (longitude BETWEEN {lon_min} AND {lon_max}) AND {property_filter} AND (entryDate BETWEEN '{last_12m_start}' AND '{today_str}') ORDER BY entryDate DESC LIMIT 500"
-            rows = fetch_rows(sql, "sold")
-            solds_listings.extend(rows)
-        
-        seen = set()
-        unique_solds = []
-        for row in solds_listings:
-            mls = row[0] if row else None
-            if mls and mls not in seen:
-                seen.add(mls)
-                unique_solds.append(row)
-        
-        print(f"Total Sold listings captured: {len(unique_solds)} (deduped from {len(solds_listings)})")
-        save_to_csv(unique_solds, "solds_last_12_months.csv", run_dir)
-
-        # ===== EXPIRED - LAST 30 DAYS =====
-        print("\n" + "="*60)
-        print("COLLECTING EXPIRED LISTINGS (LAST 30 DAYS) [direct API]")
-        print("="*60)
-        
-        expired_listings = []
-        for idx, (lat_min, lat_max, lon_min, lon_max) in enumerate(metro_boxes, 1):
-            print(f"  Fetching grid box {idx}/{len(metro_boxes)}...")
-            sql = f"SELECT * FROM *** WHERE (latitude BETWEEN {lat_min} AND {lat_max}) AND (longitude BETWEEN {lon_min} AND {lon_max}) AND {property_filter} AND (entryDate BETWEEN '{last_30d_start}' AND '{today_str}') ORDER BY entryDate DESC LIMIT 500"
-            rows = fetch_rows(sql, "expired")
-            expired_listings.extend(rows)
-        
-        seen = set()
-        unique_expired = []
-        for row in expired_listings:
-            mls = row[0] if row else None
-            if mls and mls not in seen:
-                seen.add(mls)
-                unique_expired.append(row)
-        
-        print(f"Total Expired listings captured: {len(unique_expired)} (deduped from {len(expired_listings)})")
-        save_to_csv(unique_expired, "expired_last_30_days.csv", run_dir)
-        
-        browser.close()
-    
+    metrics = Metrics(run_dir, ROW_LIMIT)
+    metrics_server = serve_metrics(metrics, args.metrics_port) if args.metrics_port else None
+    profiler = Profiler(memory=args.profile == "all").start() if args.profile else None
+
+    client = shards = scheduler = cache = None
+    try:
+        with metrics.phase("session"):
+            if args.shards > 1:
+                from zealty_shard import ShardPool
+
+                shards = ShardPool(args.shards, args.workers, args.rate, args.retries, fresh=args.fresh_login,
+                                   cache_dir=None if args.no_cache else args.cache_dir, record=args.record,
+                                   metrics=metrics, profile=args.profile and (run_dir, args.profile == "all"))
+                shards.start()
+            else:
+                client = open_client(fresh=args.fresh_login, metrics=metrics, retries=args.retries)
+    except (MissingCredentials, ProbeFailed) as e:
+        if profiler:
+            profiler.stop()
+        metrics.close()
+        if metrics_server:
+            metrics_server.shutdown()
+        shutil.rmtree(run_dir, ignore_errors=True)
+        print(f"ERROR: {e}")
+        exit(1)
+    if client is not None:
+        if args.record:
+            client = FixtureRecorder(client, args.record)
+        scheduler = client = RequestScheduler(client, args.workers, args.rate, args.retries)
+        cache = None if args.no_cache else ResponseCache(args.cache_dir)
+
+    store = ListingStore(args.sqlite, datetime.now().isoformat(timespec="seconds")) if args.sqlite else None
+    planner = QueryPlanner(enabled=not args.no_plan)
+    try:
+        results, summary, new_marks, elapsed = collect_jobs(
+            client, jobs, run_dir, args.format, args.workers, cache=cache, metrics=metrics,
+            store=store, state=state, lookback_days=args.lookback_days, today=today, shards=shards,
+            planner=planner)
+    except BaseException:
+        metrics.close()
+        if metrics_server:
+            metrics_server.shutdown()
+        if profiler:
+            # A slow run that was interrupted is what --profile is for
+            profiler.stop()
+            print(f"Profile of the interrupted run: {', '.join(profiler.save(run_dir))}")
+        raise
+    finally:
+        (shards or client).close()
+        if store:
+            store.close()
+    total_requests = sum(requests for requests, _, _, _ in results.values())
+
+    # collect_jobs timed writing the files as "finish"; this is the run's own state
+    with metrics.phase("save"):
+        save_state(run_dir, new_marks, {job.key: job.subdir for job in jobs})
+        planner.save()
+        report = write_completeness(results, run_dir, planner.skipped)
+    metrics.close()
+    if metrics_server:
+        metrics_server.shutdown()
+    if profiler:
+        profiler.stop()
+        profile = profiler.save(run_dir)
+
     print("\n" + "="*60)
     print("SUMMARY")
     print("="*60)
-    print(f"For Sale (Today): {len(unique_for_sale) if 'unique_for_sale' in locals() else 0} listings")
-    print(f"Solds (Last 12 Months): {len(unique_solds) if 'unique_solds' in locals() else 0} listings")
-    print(f"Expired (Last 30 Days): {len(unique_expired) if 'unique_expired' in locals() else 0} listings")
+    incomplete = False
+    for title, count, requests, truncated, failed in summary:
+        line = f"{title}: {count} listings ({requests} requests)"
+        if truncated:
+            line += f" - WARNING: {truncated} boxes still at the {ROW_LIMIT} row cap"
+        if failed:
+            line += f" - INCOMPLETE: {failed} boxes failed"
+            incomplete = True
+        print(line)
+    print(f"Total requests: {total_requests} in {elapsed:.1f}s")
+    print(planner.summary(results))
+    if unparsed_summary():
+        print(unparsed_summary())
+    print(shards.summary() if shards else scheduler.summary())
+    print(metrics.summary())
+    if cache:
+        print(cache.summary())
+    print(f"Per-box completeness report: {report}")
+    if profiler:
+        print("\nPROFILE")
+        print(profiler.summary())
+        print(f"Profile: {profile[0]}, flame graph stacks: {profile[1]}")
+    if incomplete:
+        return 1
 
 if __name__ == "__main__":
-    run()
+    sys.exit(run())
@@ -0,0 +1,258 @@
+"""Zealty.ca login and session reuse
+
+Logging in needs a real browser, but the resulting cookies stay valid for a
+while. They are saved as a Playwright storage state file and loaded straight
+into an ApiClient on the next run; Chromium only starts again once a probe
+query shows the session has expired. Throttling, server errors and dropped
+connections are retried and then raised as ProbeFailed, never taken for an
+expired session.
+
+Playwright and the credentials are only needed at that point, so both are
+loaded inside login(): importing this module (or the scraper) needs neither.
+
+Each browser step ends on an explicit readiness signal instead of a fixed
+sleep: signing in ends when the page leaves sign-in or a new HttpOnly cookie
+appears, and the map page when its first svcFetchDB.php response arrives.
+ZEALTY_LOGIN_TIMEOUT and ZEALTY_MAP_TIMEOUT bound how long each step waits.
+"""
+import json
+import os
+import time
+
+from zealty_fetch import ApiClient, compute_token
+from zealty_metrics import timed
+from zealty_scheduler import DEFAULT_RETRIES, RequestScheduler
+
+SESSION_FILE = os.getenv("ZEALTY_SESSION_FILE", ".zealty_session.json")
+
+SIGN_IN_URL = "https://www.zealty.ca/sign-in"
+MAP_URL = "https://www.zealty.ca/map.html"
+
+# Upper bounds in seconds on each login step; a step usually ends much sooner
+LOGIN_TIMEOUT = float(os.getenv("ZEALTY_LOGIN_TIMEOUT", "20"))
+MAP_TIMEOUT = float(os.getenv("ZEALTY_MAP_TIMEOUT", "30"))
+
+# Cookies have no Playwright event, so signals are checked this often (ms)
+SIGNAL_POLL_MS = 50
+
+# Tiny query used to check whether the saved cookies are still accepted
+PROBE_SQL = "SELECT * FROM *** WHERE (latitude BETWEEN 49.28 AND 49.281) AND (longitude BETWEEN -123.121 AND -123.12) ORDER BY entryDate DESC LIMIT 1"
+
+# Statuses that mean the API refused the session
+AUTH_STATUSES = {401, 403}
+
+MISSING_CREDENTIALS = """Missing credentials!
+Please create a .env file with:
+  ZEALTY_USERNAME=your.email@example.com
+  ZEALTY_PASSWORD=your_password_here
+
+You can copy .env.example to .env and fill in your credentials."""
+
+class MissingCredentials(Exception):
+    """Logging in needs ZEALTY_USERNAME and ZEALTY_PASSWORD"""
+
+class ProbeFailed(Exception):
+    """The session probe got no answer that says whether the session is accepted"""
+
+def credentials(account=None):
+    """ZEALTY_USERNAME and ZEALTY_PASSWORD from the environment or .env
+
+    With an account number, ZEALTY_USERNAME_<n> and ZEALTY_PASSWORD_<n> are
+    used instead when both are set.
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    if account:
+        username, password = os.getenv(f"ZEALTY_USERNAME_{account}"), os.getenv(f"ZEALTY_PASSWORD_{account}")
+        if username and password:
+            return username, password
+    return os.getenv("ZEALTY_USERNAME"), os.getenv("ZEALTY_PASSWORD")
+
+def wait_for_signal(page, signals, timeout):
+    """Wait for the first of signals (name -> check) to be true
+
+    Returns (name, seconds waited), with None as the name on timeout. Waiting
+    goes through the page, so its event handlers keep running meanwhile.
+    """
+    started = time.perf_counter()
+    while True:
+        for name, check in signals.items():
+            if check():
+                return name, time.perf_counter() - started
+        if time.perf_counter() - started >= timeout:
+            return None, time.perf_counter() - started
+        page.wait_for_timeout(SIGNAL_POLL_MS)
+
+def api_responses(page):
+    """A list that collects the status of every svcFetchDB.php response the page gets"""
+    statuses = []
+    page.on("response", lambda response: statuses.append(response.status) if "svcFetchDB.php" in response.url else None)
+    return statuses
+
+def _session_cookies(page):
+    return {c["name"] for c in page.context.cookies() if c.get("httpOnly")}
+
+def sign_in(page, username, password, timeout=LOGIN_TIMEOUT):
+    """Submit the sign-in form and wait until the site has accepted it
+
+    Returns the signal that ended the wait, or None if none came within
+    timeout seconds.
+    """
+    print("Navigating to login page...")
+    page.goto(SIGN_IN_URL, wait_until="domcontentloaded")
+    print("Filling credentials...")
+    page.fill("#email", username)
+    page.fill("#password", password)
+    before = _session_cookies(page)
+    print("Clicking sign in...")
+    page.click("button:has-text('Sign In')")
+    # Analytics cookies are readable by scripts, a session cookie shouldn't be
+    signal, waited = wait_for_signal(page, {
+        "redirected to map.html": lambda: "map.html" in page.url,
+        "left the sign-in page": lambda: "sign-in" not in page.url,
+        "session cookie set": lambda: bool(_session_cookies(page) - before),
+    }, timeout)
+    if signal:
+        print(f"Signed in after {waited:.2f}s ({signal})")
+    else:
+        print(f"WARNING: no sign of a completed login after {timeout:g}s, still on {page.url}")
+    return signal
+
+def open_map(page, responses, timeout=MAP_TIMEOUT):
+    """Load map.html unless the page is already there and wait for its first data response
+
+    responses is the list from api_responses(), attached before signing in
+    so a response to the post-login redirect isn't missed.
+    """
+    started = time.perf_counter()
+    if "map.html" not in page.url:
+        print("Navigating to map...")
+        page.goto(MAP_URL, wait_until="domcontentloaded")
+    signal, _ = wait_for_signal(page, {"first svcFetchDB.php response": lambda: bool(responses)}, timeout)
+    waited = time.perf_counter() - started
+    if signal:
+        print(f"Map ready after {waited:.2f}s ({signal}, HTTP {responses[0]})")
+    else:
+        print(f"WARNING: the map made no svcFetchDB.php request within {timeout:g}s")
+    return signal
+
+def login(username=None, password=None, session_file=SESSION_FILE, metrics=None,
+          login_timeout=LOGIN_TIMEOUT, map_timeout=MAP_TIMEOUT, account=None):
+    """Log in with Chromium, save the storage state and return its cookies
+
+    Without a username and password they come from credentials(account), and
+    MissingCredentials is raised if they aren't set.
+    """
+    if not username or not password:
+        username, password = credentials(account)
+    if not username or not password:
+        raise MissingCredentials(MISSING_CREDENTIALS)
+    with timed(metrics, "playwright_import"):
+        from playwright.sync_api import sync_playwright
+
+    with sync_playwright() as p:
+        with timed(metrics, "browser_launch"):
+            browser = p.chromium.launch(headless=True)
+            context = browser.new_context(viewport={'width': 1280, 'height': 720})
+            page = context.new_page()
+            responses = api_responses(page)
+
+        with timed(metrics, "login"):
+            sign_in(page, username, password, login_timeout)
+
+        with timed(metrics, "map_page"):
+            # Loading the map establishes the session the API accepts
+            open_map(page, responses, map_timeout)
+
+        state = context.storage_state()
+        browser.close()
+
+    save_state(state, session_file)
+    return state["cookies"]
+
+def save_state(state, session_file=SESSION_FILE):
+    """Write a storage state file readable only by the current user"""
+    tmp_path = session_file + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, session_file)
+    print(f"Saved session to {session_file}")
+
+def load_cookies(session_file=SESSION_FILE):
+    """Return the unexpired cookies from a saved storage state, or None"""
+    try:
+        with open(session_file, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    now = time.time()
+    # Playwright uses -1 for session cookies
+    cookies = [c for c in state.get("cookies", []) if c.get("expires", -1) < 0 or c["expires"] > now]
+    return cookies or None
+
+def probe(client, retries=DEFAULT_RETRIES):
+    """Check that the API accepts the client's session with one tiny query
+
+    Returns False only when the API refuses the session: a 401 or 403, or an
+    API error for the probe query, which is always valid. Anything else that
+    fails, after the retries of a RequestScheduler, raises ProbeFailed.
+    """
+    if not isinstance(client, RequestScheduler):
+        client = RequestScheduler(client, 1, rate=0, retries=retries)
+    try:
+        resp = client.post({
+            "sql": PROBE_SQL,
+            "sold": "active",
+            "from": "dmap",
+            "s": compute_token(PROBE_SQL),
+        })
+    except Exception as e:
+        raise ProbeFailed(f"session probe failed: {e}") from e
+    if resp.status in AUTH_STATUSES:
+        return False
+    if not resp.ok:
+        raise ProbeFailed(f"session probe failed: {resp.status} {resp.status_text()}")
+    try:
+        data = resp.json()
+    except Exception as e:
+        raise ProbeFailed(f"session probe got a non-JSON response: {e}") from e
+    if not isinstance(data, dict):
+        raise ProbeFailed(f"session probe got a JSON {type(data).__name__} instead of an object")
+    error = data.get("error")
+    code = error.get("code") if isinstance(error, dict) else error
+    return "rows" in data and not code
+
+def open_client(username=None, password=None, session_file=SESSION_FILE, fresh=False, metrics=None, account=None,
+                retries=DEFAULT_RETRIES):
+    """Return an ApiClient with a working session, logging in only if needed
+
+    Raises ProbeFailed if the saved session can't be checked.
+    """
+    client = ApiClient()
+    if not fresh:
+        cookies = load_cookies(session_file)
+        if cookies:
+            client.set_cookies(cookies)
+        with timed(metrics, "session_probe"):
+            accepted = probe(client, retries)
+        if accepted:
+            if cookies:
+                print(f"Reusing saved session from {session_file}")
+            else:
+                print("API accepts requests without a session, skipping login")
+            return client
+        if cookies:
+            print("Saved session has expired")
+
+    client.set_cookies(login(username, password, session_file, metrics, account=account))
+    try:
+        with timed(metrics, "session_probe"):
+            accepted = probe(client, retries)
+    except ProbeFailed as e:
+        print(f"WARNING: {e}")
+    else:
+        if not accepted:
+            print("WARNING: session probe still fails after logging in")
+    return client
@@ -0,0 +1,289 @@
+"""Sharding a run across worker processes
+
+One session and one process cap how fast a single client can go: every query
+shares its rate limit, and decoding responses shares one interpreter. A
+ShardPool starts N worker processes instead. Each opens its own client with
+its own session (and its own account, if ZEALTY_USERNAME_<n> and
+ZEALTY_PASSWORD_<n> are set) and runs collect_adaptive with its own request
+scheduler and `workers` threads.
+
+The query plan (one whole-region box per distinct job) goes onto a queue
+shared by the workers. Splitting a capped box or walking a date range makes
+more queries, and whenever a worker is idle, a busy one hands it the
+queries it can't start yet, so the load evens out even when a few dense
+regions make most of the queries. Rows, request metrics and
+per-box results come back to the parent, which deduplicates and writes them
+exactly as a single-process run does.
+
+    uv run zealty_scraper_multi.py --shards 4 --workers 4
+"""
+import multiprocessing
+import os
+import queue
+import traceback
+
+from zealty_cache import ResponseCache
+from zealty_fetch import FixtureRecorder
+from zealty_listing import unparsed_summary
+from zealty_metrics import Metrics
+from zealty_profile import Profiler, phase
+from zealty_scheduler import DEFAULT_RATE, DEFAULT_RETRIES, RequestScheduler
+from zealty_scraper_multi import DEFAULT_WORKERS, box_fetcher, collect_adaptive, date_ranges
+from zealty_session import SESSION_FILE, MissingCredentials, ProbeFailed, open_client
+
+# Seconds between checks that every worker is still alive while waiting on them
+POLL_SECONDS = 1.0
+
+def shard_path(path, index):
+    """path for shard 0, and path with `.<index>` before its extension for the others"""
+    if not index:
+        return path
+    root, ext = os.path.splitext(path)
+    if ext == ".gz":
+        root, inner = os.path.splitext(root)
+        ext = inner + ext
+    return f"{root}.{index}{ext}"
+
+class _MetricsProxy:
+    """Forwards a worker's request and phase timings to the parent's Metrics"""
+
+    def __init__(self, outbox):
+        self.outbox = outbox
+
+    def record_request(self, *args, **kwargs):
+        self.outbox.put(("request", args, kwargs))
+
+    def record_phase(self, name, seconds):
+        self.outbox.put(("phase", name, seconds))
+
+    phase = Metrics.phase
+
+def _collect(index, fetch, date_range, workers, outbox, tasks, counters):
+    """Run tasks from the shared queue until the parent's plan is finished"""
+    queued, idle, pending = counters
+
+    def take(block):
+        if block:
+            with idle.get_lock():
+                idle.value += 1
+        try:
+            task = tasks.get(block)
+        finally:
+            if block:
+                with idle.get_lock():
+                    idle.value -= 1
+        if task is not None:
+            with queued.get_lock():
+                queued.value -= 1
+        return task
+
+    def refill(slots):
+        more = []
+        try:
+            while len(more) < slots:
+                more.append(take(False))
+        except queue.Empty:
+            pass
+        taken[0] += len(more)
+        return more
+
+    def offload(key, box, remaining, days):
+        # Only hand over as many queries as there are workers waiting for one
+        with queued.get_lock():
+            if queued.value >= idle.value:
+                return False
+            queued.value += 1
+        with pending.get_lock():
+            pending.value += 1
+        tasks.put((key, box, remaining, days))
+        return True
+
+    def sink(key, box, rows):
+        outbox.put(("rows", key, box, rows))
+
+    while True:
+        task = take(True)
+        if task is None:
+            return
+        taken = [1]
+        results = collect_adaptive(fetch, [task], sink, workers=workers, date_range=date_range,
+                                   offload=offload, refill=refill)
+        outbox.put(("results", index, results))
+        # Queries handed over were counted before this, so the plan can only
+        # run out once no worker holds any of it
+        with pending.get_lock():
+            pending.value -= taken[0]
+            finished = pending.value == 0
+        if finished:
+            for _ in range(counters.processes):
+                tasks.put(None)
+
+def _worker(index, options, inbox, outbox, tasks, counters):
+    """Worker process: open a session, then collect each plan the parent sends"""
+    client = None
+    profiler = Profiler(memory=options["profile"][1]).start() if options["profile"] else None
+    try:
+        metrics = _MetricsProxy(outbox)
+        try:
+            client = open_client(session_file=shard_path(options["session_file"], index), fresh=options["fresh"],
+                                 metrics=metrics, account=index or None, retries=options["retries"])
+        except (MissingCredentials, ProbeFailed) as e:
+            outbox.put(("no_session", index, e))
+            return
+        if options["record"]:
+            client = FixtureRecorder(client, shard_path(options["record"], index))
+        client = scheduler = RequestScheduler(client, options["workers"], options["rate"], options["retries"])
+        cache = ResponseCache(options["cache_dir"]) if options["cache_dir"] else None
+        outbox.put(("ready", index))
+
+        while True:
+            plan = inbox.get()
+            if plan is None:
+                break
+            leads, marks, today_str = plan
+            with phase("collect"):
+                _collect(index, box_fetcher(client, leads, marks, cache, metrics),
+                         date_ranges(leads, marks, today_str), options["workers"], outbox, tasks, counters)
+            summaries = [scheduler.summary()] + ([cache.summary()] if cache else [])
+            # Rows are decoded here, so values left blank are only counted here
+            if unparsed_summary():
+                summaries.append(unparsed_summary())
+            outbox.put(("done", index, summaries))
+    except BaseException:
+        outbox.put(("error", index, traceback.format_exc()))
+    finally:
+        if client is not None:
+            client.close()
+        if profiler:
+            profiler.stop()
+            profiler.save(options["profile"][0], f".shard{index}")
+
+class _Counters:
+    """Shared counts the workers balance the queue with"""
+
+    def __init__(self, context, processes):
+        self.processes = processes
+        self.queued = context.Value("i", 0)  # tasks on the queue
+        self.idle = context.Value("i", 0)  # workers waiting for a task
+        self.pending = context.Value("i", 0)  # tasks queued or being collected
+
+    def __iter__(self):
+        return iter((self.queued, self.idle, self.pending))
+
+class ShardPool:
+    """Worker processes that each collect part of a run through their own session
+
+    --rate and --workers apply to each worker, so N shards send up to N
+    times as many requests per second as one process. With profile set to
+    (run directory, trace memory), each worker profiles itself into
+    profile.shard<n>.json and profile.shard<n>.stacks there.
+    """
+
+    def __init__(self, processes, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, retries=DEFAULT_RETRIES,
+                 session_file=SESSION_FILE, fresh=False, cache_dir=None, record=None, metrics=None, profile=None):
+        self.processes = processes
+        self.metrics = metrics
+        self.options = {"workers": workers, "rate": rate, "retries": retries, "session_file": session_file,
+                        "fresh": fresh, "cache_dir": cache_dir, "record": record, "profile": profile}
+        # Spawned workers don't inherit the parent's threads or open files
+        self._context = multiprocessing.get_context("spawn")
+        self._outbox = self._context.Queue()
+        self._tasks = self._context.Queue()
+        self._counters = _Counters(self._context, processes)
+        self._inboxes = []
+        self._workers = []
+        self._summaries = {}
+
+    def start(self):
+        """Start every worker and wait until each has a working session"""
+        for index in range(self.processes):
+            inbox = self._context.Queue()
+            worker = self._context.Process(target=_worker, name=f"zealty-shard-{index}", daemon=True,
+                                           args=(index, self.options, inbox, self._outbox, self._tasks,
+                                                 self._counters))
+            worker.start()
+            self._inboxes.append(inbox)
+            self._workers.append(worker)
+        try:
+            ready = 0
+            while ready < self.processes:
+                if self._receive()[0] == "ready":
+                    ready += 1
+        except BaseException:
+            self.close(terminate=True)
+            raise
+        print(f"Started {self.processes} shards")
+
+    def _receive(self, sink=None, results=None):
+        """Handle the next message from a worker and return it"""
+        while True:
+            try:
+                message = self._outbox.get(timeout=POLL_SECONDS)
+                break
+            except queue.Empty:
+                for worker in self._workers:
+                    if worker.exitcode is not None:
+                        raise RuntimeError(f"{worker.name} exited with code {worker.exitcode}")
+        kind = message[0]
+        if kind == "rows":
+            sink(*message[1:])
+        elif kind == "request":
+            if self.metrics is not None:
+                self.metrics.record_request(*message[1], **message[2])
+        elif kind == "phase":
+            if self.metrics is not None:
+                self.metrics.record_phase(*message[1:])
+        elif kind == "results":
+            for key, (requests, truncated, leaves, failed) in message[2].items():
+                total = results.setdefault(key, (0, [], [], []))
+                results[key] = (total[0] + requests, total[1] + truncated, total[2] + leaves, total[3] + failed)
+        elif kind == "no_session":
+            raise message[2]
+        elif kind == "error":
+            raise RuntimeError(f"shard {message[1]} failed:\n{message[2]}")
+        return message
+
+    def collect(self, leads, marks, today_str, jobs, sink):
+        """collect_adaptive across the workers; rows are passed to sink(key, box, rows) in this process"""
+        for inbox in self._inboxes:
+            inbox.put((leads, marks, today_str))
+        queued, _, pending = self._counters
+        with pending.get_lock():
+            pending.value += len(jobs)
+        with queued.get_lock():
+            queued.value += len(jobs)
+        for task in jobs:
+            self._tasks.put(tuple(task))
+        if not jobs:
+            for _ in range(self.processes):
+                self._tasks.put(None)
+
+        results = {task[0]: (0, [], [], []) for task in jobs}
+        done = 0
+        try:
+            while done < self.processes:
+                message = self._receive(sink, results)
+                if message[0] == "done":
+                    self._summaries[message[1]] = message[2]
+                    done += 1
+        except BaseException:
+            # The other workers' part of the plan is lost with the failed one
+            self.close(terminate=True)
+            raise
+        return results
+
+    def close(self, terminate=False):
+        """Stop the workers, closing their sessions, or kill them straight away with terminate"""
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for worker in self._workers:
+            if terminate:
+                worker.terminate()
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+
+    def summary(self):
+        return "\n".join(f"Shard {index}: {line}" for index in sorted(self._summaries)
+                         for line in self._summaries[index])
@@ -0,0 +1,412 @@
+"""Market statistics over scraped runs
+
+Loads the for-sale, sold and expired files of every run into NumPy columns
+and computes grouped medians, percentiles, price per square foot,
+list-to-sale ratios and rolling monthly trends without looping over rows in
+Python.
+
+Runs are merged into one table per category: solds and expireds keep the
+newest run's version of each MLS number, the active listings are those of
+the newest run, and every MLS number ever seen for sale keeps its last
+asking price, which a sold listing's list-to-sale ratio is measured against.
+The merged tables are cached in .zealty_stats_cache/, so after the first
+build a new run only parses its own files and a year of daily runs
+aggregates in well under a second.
+
+    uv run --with numpy zealty_stats.py summary --by neighborhood
+    uv run --with numpy zealty_stats.py trend --by property_type --months 24 --rolling 3
+    uv run --with numpy zealty_stats.py summary --runs data/run-2026-* --csv > summary.csv
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from zealty_output import CATEGORY_FILES, RUNS_GLOB
+
+CACHE_DIR = ".zealty_stats_cache"
+
+# CSV column of each string column that is grouped on
+GROUP_COLUMNS = {"neighborhood": "Neighborhood", "property_type": "Property_Type"}
+
+MERGED = ("sold", "expired", "asks")
+
+def _floats(values):
+    try:
+        return np.array([v or "nan" for v in values], dtype=np.float64)
+    except ValueError:
+        out = np.full(len(values), np.nan)
+        for i, v in enumerate(values):
+            try:
+                out[i] = float(v)
+            except ValueError:
+                pass
+        return out
+
+def _dates(values):
+    try:
+        return np.array([v[:10] or "NaT" for v in values], dtype="datetime64[D]")
+    except ValueError:
+        out = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[D]")
+        for i, v in enumerate(values):
+            try:
+                out[i] = np.datetime64(v[:10], "D")
+            except ValueError:
+                pass
+        return out
+
+class Table:
+    """Equal-length NumPy columns, with grouped string columns stored as codes into labels"""
+
+    def __init__(self, columns, labels):
+        self.columns = columns
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.columns["key"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @classmethod
+    def empty(cls):
+        columns = {
+            "key": np.array([], dtype="U1"),
+            "run": np.array([], dtype=np.int64),
+            "price": np.array([], dtype=np.float64),
+            "sqft": np.array([], dtype=np.float64),
+            "date": np.array([], dtype="datetime64[D]"),
+        }
+        columns.update({name: np.array([], dtype=np.int32) for name in GROUP_COLUMNS})
+        return cls(columns, {name: np.array([], dtype="U1") for name in GROUP_COLUMNS})
+
+    @classmethod
+    def from_csv(cls, path, run):
+        """Read one of the scraper's CSV files, stamping every row with the run time"""
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            rows = [row for row in reader if row and row[0]]
+        if not rows:
+            return cls.empty()
+        width = len(header)
+        if any(len(row) != width for row in rows):
+            rows = [(row + [""] * width)[:width] for row in rows]
+        raw = dict(zip(header, zip(*rows)))
+        sqft = _floats(raw["Unknown3"])
+        sqft[sqft <= 0] = np.nan
+        columns = {
+            "key": np.array(raw["MLS_Number"]),
+            "run": np.full(len(rows), run, dtype=np.int64),
+            "price": _floats(raw["Price"]),
+            "sqft": sqft,
+            "date": _dates(raw["Date"]),
+        }
+        labels = {}
+        for name, column in GROUP_COLUMNS.items():
+            labels[name], codes = np.unique(np.array(raw[column]), return_inverse=True)
+            columns[name] = codes.astype(np.int32).ravel()
+        return cls(columns, labels)
+
+    def take(self, index):
+        return Table({name: values[index] for name, values in self.columns.items()}, self.labels)
+
+    @classmethod
+    def concat(cls, tables):
+        """Stack tables, re-coding their grouped columns against the union of their labels"""
+        tables = [t for t in tables if len(t)] or [cls.empty()]
+        columns = {name: np.concatenate([t.columns[name] for t in tables]) for name in tables[0].columns
+                   if name not in GROUP_COLUMNS}
+        labels = {}
+        for name in GROUP_COLUMNS:
+            labels[name] = np.unique(np.concatenate([t.labels[name] for t in tables]))
+            columns[name] = np.concatenate([
+                np.searchsorted(labels[name], t.labels[name]).astype(np.int32)[t.columns[name]]
+                if len(t.labels[name]) else t.columns[name]
+                for t in tables
+            ])
+        return cls(columns, labels)
+
+    def newest_per_key(self):
+        """Keep the row from the newest run for each MLS number, sorted by MLS number"""
+        order = np.lexsort((-self["run"], self["key"]))
+        keys = self["key"][order]
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        return self.take(order[first])
+
+    def to_arrays(self, prefix):
+        arrays = {f"{prefix}__{name}": values for name, values in self.columns.items()}
+        arrays.update({f"{prefix}__{name}__labels": values for name, values in self.labels.items()})
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        columns, labels = {}, {}
+        for name in arrays.files:
+            if not name.startswith(prefix + "__"):
+                continue
+            field = name[len(prefix) + 2:]
+            if field.endswith("__labels"):
+                labels[field[:-len("__labels")]] = arrays[name]
+            else:
+                columns[field] = arrays[name]
+        return cls(columns, labels)
+
+def run_time(run_dir):
+    """When a run was taken, from its run-YYYY-MM-DD_HH-MM-SS name or else its mtime, in epoch seconds"""
+    name = os.path.basename(os.path.normpath(run_dir))
+    try:
+        return int(datetime.strptime(name, "run-%Y-%m-%d_%H-%M-%S").timestamp())
+    except ValueError:
+        return int(os.path.getmtime(run_dir))
+
+def run_files(run_dir):
+    """(category, path) of every CSV in a run, including region subdirectories"""
+    found = []
+    for path in sorted(glob.glob(os.path.join(run_dir, "*.csv")) + glob.glob(os.path.join(run_dir, "*", "*.csv"))):
+        name = os.path.basename(path)
+        for category, prefix in CATEGORY_FILES.items():
+            if name.startswith(prefix):
+                found.append((category, path))
+    return found
+
+def signature(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+class Market:
+    """Every run's listings merged into one table per category"""
+
+    def __init__(self):
+        self.tables = {name: Table.empty() for name in MERGED}
+        self.active = Table.empty()
+        self.newest = 0
+        self.files = {}
+
+    def add_run(self, run_dir):
+        """Merge one run's files into the tables"""
+        run = run_time(run_dir)
+        parsed = {"active": [], "sold": [], "expired": []}
+        for category, path in run_files(run_dir):
+            parsed[category].append(Table.from_csv(path, run))
+            self.files[os.path.abspath(path)] = signature(path)
+        if not any(parsed.values()):
+            return
+        active = Table.concat(parsed["active"])
+        for name, new in (("sold", parsed["sold"]), ("expired", parsed["expired"]), ("asks", [active])):
+            self.tables[name] = Table.concat([self.tables[name]] + new).newest_per_key()
+        if run >= self.newest:
+            self.newest = run
+            self.active = active
+
+    def save(self, path):
+        arrays = {"newest": np.array(self.newest)}
+        arrays.update(self.active.to_arrays("active"))
+        for name, table in self.tables.items():
+            arrays.update(table.to_arrays(name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path + ".tmp.npz", **arrays)
+        os.replace(path + ".tmp.npz", path + ".npz")
+        with open(path + ".json", "w", encoding="utf-8") as f:
+            json.dump(self.files, f)
+
+    @classmethod
+    def load(cls, path):
+        """The cached tables, or None if there is no usable cache"""
+        try:
+            with open(path + ".json", encoding="utf-8") as f:
+                files = json.load(f)
+            arrays = np.load(path + ".npz")
+        except (OSError, ValueError):
+            return None
+        market = cls()
+        market.files = files
+        market.newest = int(arrays["newest"])
+        market.active = Table.from_arrays(arrays, "active")
+        market.tables = {name: Table.from_arrays(arrays, name) for name in MERGED}
+        return market
+
+def load_market(run_dirs, cache_dir=CACHE_DIR):
+    """Merge the given runs, reusing the cached tables when they cover a subset of them"""
+    path = os.path.join(cache_dir, "market") if cache_dir else None
+    wanted = {os.path.abspath(p): signature(p) for run_dir in run_dirs for _, p in run_files(run_dir)}
+    market = Market.load(path) if path else None
+    if market is None or any(wanted.get(p) != sig for p, sig in market.files.items()):
+        # Runs were removed or rewritten since the cache was built
+        market = Market()
+    new_runs = [run_dir for run_dir in run_dirs
+                if any(os.path.abspath(p) not in market.files for _, p in run_files(run_dir))]
+    for run_dir in new_runs:
+        market.add_run(run_dir)
+    if new_runs and path:
+        market.save(path)
+    return market, len(new_runs)
+
+def grouped_percentiles(codes, values, groups, pcts):
+    """Percentiles of values per group code, skipping NaNs
+
+    Returns (groups x len(pcts) array, counts) using the same linear
+    interpolation as np.percentile.
+    """
+    keep = ~np.isnan(values)
+    codes, values = codes[keep], values[keep]
+    order = np.lexsort((values, codes))
+    values = values[order]
+    counts = np.bincount(codes, minlength=groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    out = np.full((groups, len(pcts)), np.nan)
+    has = counts > 0
+    for j, pct in enumerate(pcts):
+        position = starts[has] + (counts[has] - 1) * (pct / 100)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        out[has, j] = values[low] + (values[high] - values[low]) * (position - low)
+    return out, counts
+
+def group_codes(table, by):
+    """Group code of every row and the label of each group"""
+    if by == "none":
+        return np.zeros(len(table), dtype=np.int64), ["All"]
+    if by in GROUP_COLUMNS:
+        return table[by].astype(np.int64), [str(label) for label in table.labels[by]]
+    # Every neighbourhood and property type pair that occurs
+    types = len(table.labels["property_type"])
+    pairs, codes = np.unique(table["neighborhood"].astype(np.int64) * types + table["property_type"], return_inverse=True)
+    labels = [f"{table.labels['neighborhood'][p // types]} / {table.labels['property_type'][p % types]}" for p in pairs]
+    return codes.ravel(), labels
+
+def by_label(table, by, values, pcts):
+    """{group label: (count, percentiles)} of values"""
+    codes, labels = group_codes(table, by)
+    stats, counts = grouped_percentiles(codes, values, len(labels), pcts)
+    return {label: (int(counts[i]), stats[i]) for i, label in enumerate(labels)}
+
+def list_to_sale(market, sold):
+    """Sold price as a percentage of each sold listing's last asking price (NaN if it was never seen for sale)"""
+    asks = market.tables["asks"]
+    ratio = np.full(len(sold), np.nan)
+    if not len(asks) or not len(sold):
+        return ratio
+    position = np.minimum(np.searchsorted(asks["key"], sold["key"]), len(asks) - 1)
+    matched = (asks["key"][position] == sold["key"]) & (asks["price"][position] > 0)
+    ratio[matched] = sold["price"][matched] / asks["price"][position][matched] * 100
+    return ratio
+
+def recent(table, newest, months):
+    """Rows dated within `months` months of the newest run"""
+    since = np.datetime64(datetime.utcfromtimestamp(newest).date(), "M") - (months - 1)
+    return table.take(table["date"].astype("datetime64[M]") >= since)
+
+def summary_rows(market, by, months, min_count):
+    """Per group: inventory and asking price, sold prices, $/sqft, list-to-sale ratio and expireds"""
+    active = market.active
+    sold = recent(market.tables["sold"], market.newest, months)
+    expired = recent(market.tables["expired"], market.newest, months)
+    asking = by_label(active, by, active["price"], (50,))
+    prices = by_label(sold, by, sold["price"], (25, 50, 75))
+    per_sqft = by_label(sold, by, sold["price"] * 1000 / sold["sqft"], (50,))
+    ratios = by_label(sold, by, list_to_sale(market, sold), (50,))
+    expireds = by_label(expired, by, expired["price"], (50,))
+
+    rows = []
+    for label in set(asking) | set(prices) | set(expireds):
+        listed, ask = asking.get(label, (0, [np.nan]))
+        sales, (p25, p50, p75) = prices.get(label, (0, [np.nan] * 3))
+        _, (sqft,) = per_sqft.get(label, (0, [np.nan]))
+        matched, (ratio,) = ratios.get(label, (0, [np.nan]))
+        expired_count, _ = expireds.get(label, (0, None))
+        if max(listed, sales, expired_count) < min_count:
+            continue
+        rows.append([label, listed, ask[0], sales, p25, p50, p75, sqft, ratio, matched, expired_count])
+    rows.sort(key=lambda r: (-r[3], -r[1], r[0]))
+    return ["group", "active", "ask_p50_k", "sold", "sold_p25_k", "sold_p50_k", "sold_p75_k",
+            "per_sqft_p50", "sale_to_list_pct", "ratio_n", "expired"], rows
+
+def trend_rows(market, by, months, rolling, min_count):
+    """Per group and month: sales, median sold price and $/sqft over the trailing `rolling` months"""
+    sold = market.tables["sold"]
+    month = sold["date"].astype("datetime64[M]")
+    codes, labels = group_codes(sold, by)
+    values = np.column_stack([sold["price"], sold["price"] * 1000 / sold["sqft"]])
+    last = np.datetime64(datetime.utcfromtimestamp(market.newest).date(), "M")
+    rows = []
+    for end in np.arange(last - (months - 1), last + 1):
+        window = (month > end - rolling) & (month <= end)
+        prices, counts = grouped_percentiles(codes[window], values[window, 0], len(labels), (50,))
+        per_sqft, _ = grouped_percentiles(codes[window], values[window, 1], len(labels), (50,))
+        for i in np.flatnonzero(counts >= max(min_count, 1)):
+            rows.append([labels[i], str(end), int(counts[i]), prices[i, 0], per_sqft[i, 0]])
+    rows.sort(key=lambda r: (r[0], r[1]))
+    return ["group", "month", "sold", "sold_p50_k", "per_sqft_p50"], rows
+
+def print_table(header, rows, as_csv=False):
+    if as_csv:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(header)
+        writer.writerows([(round(v, 2) if v == v else "") if isinstance(v, float) else v for v in row] for row in rows)
+        return
+    digits = [1 if name.endswith("_pct") else 0 for name in header]
+    cells = [[f"{v:.{d}f}" if isinstance(v, float) and v == v else "-" if isinstance(v, float) else str(v)
+              for v, d in zip(row, digits)] for row in rows]
+    widths = [max([len(h)] + [len(row[i]) for row in cells]) for i, h in enumerate(header)]
+    print("  ".join(h.ljust(w) if i == 0 else h.rjust(w) for i, (h, w) in enumerate(zip(header, widths))))
+    for row in cells:
+        print("  ".join(v.ljust(w) if i == 0 else v.rjust(w) for i, (v, w) in enumerate(zip(row, widths))))
+
+def run(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--runs", nargs="+", metavar="DIR",
+                        help=f"run directories to include (default: every {RUNS_GLOB})")
+    common.add_argument("--no-cache", action="store_true",
+                        help=f"rebuild the merged tables instead of reusing {CACHE_DIR}/")
+    common.add_argument("--csv", action="store_true", help="print CSV instead of a table")
+    parser = argparse.ArgumentParser(description="Market statistics over scraped runs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary = commands.add_parser("summary", parents=[common],
+                                  help="prices, $/sqft, list-to-sale ratios and counts per group")
+    summary.add_argument("--months", type=int, default=12, help="solds and expireds from the last N months (default: 12)")
+    trend = commands.add_parser("trend", parents=[common], help="monthly sold prices and $/sqft per group")
+    trend.add_argument("--months", type=int, default=12, help="months to report (default: 12)")
+    trend.add_argument("--rolling", type=int, default=1, help="months in each trailing window (default: 1)")
+    for command, default in ((summary, "neighborhood"), (trend, "none")):
+        command.add_argument("--by", choices=["none", "neighborhood", "property_type", "both"], default=default,
+                             help=f"what to group by (default: {default})")
+        command.add_argument("--min-count", type=int, default=5,
+                             help="leave out groups with fewer listings than this (default: 5)")
+    args = parser.parse_args(argv)
+
+    if np is None:
+        print("ERROR: statistics need numpy: pip install 'vancouver-real-estate-scraper[stats]'")
+        exit(1)
+    run_dirs = [run_dir for run_dir in sorted(args.runs or glob.glob(RUNS_GLOB)) if run_files(run_dir)]
+    if not run_dirs:
+        print("ERROR: no run directories with listing CSVs to analyse")
+        exit(1)
+
+    started = time.perf_counter()
+    market, added = load_market(run_dirs, None if args.no_cache else CACHE_DIR)
+    loaded = time.perf_counter() - started
+    started = time.perf_counter()
+    if args.command == "summary":
+        header, rows = summary_rows(market, args.by, args.months, args.min_count)
+    else:
+        header, rows = trend_rows(market, args.by, args.months, args.rolling, args.min_count)
+    aggregated = time.perf_counter() - started
+    print_table(header, rows, args.csv)
+    if not args.csv:
+        print(f"\n{len(run_dirs)} runs ({added} newly merged) in {loaded:.2f}s, "
+              f"{len(market.tables['sold'])} solds, {len(market.tables['expired'])} expireds, "
+              f"{len(market.active)} for sale, aggregated in {aggregated * 1000:.0f}ms")
+
+if __name__ == "__main__":
+    sys.exit(run())
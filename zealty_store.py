@@ -0,0 +1,106 @@
+"""SQLite store of listings across runs
+
+`listings` holds the latest version of every (MLS number, category) pair ever
+seen. `history` is written by triggers: one 'new' event the first time a pair
+appears (so an active -> sold transition shows up as a new 'sold' event) and
+one 'price' event whenever its price changes.
+"""
+import sqlite3
+from datetime import date
+
+from zealty_listing import COLUMNS, FIELDS, SCHEMA
+
+# Column names in the database, in COLUMNS order
+DB_COLUMNS = FIELDS
+
+SQL_TYPES = {"string": "TEXT", "date32": "TEXT", "float64": "REAL", "int16": "INTEGER", "int32": "INTEGER"}
+
+def _schema_sql():
+    columns = ",\n    ".join(
+        f"{name} {SQL_TYPES[SCHEMA[col][0]]}" for name, col in zip(DB_COLUMNS[1:], COLUMNS[1:])
+    )
+    return f"""
+CREATE TABLE IF NOT EXISTS listings (
+    mls_number TEXT NOT NULL,
+    category TEXT NOT NULL,
+    {columns},
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    PRIMARY KEY (mls_number, category)
+);
+CREATE INDEX IF NOT EXISTS listings_neighborhood ON listings (neighborhood);
+CREATE INDEX IF NOT EXISTS listings_date ON listings (date);
+
+CREATE TABLE IF NOT EXISTS history (
+    mls_number TEXT NOT NULL,
+    category TEXT NOT NULL,
+    event TEXT NOT NULL,
+    observed TEXT NOT NULL,
+    price REAL,
+    previous_price REAL
+);
+CREATE INDEX IF NOT EXISTS history_mls ON history (mls_number, observed);
+CREATE INDEX IF NOT EXISTS history_observed ON history (observed);
+
+CREATE TRIGGER IF NOT EXISTS listings_new AFTER INSERT ON listings
+BEGIN
+    INSERT INTO history (mls_number, category, event, observed, price)
+    VALUES (NEW.mls_number, NEW.category, 'new', NEW.last_seen, NEW.price);
+END;
+
+CREATE TRIGGER IF NOT EXISTS listings_price AFTER UPDATE OF price ON listings
+WHEN NEW.price IS NOT OLD.price
+BEGIN
+    INSERT INTO history (mls_number, category, event, observed, price, previous_price)
+    VALUES (NEW.mls_number, NEW.category, 'price', NEW.last_seen, NEW.price, OLD.price);
+END;
+"""
+
+def _upsert_sql():
+    names = ", ".join(["category"] + DB_COLUMNS + ["first_seen", "last_seen"])
+    placeholders = ", ".join("?" * (len(DB_COLUMNS) + 3))
+    updates = ", ".join(f"{name} = excluded.{name}" for name in DB_COLUMNS[1:] + ["last_seen"])
+    return (f"INSERT INTO listings ({names}) VALUES ({placeholders}) "
+            f"ON CONFLICT (mls_number, category) DO UPDATE SET {updates}")
+
+class ListingStore:
+    """Upserts scraped rows into a SQLite database, one transaction per batch"""
+
+    def __init__(self, path, observed):
+        self.path = path
+        self.observed = observed
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_schema_sql())
+        self._upsert = _upsert_sql()
+
+    def _values(self, category, row):
+        values = [category]
+        values += [value.isoformat() if type(value) is date else value for value in row]
+        values += [self.observed, self.observed]
+        return values
+
+    def upsert(self, category, rows):
+        """Insert or update Listings for a category"""
+        with self.conn:
+            self.conn.executemany(self._upsert, (self._values(category, row) for row in rows if row.mls_number))
+
+    def close(self):
+        self.conn.close()
+
+def price_history(conn, mls_number):
+    """Every recorded event for one MLS number, oldest first"""
+    return conn.execute(
+        "SELECT observed, category, event, price, previous_price FROM history "
+        "WHERE mls_number = ? ORDER BY observed", (mls_number,)
+    ).fetchall()
+
+def price_changes(conn, neighborhood, since):
+    """Price changes since a date for listings whose neighbourhood matches a LIKE pattern"""
+    return conn.execute(
+        "SELECT h.observed, h.mls_number, l.address, h.previous_price, h.price FROM history h "
+        "JOIN listings l ON l.mls_number = h.mls_number AND l.category = h.category "
+        "WHERE h.event = 'price' AND h.observed >= ? AND l.neighborhood LIKE ? "
+        "ORDER BY h.observed", (since, neighborhood)
+    ).fetchall()